@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import decimal
+import os
+import random
+import sys
+
+
+# Generator of synthetic books.
+#
+# Writes a valid book in the syntax of the ledger, with random (but
+# reproducible, for a given seed) contents: asset accounts in several
+# currencies, a credit card, equity accounts with brokerage cash accounts,
+# expenses, revenues, transfers (including multi-currency ones, with rates),
+# purchases and sales of shares (with fees), dividends, share prices, and
+# exchange rates. The book is split into a tree of files: the main file opens
+# the accounts and includes a file for each year, which includes a file for
+# each month.
+#
+# Usage:
+#
+#   python3 bench/generate.py ./book
+#   python3 bench/generate.py --postings 100000 --years 5 ./book
+#   maelkum-ledger ./book/main.ledger
+
+DEFAULT_CURRENCIES = ('PLN', 'EUR', 'USD', 'CHF',)
+COMPANIES = ('ACME', 'GLOBEX', 'INITECH', 'UMBRELLA', 'HOOLI', 'VANDELAY',)
+SINKS = tuple('SHOP {}'.format(i) for i in range(200))
+FAUCETS = ('EMPLOYER', 'CLIENT A', 'CLIENT B', 'CLIENT C', 'BANK',)
+
+# Average number of postings of a transaction, used to guess how many
+# transactions a day there must be to reach the requested number of postings.
+POSTINGS_PER_TX = 2
+
+CENT = decimal.Decimal('0.01')
+FOURTH = decimal.Decimal('0.0001')
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog = 'generate.py',
+        description = 'Generate a synthetic book.',
+    )
+    parser.add_argument('directory',
+        help = 'directory to write the book to (main.ledger is its main file)',
+    )
+    parser.add_argument('--accounts',
+        type = int,
+        default = 8,
+        help = 'number of asset accounts (default: 8)',
+    )
+    parser.add_argument('--equity-accounts',
+        type = int,
+        default = 2,
+        help = 'number of equity accounts (default: 2)',
+    )
+    parser.add_argument('--currencies',
+        default = ','.join(DEFAULT_CURRENCIES),
+        help = 'comma-separated currencies, the first one is the default'
+            ' (default: {})'.format(','.join(DEFAULT_CURRENCIES)),
+    )
+    parser.add_argument('--years',
+        type = int,
+        default = 3,
+        help = 'number of years the book spans, ending today (default: 3)',
+    )
+    parser.add_argument('--per-day',
+        type = float,
+        default = 3,
+        help = 'average number of transactions a day (default: 3)',
+    )
+    parser.add_argument('--postings',
+        type = int,
+        default = None,
+        help = 'number of postings to generate; overrides --per-day',
+    )
+    parser.add_argument('--seed',
+        type = int,
+        default = 0,
+        help = 'seed of the random number generator (default: 0)',
+    )
+    return parser.parse_args(args)
+
+
+def cents(rng, low, high):
+    return (decimal.Decimal(rng.randint(int(low * 100), int(high * 100))) * CENT)
+
+def stamp(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M')
+
+def new_state(rng, currencies, n_accounts, n_equity):
+    default_currency = currencies[0]
+    state = {
+        'rng': rng,
+        'default_currency': default_currency,
+        'currencies': currencies,
+        'assets': [],
+        'liabilities': [('card', default_currency,)],
+        'equity': [],
+        'rates': {
+            each: decimal.Decimal(rng.uniform(0.5, 5)).quantize(FOURTH)
+            for each in currencies[1:]
+        },
+        'prices': {
+            each: decimal.Decimal(rng.uniform(10, 500)).quantize(CENT)
+            for each in COMPANIES
+        },
+        # Shares held by each equity account, so that only held shares are
+        # sold, and dividends are only paid for held shares.
+        'held': {},
+        'postings': 0,
+        'records': 0,
+    }
+    for i in range(n_accounts):
+        currency = currencies[i % len(currencies)]
+        state['assets'].append(('bank.{}'.format(i), currency,))
+
+    # Shares are bought with money kept on a cash account at the broker, in
+    # the currency of the equity account.
+    equity_currency = (currencies[2] if len(currencies) > 2 else default_currency)
+    for i in range(n_equity):
+        name = 'broker.{}'.format(i)
+        state['equity'].append((name, equity_currency,))
+        state['assets'].append((name + '.cash', equity_currency,))
+        state['held'][name] = {}
+    return state
+
+def record(state, lines, postings):
+    state['records'] += 1
+    state['postings'] += postings
+    return '\n'.join(lines)
+
+def open_accounts(state, moment):
+    out = []
+    kinds = (
+        ('asset', state['assets'],),
+        ('liability', state['liabilities'],),
+        ('equity', state['equity'],),
+    )
+    for kind, accounts in kinds:
+        for name, currency in accounts:
+            out.append(record(state, [
+                'open account {} {} {}'.format(stamp(moment), kind, name),
+                '    balance: 0.00 {}'.format(currency),
+                'with',
+                '    overview',
+                'end',
+            ], 0))
+    return out
+
+def exchange_rates(state, moment):
+    rng = state['rng']
+    lines = ['currency_rates {}'.format(stamp(moment))]
+    for currency, rate in state['rates'].items():
+        rate = (rate * decimal.Decimal(rng.uniform(0.98, 1.02))).quantize(FOURTH)
+        state['rates'][currency] = rate
+        lines.append('    {}/{} {}'.format(
+            currency,
+            state['default_currency'],
+            rate,
+        ))
+    lines.append('end')
+    return record(state, lines, 0)
+
+def own_account(state):
+    rng = state['rng']
+    choices = [('asset', name, c,) for name, c in state['assets']]
+    choices += [('liability', name, c,) for name, c in state['liabilities']]
+    return rng.choice(choices)
+
+def expense(state, moment):
+    rng = state['rng']
+    kind, name, currency = own_account(state)
+    lines = ['ex {}'.format(stamp(moment))]
+    lines.append('    {}/{} -{} {}'.format(kind, name, cents(rng, 1, 200), currency))
+    postings = 2
+    # Some expenses are split between two accounts.
+    if rng.random() < 0.05:
+        kind, name, currency = own_account(state)
+        lines.append('    {}/{} -{} {}'.format(kind, name, cents(rng, 1, 50), currency))
+        postings += 1
+    lines.append('    {}'.format(rng.choice(SINKS)))
+    lines.append('end')
+    return record(state, lines, postings)
+
+def revenue(state, moment):
+    rng = state['rng']
+    kind, name, currency = own_account(state)
+    while kind != 'asset' or name.endswith('.cash'):
+        kind, name, currency = own_account(state)
+    return record(state, [
+        'rx {}'.format(stamp(moment)),
+        '    {}'.format(rng.choice(FAUCETS)),
+        '    asset/{} {} {}'.format(name, cents(rng, 100, 10000), currency),
+        'end',
+    ], 2)
+
+def transfer(state, moment):
+    rng = state['rng']
+    src_kind, src, src_currency = own_account(state)
+    dst_kind, dst, dst_currency = own_account(state)
+    if (src_kind, src,) == (dst_kind, dst,):
+        return None
+
+    value = cents(rng, 10, 2000)
+    lines = [
+        'tx {}'.format(stamp(moment)),
+        '    {}/{} -{} {}'.format(src_kind, src, value, src_currency),
+    ]
+    if src_currency == dst_currency:
+        lines.append('    {}/{} {} {}'.format(dst_kind, dst, value, dst_currency))
+        lines.append('end')
+        return record(state, lines, 2)
+
+    # Multi-currency transfers are recorded with the rate used.
+    default_currency = state['default_currency']
+    def in_default(currency):
+        if currency == default_currency:
+            return decimal.Decimal(1)
+        return state['rates'][currency]
+    rate = (in_default(src_currency) / in_default(dst_currency)).quantize(FOURTH)
+    if not rate:
+        return None
+    lines.append('    {}/{} {} {}'.format(
+        dst_kind,
+        dst,
+        (value * rate).quantize(CENT),
+        dst_currency,
+    ))
+    lines.append('with')
+    lines.append('    rate: {}/{} {}'.format(dst_currency, src_currency, (1 / rate).quantize(FOURTH)))
+    lines.append('end')
+    return record(state, lines, 2)
+
+def trade(state, moment):
+    rng = state['rng']
+    if not state['equity']:
+        return None
+    name, currency = rng.choice(state['equity'])
+    held = state['held'][name]
+    company = rng.choice(COMPANIES)
+    price = state['prices'][company]
+    price = (price * decimal.Decimal(rng.uniform(0.95, 1.05))).quantize(CENT)
+    state['prices'][company] = price
+
+    if held.get(company) and rng.random() < 0.3:
+        no = rng.randint(1, held[company])
+        held[company] -= no
+        value = (price * no)
+        return record(state, [
+            'tx {}'.format(stamp(moment)),
+            '    equity/{} -{} {}'.format(name, value, currency),
+            '    asset/{}.cash {} {}'.format(name, value, currency),
+            'with',
+            '    shares: {} -{}'.format(company, no),
+            'end',
+        ], 2)
+
+    no = rng.randint(1, 20)
+    held[company] = (held.get(company, 0) + no)
+    value = (price * no)
+    fee = cents(rng, 1, 5)
+    return record(state, [
+        'tx {}'.format(stamp(moment)),
+        '    asset/{}.cash -{} {}'.format(name, (value + fee), currency),
+        '    equity/{} {} {}'.format(name, value, currency),
+        'with',
+        '    shares: {} {}'.format(company, no),
+        '    fee: -{} {}'.format(fee, currency),
+        'end',
+    ], 2)
+
+def month_end(state, moment):
+    """Produce records closing a month: dividends and share prices of held
+    companies, and exchange rates.
+    """
+    rng = state['rng']
+    out = []
+    for name, currency in state['equity']:
+        prices = []
+        for company, no in sorted(state['held'][name].items()):
+            if not no:
+                continue
+            if rng.random() < 0.3:
+                out.append(record(state, [
+                    'dividend {}'.format(stamp(moment)),
+                    '    equity/{} {}'.format(name, company),
+                    '    asset/{}.cash {} {}'.format(
+                        name,
+                        (cents(rng, 0.1, 2) * no).quantize(CENT),
+                        currency,
+                    ),
+                    'end',
+                ], 2))
+            prices.append('    equity/{} {} {} {}'.format(
+                name,
+                company,
+                state['prices'][company],
+                currency,
+            ))
+        if prices:
+            out.append(record(state,
+                ['balance {}'.format(stamp(moment))] + prices + ['end'],
+                0,
+            ))
+    if len(state['currencies']) > 1:
+        out.append(exchange_rates(state, moment))
+    return out
+
+KINDS = (
+    (expense, 0.72,),
+    (revenue, 0.06,),
+    (transfer, 0.14,),
+    (trade, 0.08,),
+)
+
+def day_of_transactions(state, day, per_day):
+    rng = state['rng']
+    out = []
+    # Number of transactions of a day varies around the average.
+    n = int(per_day)
+    if rng.random() < (per_day - n):
+        n += 1
+    n = rng.randint(0, 2 * n) if n else 0
+    for _ in range(n):
+        moment = datetime.datetime.combine(day, datetime.time(
+            rng.randint(6, 22),
+            rng.randint(0, 59),
+        ))
+        generator = rng.choices(
+            [each for each, _ in KINDS],
+            weights = [w for _, w in KINDS],
+        )[0]
+        item = generator(state, moment)
+        if item is not None:
+            out.append(item)
+    return out
+
+def write_file(path, chunks):
+    with open(path, 'w') as ofstream:
+        for each in chunks:
+            ofstream.write(each)
+            ofstream.write('\n')
+
+def generate(directory, accounts = 8, equity_accounts = 2,
+        currencies = DEFAULT_CURRENCIES, years = 3, per_day = 3, postings = None,
+        seed = 0):
+    """Write a synthetic book to a directory.
+
+    Returns a dict with the path of the main file of the book, and the numbers
+    of files, records, and postings written.
+    """
+    rng = random.Random(seed)
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok = True)
+
+    today = datetime.date.today()
+    first_day = (today - datetime.timedelta(days = (365 * years) - 1))
+    if postings is not None:
+        days = (today - first_day).days + 1
+        per_day = (postings / POSTINGS_PER_TX / days)
+
+    state = new_state(rng, list(currencies), accounts, equity_accounts)
+    beginning = datetime.datetime.combine(first_day, datetime.time(0, 0))
+
+    main = ['set default-currency {}'.format(state['default_currency'])]
+    main.extend(open_accounts(state, beginning))
+    if len(currencies) > 1:
+        main.append(exchange_rates(state, beginning))
+
+    files = 1
+    day = first_day
+    one_day = datetime.timedelta(days = 1)
+    year_files = {}
+    while day <= today:
+        if postings is not None and state['postings'] >= postings:
+            break
+
+        month = []
+        this_month = (day.year, day.month,)
+        while day <= today and (day.year, day.month,) == this_month:
+            month.extend(day_of_transactions(state, day, per_day))
+            day += one_day
+        month.extend(month_end(state, datetime.datetime.combine(
+            day - one_day,
+            datetime.time(23, 59),
+        )))
+
+        month_path = os.path.join(directory, '{:04}-{:02}.ledger'.format(*this_month))
+        write_file(month_path, month)
+        files += 1
+
+        year_path = os.path.join(directory, '{:04}.ledger'.format(this_month[0]))
+        if year_path not in year_files:
+            year_files[year_path] = []
+            main.append('include {}'.format(year_path))
+        year_files[year_path].append('include {}'.format(month_path))
+
+    for path, includes in year_files.items():
+        write_file(path, includes)
+        files += 1
+
+    main_path = os.path.join(directory, 'main.ledger')
+    write_file(main_path, main)
+
+    return {
+        'path': main_path,
+        'files': files,
+        'records': state['records'],
+        'postings': state['postings'],
+    }
+
+def main(args):
+    args = parse_args(args)
+    summary = generate(
+        args.directory,
+        accounts = args.accounts,
+        equity_accounts = args.equity_accounts,
+        currencies = args.currencies.split(','),
+        years = args.years,
+        per_day = args.per_day,
+        postings = args.postings,
+        seed = args.seed,
+    )
+    print('{}: {} files, {} records, {} postings'.format(
+        summary['path'],
+        summary['files'],
+        summary['records'],
+        summary['postings'],
+    ))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ledger
+
+
+# Memory benchmark.
+#
+# Loads a book (a real one, or a generated one, see bench/generate.py) and runs
+# the stages of processing one by one: loading lines, parsing (and indexing),
+# sorting, setting up accounts, building rollups, and calculating balances and
+# equity values. After each stage the following are reported:
+#
+#   - peak resident set size of the process
+#   - current and peak memory allocated by Python (as traced by tracemalloc)
+#   - live objects created since the book started loading, by type (and the
+#     module defining the type), with their counts and sizes
+#
+# Sizes of objects are shallow, except that attribute dicts of instances are
+# counted as part of the instances. Objects which the garbage collector does not
+# track (eg, strings, Decimal amounts, datetimes) are found through the objects
+# referring to them.
+#
+# The benchmark fails (ie, exits with a non-zero code) if the memory retained
+# after the last stage, divided by the number of postings in the book, exceeds
+# the budget.
+#
+# Usage:
+#
+#   python3 bench/memory.py path/to/main.ledger
+#   python3 bench/memory.py --postings 100000 --budget 4096
+
+DEFAULT_BUDGET = 4096
+DEFAULT_TOP = 12
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog = 'memory.py',
+        description = 'Measure memory used by the ledger.',
+    )
+    parser.add_argument('book',
+        nargs = '?',
+        default = None,
+        help = 'main file of the book (default: generate a book)',
+    )
+    parser.add_argument('--postings',
+        type = int,
+        default = 10000,
+        help = 'number of postings of a generated book (default: 10000)',
+    )
+    parser.add_argument('--budget',
+        metavar = 'BYTES',
+        type = int,
+        default = DEFAULT_BUDGET,
+        help = 'budget of retained bytes per posting (default: {})'.format(
+            DEFAULT_BUDGET),
+    )
+    parser.add_argument('--top',
+        type = int,
+        default = DEFAULT_TOP,
+        help = 'number of types of objects to list after each stage'
+            ' (default: {})'.format(DEFAULT_TOP),
+    )
+    parser.add_argument('--output', '-o',
+        metavar = 'FILE',
+        default = None,
+        help = 'file to write results to, as JSON',
+    )
+    return parser.parse_args(args)
+
+
+def peak_rss():
+    # Linux reports the peak in kilobytes, macOS in bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak if sys.platform == 'darwin' else (peak * 1024))
+
+def type_name(kind):
+    return '{}.{}'.format(kind.__module__, kind.__qualname__)
+
+def attributes_of(obj):
+    try:
+        attributes = object.__getattribute__(obj, '__dict__')
+    except Exception:
+        return None
+    return (attributes if type(attributes) is dict else None)
+
+def live_objects():
+    """Count live objects, and their sizes, by type.
+
+    Returns a dict mapping names of types to (count, bytes) pairs.
+    """
+    gc.collect()
+    tracked = gc.get_objects()
+
+    # Attribute dicts are counted as parts of their instances.
+    attribute_dicts = set()
+    for each in tracked:
+        attributes = attributes_of(each)
+        if attributes is not None:
+            attribute_dicts.add(id(attributes))
+
+    census = {}
+    def add(obj, size):
+        key = type_name(type(obj))
+        count, total = census.get(key, (0, 0,))
+        census[key] = (count + 1, total + size,)
+
+    untracked = {}
+    def find_untracked(obj):
+        # Containers of only untracked objects (eg, tuples of amounts and
+        # currencies) are untracked too, so their contents are looked into.
+        pending = [obj]
+        while pending:
+            for referent in gc.get_referents(pending.pop()):
+                if gc.is_tracked(referent) or id(referent) in untracked:
+                    continue
+                untracked[id(referent)] = referent
+                pending.append(referent)
+
+    for each in tracked:
+        find_untracked(each)
+        if id(each) in attribute_dicts:
+            continue
+        size = sys.getsizeof(each)
+        attributes = attributes_of(each)
+        if attributes is not None:
+            size += sys.getsizeof(attributes)
+        add(each, size)
+    for each in untracked.values():
+        add(each, sys.getsizeof(each))
+    return census
+
+def census_delta(after, before):
+    delta = {}
+    for key, (count, size) in after.items():
+        count_before, size_before = before.get(key, (0, 0,))
+        if count > count_before:
+            delta[key] = (count - count_before, size - size_before,)
+    return delta
+
+def format_bytes(n):
+    return ledger.timing.format_bytes(n)
+
+def new_measurement(stage, census, baseline):
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        'stage': stage,
+        'rss_peak': peak_rss(),
+        'traced_current': current,
+        'traced_peak': peak,
+        'objects': census_delta(census, baseline),
+    }
+
+def print_measurement(measurement, top):
+    print('after {}:'.format(measurement['stage']))
+    print('  peak RSS:       {:>12}'.format(format_bytes(measurement['rss_peak'])))
+    print('  traced memory:  {:>12} (peak {})'.format(
+        format_bytes(measurement['traced_current']),
+        format_bytes(measurement['traced_peak']),
+    ))
+    objects = sorted(
+        measurement['objects'].items(),
+        key = lambda each: each[1][1],
+        reverse = True,
+    )
+    for name, (count, size) in objects[:top]:
+        print('  {:>12}  {:>10} objects  {}'.format(
+            format_bytes(size),
+            count,
+            name,
+        ))
+    print()
+
+def count_postings(book_ir):
+    return sum(
+        (len(each.ins) + len(each.outs))
+        for each in book_ir
+        if isinstance(each, ledger.ir.Transaction_record)
+    )
+
+def measure(book_path, top):
+    """Run stages of processing of a book, measuring memory after each of them.
+    """
+    # Modules of the ledger are imported lazily, and must not be counted as
+    # memory used by the stage which first used them.
+    for each in ('loader', 'parser', 'index', 'book', 'rollup', 'currency',
+            'prices',):
+        importlib.import_module('ledger.' + each)
+
+    measurements = []
+    tracemalloc.start()
+    baseline = live_objects()
+    traced_baseline, _ = tracemalloc.get_traced_memory()
+
+    def after(stage):
+        measurements.append(new_measurement(stage, live_objects(), baseline))
+        print_measurement(measurements[-1], top)
+        tracemalloc.reset_peak()
+
+    book_lines = ledger.loader.load(book_path)
+    after('load')
+
+    index = ledger.index.new_index()
+    book_ir = ledger.parser.parse(book_lines, index = index)
+    after('parse')
+
+    book_ir = sorted(book_ir, key = ledger.book.sorting_key)
+    ledger.index.finish(index, book_ir)
+    del book_lines
+    after('sort')
+
+    default_currency = 'EUR'
+    for each in book_ir:
+        if type(each) is ledger.ir.Configuration_line:
+            if each.key == 'default-currency':
+                default_currency = str(each.value)
+
+    accounts = ledger.book.new_accounts()
+    ledger.book.setup_accounts(accounts, book_ir)
+    after('setup accounts')
+
+    currency_basket = ledger.book.new_currency_basket()
+    currency_basket['rollup'] = ledger.rollup.build(book_ir)
+    after('rollup')
+
+    book = (book_ir, currency_basket,)
+    ledger.book.calculate_balances(accounts, book, default_currency)
+    after('calculate balances')
+
+    ledger.book.calculate_equity_values(accounts, book, default_currency)
+    after('calculate equity values')
+
+    retained = (measurements[-1]['traced_current'] - traced_baseline)
+    postings = count_postings(book_ir)
+    tracemalloc.stop()
+    return {
+        'book': book_path,
+        'records': len(book_ir),
+        'postings': postings,
+        'retained': retained,
+        'bytes_per_posting': (retained / postings if postings else None),
+        'stages': measurements,
+    }
+
+def main(args):
+    args = parse_args(args)
+
+    scratch = None
+    book_path = args.book
+    if book_path is None:
+        scratch = tempfile.mkdtemp(prefix = 'ledger-bench-')
+        book_path = generate.generate(scratch, postings = args.postings)['path']
+
+    try:
+        result = measure(book_path, args.top)
+    finally:
+        if scratch is not None:
+            shutil.rmtree(scratch)
+
+    print('records:            {}'.format(result['records']))
+    print('postings:           {}'.format(result['postings']))
+    print('retained memory:    {}'.format(format_bytes(result['retained'])))
+    if result['bytes_per_posting'] is not None:
+        print('bytes per posting:  {:.0f} (budget {})'.format(
+            result['bytes_per_posting'],
+            args.budget,
+        ))
+
+    if args.output is not None:
+        with open(args.output, 'w') as ofstream:
+            json.dump(result, ofstream, indent = 2)
+            ofstream.write('\n')
+
+    if (result['bytes_per_posting'] or 0) > args.budget:
+        print('over the budget of {} bytes per posting'.format(args.budget))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import generate
+
+
+# Scaling benchmark.
+#
+# Generates synthetic books of increasing sizes (see bench/generate.py) and runs
+# the ledger on each of them, without the cache, timing every stage of
+# processing: loading, parsing, sorting, calculating balances and equity values,
+# and computing and rendering each report. Times are taken from the trace
+# written by the ledger (see the --trace option), and medians of several runs
+# are written as JSON, so results can be compared across commits.
+#
+# Usage:
+#
+#   python3 bench/scaling.py --output before.json
+#   python3 bench/scaling.py --sizes 10k,100k --runs 5 --output after.json
+#
+# Generated books are removed after the benchmark, unless a directory to keep
+# them in is given with --books. Books found there are reused.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UI = os.path.join(ROOT, 'ui.py')
+
+DEFAULT_SIZES = '10k,100k,1M'
+DEFAULT_RUNS = 3
+
+
+def parse_size(s):
+    multipliers = { 'k': 1000, 'M': 1000000, }
+    try:
+        if s[-1] in multipliers:
+            return int(float(s[:-1]) * multipliers[s[-1]])
+        return int(s)
+    except (ValueError, IndexError):
+        raise argparse.ArgumentTypeError('invalid size: {}'.format(s))
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog = 'scaling.py',
+        description = 'Measure how the ledger scales with the size of a book.',
+    )
+    parser.add_argument('--sizes',
+        type = lambda s: [parse_size(each) for each in s.split(',')],
+        default = DEFAULT_SIZES,
+        help = 'comma-separated numbers of postings (default: {})'.format(
+            DEFAULT_SIZES),
+    )
+    parser.add_argument('--runs',
+        type = int,
+        default = DEFAULT_RUNS,
+        help = 'number of runs for each size (default: {})'.format(
+            DEFAULT_RUNS),
+    )
+    parser.add_argument('--jobs', '-j',
+        type = int,
+        default = 1,
+        help = 'number of processes computing reports (default: 1)',
+    )
+    parser.add_argument('--years',
+        type = int,
+        default = 5,
+        help = 'number of years generated books span (default: 5)',
+    )
+    parser.add_argument('--seed',
+        type = int,
+        default = 0,
+        help = 'seed of the generator of books (default: 0)',
+    )
+    parser.add_argument('--books',
+        metavar = 'DIR',
+        default = None,
+        help = 'directory to keep generated books in, and reuse them from',
+    )
+    parser.add_argument('--output', '-o',
+        metavar = 'FILE',
+        default = None,
+        help = 'file to write results to (default: standard output)',
+    )
+    return parser.parse_args(args)
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd = ROOT,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.DEVNULL,
+            text = True,
+            check = True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def book_of_size(books, postings, years, seed):
+    directory = os.path.join(books, 'book-{}-{}y-{}'.format(postings, years, seed))
+    main = os.path.join(directory, 'main.ledger')
+    if os.path.exists(main):
+        return { 'path': main, 'postings': postings, }
+    sys.stderr.write('generating a book of {} postings\n'.format(postings))
+    return generate.generate(
+        directory,
+        years = years,
+        postings = postings,
+        seed = seed,
+    )
+
+def run_once(book, jobs, trace_path):
+    """Run the ledger on a book and collect times of its stages from the trace.
+
+    Returns a dict with the total time, times of top-level stages, times of
+    computation and rendering of each report, and counts of processed items.
+    """
+    env = dict(os.environ)
+    env.setdefault('COLUMNS', '120')
+    subprocess.run(
+        [
+            sys.executable, UI, book,
+            '--no-cache',
+            '--jobs', str(jobs),
+            '--trace', trace_path,
+        ],
+        stdout = subprocess.DEVNULL,
+        env = env,
+        check = True,
+    )
+    with open(trace_path) as ifstream:
+        events = json.load(ifstream)['traceEvents']
+
+    run = {
+        'total': None,
+        'stages': {},
+        'reports': {},
+        'counts': {},
+    }
+    for each in events:
+        if each['ph'] != 'X':
+            continue
+        seconds = (each['dur'] / 1000000)
+        args = each['args']
+        if each['name'] == 'total':
+            run['total'] = seconds
+        elif 'report' in args:
+            report = run['reports'].setdefault(args['report'], {})
+            report[args['phase']] = seconds
+        elif each['name'] != 'file':
+            run['stages'][each['name']] = seconds
+            for key, value in args.items():
+                if isinstance(value, int):
+                    run['counts'][key] = max(run['counts'].get(key, 0), value)
+    return run
+
+def median_of(runs):
+    """Combine runs into one result, taking medians of times.
+    """
+    def median(values):
+        values = [each for each in values if each is not None]
+        return (statistics.median(values) if values else None)
+
+    result = {
+        'total': median(each['total'] for each in runs),
+        'stages': {},
+        'reports': {},
+        'counts': runs[0]['counts'],
+    }
+    for name in runs[0]['stages']:
+        result['stages'][name] = median(
+            each['stages'].get(name) for each in runs)
+    for name, phases in runs[0]['reports'].items():
+        result['reports'][name] = {
+            phase: median(each['reports'].get(name, {}).get(phase)
+                for each in runs)
+            for phase in phases
+        }
+    return result
+
+def main(args):
+    args = parse_args(args)
+
+    books = args.books
+    scratch = tempfile.mkdtemp(prefix = 'ledger-bench-')
+    if books is None:
+        books = scratch
+
+    results = []
+    try:
+        for size in args.sizes:
+            book = book_of_size(books, size, args.years, args.seed)
+            trace_path = os.path.join(scratch, 'trace.json')
+            runs = [
+                run_once(book['path'], args.jobs, trace_path)
+                for _ in range(args.runs)
+            ]
+            result = median_of(runs)
+            result['postings'] = size
+            results.append(result)
+            sys.stderr.write('{:>9} postings: {:9.1f} ms\n'.format(
+                size,
+                result['total'] * 1000,
+            ))
+    finally:
+        shutil.rmtree(scratch)
+
+    report = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M'),
+        'runs': args.runs,
+        'jobs': args.jobs,
+        'results': results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent = 2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as ofstream:
+            json.dump(report, ofstream, indent = 2)
+            ofstream.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import argparse
+import decimal
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ledger
+
+
+# Sketch accuracy check.
+#
+# Adds random amounts (shaped like expenses: mostly small, some large, a few
+# negative) to accumulators of statistics (see ledger.util.math) and compares
+# their quantiles with exact quantiles of the sorted amounts. Accumulators are
+# checked as filled one value at a time, merged from parts, and scaled by
+# exchange rates and merged from parts (as statistics of expenses in several
+# currencies are), for counts below and above STATS_EXACT_VALUES.
+#
+# The check fails (ie, exits with a non-zero code) if a quantile of an
+# accumulator holding its values is not exact, or if an estimated quantile is
+# off by more than SKETCH_RELATIVE_ACCURACY.
+#
+# Usage:
+#
+#   python3 bench/sketch.py
+#   python3 bench/sketch.py --rounds 100 --seed 3
+
+QUANTILES = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99,)
+RATES = (
+    decimal.Decimal('4.2770'),
+    decimal.Decimal('1.0000'),
+    decimal.Decimal('0.2338'),
+)
+COUNTS = (1, 2, 7, 100, 256, 257, 1000, 20000,)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog = 'sketch.py',
+        description = 'Check quantiles of statistics against exact ones.',
+    )
+    parser.add_argument('--rounds',
+        type = int,
+        default = 20,
+        help = 'number of random data sets of each size (default: 20)',
+    )
+    parser.add_argument('--seed',
+        type = int,
+        default = 0,
+        help = 'seed of the generator of data (default: 0)',
+    )
+    return parser.parse_args(args)
+
+
+def random_amount(rng):
+    amount = decimal.Decimal(round(rng.lognormvariate(3, 1.5), 2))
+    if rng.random() < 0.05:
+        amount = -amount
+    return amount
+
+def filled(values):
+    stats = ledger.util.math.new_stats()
+    for each in values:
+        ledger.util.math.stats_add(stats, each)
+    return stats
+
+def merged(values, rng):
+    stats = ledger.util.math.new_stats()
+    cuts = sorted(rng.randrange(len(values) + 1) for _ in range(3))
+    for start, end in zip([0] + cuts, cuts + [len(values)]):
+        ledger.util.math.stats_merge(stats, filled(values[start:end]))
+    return stats
+
+def scaled(values, rng):
+    # Values of every part are in another currency, and converted with its
+    # rate, so the expected values are amounts of parts times their rates.
+    stats = ledger.util.math.new_stats()
+    expected = []
+    cuts = sorted(rng.randrange(len(values) + 1) for _ in range(len(RATES) - 1))
+    for rate, start, end in zip(RATES, [0] + cuts, cuts + [len(values)]):
+        part = values[start:end]
+        ledger.util.math.stats_merge(stats,
+            ledger.util.math.stats_scale(filled(part), rate))
+        expected.extend((each * rate) for each in part)
+    return (expected, stats,)
+
+def compare(how, values, stats):
+    mismatches = []
+    exact = (len(values) <= ledger.util.math.STATS_EXACT_VALUES)
+    for q in QUANTILES:
+        want = ledger.util.math.quantile(values, q)
+        got = ledger.util.math.stats_quantile(stats, q)
+        if exact:
+            if got != want:
+                mismatches.append((how, len(values), q, want, got,))
+            continue
+        error = abs(got - want) / abs(want)
+        if error > ledger.util.math.SKETCH_RELATIVE_ACCURACY:
+            mismatches.append((how, len(values), q, want, got,))
+    return mismatches
+
+def check(rounds, seed):
+    rng = random.Random(seed)
+    mismatches = []
+    for count in COUNTS:
+        for _ in range(rounds):
+            values = [random_amount(rng) for _ in range(count)]
+            mismatches.extend(compare('filled', values, filled(values)))
+            mismatches.extend(compare('merged', values, merged(values, rng)))
+            mismatches.extend(compare('scaled', *scaled(values, rng)))
+    return mismatches
+
+def main(args):
+    args = parse_args(args)
+
+    mismatches = check(args.rounds, args.seed)
+
+    print('counts:      {}'.format(', '.join(map(str, COUNTS))))
+    print('quantiles:   {}'.format(', '.join(map(str, QUANTILES))))
+    for how, count, q, want, got in mismatches:
+        print('{}: {} values: {}-quantile: expected {}, got {}'.format(
+            how,
+            count,
+            q,
+            want,
+            got,
+        ))
+    if mismatches:
+        print('{} mismatches'.format(len(mismatches)))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Startup benchmark.
+#
+# Measures how long it takes the ledger to print the first byte of its output,
+# and to finish, when run on a book whose cache is warm. Imports done during
+# startup are measured with "python -X importtime" and the benchmark fails (ie,
+# exits with a non-zero code) if the time spent importing modules exceeds the
+# budget, so that slow imports creeping into the startup path are noticed.
+#
+# Usage:
+#
+#   python3 bench/startup.py path/to/main.ledger
+#   python3 bench/startup.py --runs 20 --budget 50 path/to/main.ledger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UI = os.path.join(ROOT, 'ui.py')
+
+DEFAULT_RUNS = 10
+DEFAULT_BUDGET_MS = 50
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog = 'startup.py',
+        description = 'Measure startup time of the ledger.',
+    )
+    parser.add_argument('book',
+        help = 'main file of the book to report on',
+    )
+    parser.add_argument('--runs',
+        type = int,
+        default = DEFAULT_RUNS,
+        help = 'number of timed runs (default: {})'.format(DEFAULT_RUNS),
+    )
+    parser.add_argument('--budget',
+        type = float,
+        default = DEFAULT_BUDGET_MS,
+        help = 'budget for imports, in milliseconds (default: {})'.format(
+            DEFAULT_BUDGET_MS),
+    )
+    parser.add_argument('--top',
+        type = int,
+        default = 10,
+        help = 'number of slowest imports to list (default: 10)',
+    )
+    return parser.parse_args(args)
+
+def command(book, *flags):
+    return [sys.executable, *flags, UI, book]
+
+def environment():
+    env = dict(os.environ)
+    # The width of the screen must not depend on where the benchmark is run.
+    env.setdefault('COLUMNS', '120')
+    return env
+
+def time_run(book):
+    """Run the ledger once and measure time to the first byte of its output,
+    and time to its completion, in seconds.
+    """
+    began = time.perf_counter()
+    proc = subprocess.Popen(
+        command(book),
+        stdout = subprocess.PIPE,
+        stderr = subprocess.DEVNULL,
+        env = environment(),
+    )
+    proc.stdout.read(1)
+    first_output = (time.perf_counter() - began)
+    proc.stdout.read()
+    proc.wait()
+    done = (time.perf_counter() - began)
+    if proc.returncode != 0:
+        raise RuntimeError('ledger exited with code {}'.format(proc.returncode))
+    return (first_output, done,)
+
+def import_times(book):
+    """Run the ledger with -X importtime and parse its report.
+
+    Returns a list of (module, self microseconds, cumulative microseconds,
+    depth) tuples, in the order in which the interpreter reported them.
+    """
+    proc = subprocess.run(
+        command(book, '-X', 'importtime'),
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.PIPE,
+        env = environment(),
+        text = True,
+        check = True,
+    )
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # The header line.
+            continue
+        name = fields[2].rstrip()
+        depth = ((len(name) - len(name.lstrip())) // 2)
+        imports.append((name.strip(), self_us, cumulative_us, depth,))
+    return imports
+
+def main(args):
+    args = parse_args(args)
+
+    # The first run warms the cache.
+    time_run(args.book)
+
+    first_outputs = []
+    completions = []
+    for _ in range(args.runs):
+        first_output, done = time_run(args.book)
+        first_outputs.append(first_output)
+        completions.append(done)
+
+    def ms(seconds):
+        return '{:8.1f} ms'.format(seconds * 1000)
+
+    print('runs:          {}'.format(args.runs))
+    print('first output:  {} (median)  {} (min)'.format(
+        ms(statistics.median(first_outputs)),
+        ms(min(first_outputs)),
+    ))
+    print('completion:    {} (median)  {} (min)'.format(
+        ms(statistics.median(completions)),
+        ms(min(completions)),
+    ))
+
+    imports = import_times(args.book)
+    # Modules imported at the top level account for all the time spent on
+    # imports, as their cumulative times include imports they triggered.
+    total_us = sum(each[2] for each in imports if each[3] == 0)
+    print('imports:       {} ({} modules)'.format(
+        ms(total_us / 1000000),
+        len(imports),
+    ))
+    print()
+    print('slowest top-level imports (cumulative):')
+    top_level = sorted(
+        (each for each in imports if each[3] == 0),
+        key = lambda each: each[2],
+        reverse = True,
+    )
+    for name, _, cumulative_us, _ in top_level[:args.top]:
+        print('  {}  {}'.format(ms(cumulative_us / 1000000), name))
+
+    if (total_us / 1000) > args.budget:
+        print()
+        print('imports took {:.1f} ms, over the budget of {:.1f} ms'.format(
+            total_us / 1000,
+            args.budget,
+        ))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+
+import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ledger
+
+
+# Valuation check.
+#
+# Loads a book (a real one, or a generated one, see bench/generate.py),
+# calculates balances and equity values the way the equity report does, and
+# values the portfolio after the last record of the book from the price and
+# position histories (see ledger.valuation). Both must agree on every position:
+# the number of shares held, the price of a share, the worth, the amount paid,
+# and the nominal gain. If NumPy is available, the pure Python implementation
+# is checked too.
+#
+# The check fails (ie, exits with a non-zero code) if any figure differs.
+#
+# Usage:
+#
+#   python3 bench/valuation.py path/to/main.ledger
+#   python3 bench/valuation.py --postings 10000 --seed 3
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog = 'valuation.py',
+        description = 'Check that valuation from price histories agrees with'
+            ' the equity report.',
+    )
+    parser.add_argument('book',
+        nargs = '?',
+        default = None,
+        help = 'main file of the book (default: generate a book)',
+    )
+    parser.add_argument('--postings',
+        type = int,
+        default = 10000,
+        help = 'number of postings of a generated book (default: 10000)',
+    )
+    parser.add_argument('--seed',
+        type = int,
+        default = 0,
+        help = 'seed of the generator of books (default: 0)',
+    )
+    return parser.parse_args(args)
+
+
+def load(book_path):
+    book_ir = ledger.parser.parse(ledger.loader.load(book_path))
+    book_ir = sorted(book_ir, key = ledger.book.sorting_key)
+
+    default_currency = 'EUR'
+    for each in book_ir:
+        if type(each) is ledger.ir.Configuration_line:
+            if each.key == 'default-currency':
+                default_currency = str(each.value)
+
+    accounts = ledger.book.new_accounts()
+    ledger.book.setup_accounts(accounts, book_ir)
+    book = (book_ir, ledger.book.new_currency_basket(),)
+    ledger.book.calculate_balances(accounts, book, default_currency)
+    ledger.book.calculate_equity_values(accounts, book, default_currency)
+    return (accounts, book,)
+
+def expected_of(accounts):
+    """Get figures of positions as calculated for the equity report.
+    """
+    expected = {}
+    for name, account in accounts['equity'].items():
+        for company, shares in account['shares'].items():
+            if not shares['shares']:
+                continue
+            expected[(name, company,)] = {
+                'shares': shares['shares'],
+                'prices': shares['price_per_share'],
+                'worth': shares['balance'],
+                'paid': shares['paid'],
+                'gain_nominal': shares['gain']['nominal'],
+            }
+    return expected
+
+def compare(expected, valuation, implementation):
+    mismatches = []
+    for j, column in enumerate(valuation['columns']):
+        want = expected.get(column)
+        if want is None:
+            if valuation['shares'][-1][j]:
+                mismatches.append((implementation, column, 'shares',
+                    0, valuation['shares'][-1][j],))
+            continue
+        for key, value in want.items():
+            got = valuation[key][-1][j]
+            if got != value:
+                mismatches.append((implementation, column, key, value, got,))
+    for column in expected:
+        if column not in valuation['columns']:
+            mismatches.append((implementation, column, 'position',
+                'recorded', 'missing',))
+    return mismatches
+
+def check(book_path):
+    accounts, (book_ir, currency_basket,) = load(book_path)
+    expected = expected_of(accounts)
+
+    # Value the portfolio after the last record, so every price and position
+    # change is taken into account.
+    last = ledger.book.sorting_key(book_ir[-1])
+    dates = [last + datetime.timedelta(minutes = 1)]
+
+    mismatches = []
+    implementations = [('python', ledger.valuation.value_portfolio_python,)]
+    if ledger.valuation.numpy is not None:
+        implementations.append(('numpy', ledger.valuation.value_portfolio_numpy,))
+    columns = sorted(currency_basket['positions'].keys())
+    deltas = {
+        each: ledger.valuation.position_deltas(
+            currency_basket['positions'][each])
+        for each in columns
+    }
+    for name, implementation in implementations:
+        valuation = implementation(currency_basket, dates, columns, deltas)
+        mismatches.extend(compare(expected, valuation, name))
+    return (len(expected), [each[0] for each in implementations], mismatches,)
+
+def main(args):
+    args = parse_args(args)
+
+    scratch = None
+    book_path = args.book
+    if book_path is None:
+        scratch = tempfile.mkdtemp(prefix = 'ledger-bench-')
+        book_path = generate.generate(
+            scratch,
+            postings = args.postings,
+            seed = args.seed,
+        )['path']
+
+    try:
+        positions, implementations, mismatches = check(book_path)
+    finally:
+        if scratch is not None:
+            shutil.rmtree(scratch)
+
+    print('positions:        {}'.format(positions))
+    print('implementations:  {}'.format(', '.join(implementations)))
+    for implementation, (account, company), key, want, got in mismatches:
+        print('{}: {}/{}: {}: expected {}, got {}'.format(
+            implementation,
+            account,
+            company,
+            key,
+            want,
+            got,
+        ))
+    if mismatches:
+        print('{} mismatches'.format(len(mismatches)))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,9 +1,48 @@
 __version__ = '0.5.0'
 __commit__ = 'HEAD'
 
-import ledger.constants
-import ledger.loader
-import ledger.parser
-import ledger.reporter
-import ledger.util
-import ledger.book
+import importlib
+
+
+# Submodules are imported lazily, when they are first used (eg, ledger.reporter
+# is imported when it is first referred to), so starting the ledger does not pay
+# for modules that a given invocation does not need.
+#
+# Every submodule must be listed here. They are not discovered (eg, using
+# pkgutil.iter_modules), because importing pkgutil alone takes longer than
+# starting the ledger.
+SUBMODULES = (
+    'book',
+    'budget',
+    'cache',
+    'constants',
+    'currency',
+    'history',
+    'index',
+    'ir',
+    'loader',
+    'output',
+    'parser',
+    'period',
+    'prices',
+    'reporter',
+    'rolling',
+    'rollup',
+    'scheduler',
+    'timeseries',
+    'timing',
+    'trace',
+    'util',
+    'valuation',
+)
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__,
+        name,
+    ))
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(SUBMODULES))
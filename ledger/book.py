@@ -1,8 +1,10 @@
+import bisect
+import collections
 import datetime
 import decimal
 import sys
 
-from ledger import constants, ir, util
+from ledger import constants, currency, ir, prices, util
 
 
 def setup_accounts(accounts, book_ir):
@@ -29,6 +31,7 @@ def setup_accounts(accounts, book_ir):
                 'balance': each.balance[0],
                 'currency': each.balance[1],
                 'created': each.timestamp,
+                'closed': None,
                 'tags': each.tags,
                 '~': each,
             }
@@ -72,23 +75,300 @@ def setup_accounts(accounts, book_ir):
                 exit(1)
 
             accounts[kind][name]['active'] = False
+            accounts[kind][name]['closed'] = each.timestamp
+
+def sorting_key(item):
+    if isinstance(item, ir.Transaction_record):
+        return item.effective_date()
+    return item.timestamp
+
+def new_accounts():
+    return { kind: {} for kind in constants.ACCOUNT_TYPES }
+
+def new_currency_basket():
+    return {
+        'rates': {},
+        'rates_version': 0,
+        'conversions': currency.new_conversions(),
+        'txs': [],
+        'prices': prices.new_price_store(),
+        'positions': prices.new_position_store(),
+        'rollup': None,
+        'index': None,
+    }
+
+def currency_matches(accounts, a):
+    kind, name = a.account
+    account_currency = accounts[kind][name]['currency']
+    tx_currency = a.value[1]
+    return (account_currency == tx_currency)
+def ensure_currency_match(accounts, a):
+    kind, name = a.account
+    if kind is None:
+        fmt = 'no currency for non-owned account {}'
+        sys.stdout.write(('{}: {}: ' + fmt + '\n').format(
+            util.colors.colorise(
+                'white',
+                a.text.location,
+            ),
+            util.colors.colorise(
+                'red',
+                'error',
+            ),
+            util.colors.colorise(
+                'white',
+                '{}/{}'.format(kind, name),
+            ),
+        ))
+        exit(1)
+    if name not in accounts[kind]:
+        fmt = 'account {} does not exist'
+        sys.stdout.write(('{}: {}: ' + fmt + '\n').format(
+            util.colors.colorise(
+                'white',
+                a.to_location(),
+            ),
+            util.colors.colorise(
+                'red',
+                'error',
+            ),
+            util.colors.colorise(
+                'white',
+                '{}/{}'.format(kind, name),
+            ),
+        ))
+        exit(1)
+    account_currency = accounts[kind][name]['currency']
+    tx_currency = a.value[1]
+    if account_currency != tx_currency:
+        fmt = 'mismatched currency: account {} is in {}, but value is in {}'
+        sys.stdout.write(('{}: {}: ' + fmt + '\n').format(
+            util.colors.colorise(
+                'white',
+                a.text.location,
+            ),
+            util.colors.colorise(
+                'red',
+                'error',
+            ),
+            util.colors.colorise(
+                'white',
+                '{}/{}'.format(kind, name),
+            ),
+            util.colors.colorise(
+                'light_green',
+                account_currency,
+            ),
+            util.colors.colorise(
+                'red_1',
+                tx_currency,
+            ),
+        ))
+        exit(1)
+
+def new_position():
+    return {
+        # Number of shares held.
+        'shares': decimal.Decimal(),
+
+        # Last known price of a single share.
+        'price_per_share': decimal.Decimal(),
+
+        # Fees paid to intermediaries for all trades, and dividends received.
+        # These are never reset, even if the position is liquidated, because
+        # they are useful for calculating total return across periods.
+        'fees': decimal.Decimal(),
+        'dividends': decimal.Decimal(),
+
+        # Lots of shares currently held, oldest first. Each lot is a pair of the
+        # number of shares and the amount paid for them (including fees). Lots
+        # are consumed in FIFO order when shares are sold or transferred out.
+        'lots': collections.deque(),
+
+        # Cost basis of the shares currently held ie, the sum of costs of all
+        # the lots. Tracked separately to avoid summing the lots on every
+        # valuation.
+        'paid': decimal.Decimal(),
+
+        # Valuation of the position, filled by calculate_equity_values().
+        'balance': decimal.Decimal(),
+        'value': decimal.Decimal(),
+        'total_return': decimal.Decimal(),
+    }
+
+def ensure_position(account, company):
+    if company not in account['shares']:
+        account['shares'][company] = new_position()
+    account['companies'].add(company)
+    return account['shares'][company]
+
+def position_acquire(position, no, cost):
+    position['lots'].append((no, cost,))
+    position['shares'] += no
+    position['paid'] += cost
+
+def position_dispose(position, no, value):
+    """Remove shares from a position, consuming the oldest lots first.
+
+    Returns the list of removed lots, with the cost basis they had in the
+    position. If the position does not hold enough shares the missing part is
+    valued using the value of the transaction.
+    """
+    removed = []
+    left = no
+    lots = position['lots']
+    while left and lots:
+        lot_no, lot_cost = lots[0]
+        if lot_no <= left:
+            lots.popleft()
+            removed.append((lot_no, lot_cost,))
+            left -= lot_no
+            continue
 
-def calculate_balances(accounts, book, default_currency):
-    book_ir, currency_basket = book
+        # Only a part of the lot is consumed. Its cost is split proportionally
+        # to the number of shares.
+        cost = (lot_cost * left / lot_no)
+        lots[0] = ((lot_no - left), (lot_cost - cost),)
+        removed.append((left, cost,))
+        left = 0
+    if left:
+        removed.append((left, abs(value) * left / no,))
+
+    position['shares'] -= no
+    if lots:
+        position['paid'] -= sum(map(lambda each: each[1], removed))
+    else:
+        # Avoid leaving any rounding residue in the cost basis once the whole
+        # position is liquidated.
+        position['paid'] = decimal.Decimal()
+
+    return removed
+
+def apply_exchange_rates(currency_basket, each):
+    for r in each.rates:
+        lhs = str(r.src)
+        rhs = str(r.dst)
+
+        base = (lhs, rhs,)
+        rev = (rhs, lhs,)
+
+        currency_basket['rates'].pop(base, None)
+        currency_basket['rates'].pop(rev, None)
+
+        currency_basket['rates'][base] = r
+    currency.bump_version(currency_basket)
+
+def apply_item(accounts, currency_basket, each, default_currency):
+    """Apply a single item of the book to the accounts and the currency basket.
+
+    Items are expected to be applied in chronological order. No check of the
+    item's effective date is made here - it is the caller's responsibility to
+    decide which items should be applied.
+    """
+    if type(each) is ir.Configuration_line:
+        return
+    if type(each) is ir.Account_record:
+        return
+
+    if type(each) is ir.Exchange_rates_record:
+        apply_exchange_rates(currency_basket, each)
+        return
+
+    if type(each) is ir.Balance_record:
+        for b in each.accounts:
+            kind, name = b.account
+            if kind == constants.ACCOUNT_EQUITY_T:
+                company, share_price, _ = b.value
+                shares = accounts[kind][name]['shares']
+                shares[company]['price_per_share'] = share_price
+                prices.record_price(
+                    currency_basket,
+                    name,
+                    company,
+                    sorting_key(each),
+                    share_price,
+                )
+            else:
+                ensure_currency_match(accounts, b)
+                accounts[kind][name]['balance'] = b.value[0]
+    if type(each) is ir.Revenue_tx:
+        for a in each.outs:
+            ensure_currency_match(accounts, a)
+            kind, name = a.account
+            accounts[kind][name]['balance'] += a.value[0]
+    elif type(each) is ir.Expense_tx:
+        for a in each.ins:
+            ensure_currency_match(accounts, a)
+            kind, name = a.account
+            accounts[kind][name]['balance'] += a.value[0]
+    elif type(each) is ir.Transfer_tx:
+        for a in each.ins:
+            ensure_currency_match(accounts, a)
+            kind, name = a.account
+            accounts[kind][name]['balance'] += a.value[0]
+        for a in each.outs:
+            ensure_currency_match(accounts, a)
+            kind, name = a.account
+            accounts[kind][name]['balance'] += a.value[0]
+    elif type(each) is ir.Equity_tx:
+        inflow = decimal.Decimal()
+        outflow = decimal.Decimal()
+
+        # There is only one destination account since we can only deposit
+        # shares in one account using a single transfer.
+        dst_account = None
+        src_account = None
+        for a in each.ins:
+            ensure_currency_match(accounts, a)
+            kind, name = a.account
+            accounts[kind][name]['balance'] += a.value[0]
+            inflow += a.value[0]
+            src_account = a.account
+        for a in each.outs:
+            ensure_currency_match(accounts, a)
+            kind, name = a.account
+            outflow += a.value[0]
+            accounts[kind][name]['balance'] += a.value[0]
+            dst_account = a.account
+
+        fee_value = decimal.Decimal()
+        fee_currency = default_currency
+        for t in each.tags:
+            s = str(t).strip()
+            if s.startswith('fee:'):
+                fee = s.split()[1:]
+                fee_currency = fee[1]
+                fee_value = decimal.Decimal(fee[0])
+
+        # FIXME check currency
+        if fee_value:
+            kind, name = src_account
+            accounts[kind][name]['balance'] += fee_value
+
+        this_shares = None
+        for t in each.tags:
+            s = str(t).strip()
+            if s.startswith('shares:'):
+                shares = s.split()[1:]
+
+                company = shares[0]
+                this_shares = {
+                    'company': company,
+                    'no': decimal.Decimal(shares[1]),
+                    'fee': {
+                        'currency': fee_currency,
+                        'amount': fee_value,
+                    },
+                }
 
-    def currency_matches(accounts, a):
-        kind, name = a.account
-        account_currency = accounts[kind][name]['currency']
-        tx_currency = a.value[1]
-        return (account_currency == tx_currency)
-    def ensure_currency_match(accounts, a):
-        kind, name = a.account
-        if kind is None:
-            fmt = 'no currency for non-owned account {}'
-            sys.stdout.write(('{}: {}: ' + fmt + '\n').format(
+        pps = abs(-inflow / this_shares['no'])
+
+        if -outflow != (inflow - fee_value):
+            fmt = 'inflow {} from {} does not equal outflow {} to {} plus fees {}'
+            sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
                 util.colors.colorise(
                     'white',
-                    a.text.location,
+                    each.to_location(),
                 ),
                 util.colors.colorise(
                     'red',
@@ -96,171 +376,66 @@ def calculate_balances(accounts, book, default_currency):
                 ),
                 util.colors.colorise(
                     'white',
-                    '{}/{}'.format(kind, name),
+                    inflow,
                 ),
-            ))
-            exit(1)
-        if name not in accounts[kind]:
-            fmt = 'account {} does not exist'
-            sys.stdout.write(('{}: {}: ' + fmt + '\n').format(
                 util.colors.colorise(
                     'white',
-                    a.to_location(),
-                ),
-                util.colors.colorise(
-                    'red',
-                    'error',
+                    '/'.join(src_account),
                 ),
                 util.colors.colorise(
                     'white',
-                    '{}/{}'.format(kind, name),
+                    '/'.join(dst_account),
                 ),
-            ))
-            exit(1)
-        account_currency = accounts[kind][name]['currency']
-        tx_currency = a.value[1]
-        if account_currency != tx_currency:
-            fmt = 'mismatched currency: account {} is in {}, but value is in {}'
-            sys.stdout.write(('{}: {}: ' + fmt + '\n').format(
                 util.colors.colorise(
                     'white',
-                    a.text.location,
-                ),
-                util.colors.colorise(
-                    'red',
-                    'error',
+                    outflow,
                 ),
                 util.colors.colorise(
                     'white',
-                    '{}/{}'.format(kind, name),
-                ),
-                util.colors.colorise(
-                    'light_green',
-                    account_currency,
-                ),
-                util.colors.colorise(
-                    'red_1',
-                    tx_currency,
+                    fee_value,
                 ),
             ))
             exit(1)
 
-    this_moment_in_time = datetime.datetime.now()
-
-    # Calculate balances.
-    for each in book_ir:
-        if type(each) is ir.Configuration_line:
-            continue
-        if type(each) is ir.Account_record:
-            continue
-
-        if type(each) is ir.Exchange_rates_record:
-            for r in each.rates:
-                lhs = str(r.src)
-                rhs = str(r.dst)
-
-                base = (lhs, rhs,)
-                rev = (rhs, lhs,)
-
-                currency_basket['rates'].pop(base, None)
-                currency_basket['rates'].pop(rev, None)
-
-                currency_basket['rates'][base] = r
-            continue
-
-        if each.effective_date() > this_moment_in_time:
-            continue
-
-        if type(each) is ir.Balance_record:
-            for b in each.accounts:
-                kind, name = b.account
-                if kind == constants.ACCOUNT_EQUITY_T:
-                    company, share_price, _ = b.value
-                    shares = accounts[kind][name]['shares']
-                    shares[company]['price_per_share'] = share_price
-                else:
-                    ensure_currency_match(accounts, b)
-                    accounts[kind][name]['balance'] = b.value[0]
-        if type(each) is ir.Revenue_tx:
-            for a in each.outs:
-                ensure_currency_match(accounts, a)
-                kind, name = a.account
-                accounts[kind][name]['balance'] += a.value[0]
-        elif type(each) is ir.Expense_tx:
-            for a in each.ins:
-                ensure_currency_match(accounts, a)
-                kind, name = a.account
-                accounts[kind][name]['balance'] += a.value[0]
-        elif type(each) is ir.Transfer_tx:
-            for a in each.ins:
-                ensure_currency_match(accounts, a)
-                kind, name = a.account
-                accounts[kind][name]['balance'] += a.value[0]
-            for a in each.outs:
-                ensure_currency_match(accounts, a)
-                kind, name = a.account
-                accounts[kind][name]['balance'] += a.value[0]
-        elif type(each) is ir.Equity_tx:
-            inflow = decimal.Decimal()
-            outflow = decimal.Decimal()
-
-            # There is only one destination account since we can only deposit
-            # shares in one account using a single transfer.
-            dst_account = None
-            src_account = None
-            for a in each.ins:
-                ensure_currency_match(accounts, a)
-                kind, name = a.account
-                accounts[kind][name]['balance'] += a.value[0]
-                inflow += a.value[0]
-                src_account = a.account
-            for a in each.outs:
-                ensure_currency_match(accounts, a)
-                kind, name = a.account
-                outflow += a.value[0]
-                accounts[kind][name]['balance'] += a.value[0]
-                dst_account = a.account
-
-            fee_value = decimal.Decimal()
-            fee_currency = default_currency
-            for t in each.tags:
-                s = str(t).strip()
-                if s.startswith('fee:'):
-                    fee = s.split()[1:]
-                    fee_currency = fee[1]
-                    fee_value = decimal.Decimal(fee[0])
-
-            # FIXME check currency
-            if fee_value:
+        both_equity = (
+                dst_account[0] == constants.ACCOUNT_EQUITY_T
+            and src_account[0] == constants.ACCOUNT_EQUITY_T)
+        if both_equity:
+            dst_kind, dst_name = dst_account
+            src_kind, src_name = src_account
+
+            company = this_shares['company']
+
+            # Shares transferred between two equity accounts (eg, when moving
+            # them to a different broker) carry their cost basis with them. The
+            # lots removed from the source account are deposited in the
+            # destination account unchanged.
+            src = accounts[src_kind][src_name]
+            src_position = ensure_position(src, company)
+            lots = position_dispose(src_position, this_shares['no'], inflow)
+            src_position['price_per_share'] = pps
+
+            dst = accounts[dst_kind][dst_name]
+            dst_position = ensure_position(dst, company)
+            for no, cost in lots:
+                position_acquire(dst_position, no, cost)
+            dst_position['fees'] -= fee_value
+            dst_position['price_per_share'] = pps
+
+            prices.record_position(currency_basket, src_name, company,
+                sorting_key(each), src_position)
+            prices.record_position(currency_basket, dst_name, company,
+                sorting_key(each), dst_position)
+            prices.record_price(currency_basket, src_name, company,
+                sorting_key(each), pps)
+            prices.record_price(currency_basket, dst_name, company,
+                sorting_key(each), pps)
+        else:
+            kind, name = dst_account
+            if kind != constants.ACCOUNT_EQUITY_T:
                 kind, name = src_account
-                accounts[kind][name]['balance'] += fee_value
-
-            this_shares = None
-            for t in each.tags:
-                s = str(t).strip()
-                if s.startswith('shares:'):
-                    shares = s.split()[1:]
-
-                    company = shares[0]
-                    this_shares = {
-                        'company': company,
-                        'no': decimal.Decimal(shares[1]),
-                        'fee': {
-                            'currency': fee_currency,
-                            'amount': fee_value,
-                        },
-                    }
-
-            pps = abs(-inflow / this_shares['no'])
-
-            this_tx = {
-                'base': each,
-                'value': -inflow,
-                'shares': this_shares,
-            }
-
-            if -outflow != (inflow - fee_value):
-                fmt = 'inflow {} from {} does not equal outflow {} to {} plus fees {}'
+            if kind != constants.ACCOUNT_EQUITY_T:
+                fmt = 'no equity account in transfer of {} shares'
                 sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
                     util.colors.colorise(
                         'white',
@@ -272,167 +447,137 @@ def calculate_balances(accounts, book, default_currency):
                     ),
                     util.colors.colorise(
                         'white',
-                        inflow,
-                    ),
-                    util.colors.colorise(
-                        'white',
-                        '/'.join(src_account),
-                    ),
-                    util.colors.colorise(
-                        'white',
-                        '/'.join(dst_account),
-                    ),
-                    util.colors.colorise(
-                        'white',
-                        outflow,
-                    ),
-                    util.colors.colorise(
-                        'white',
-                        fee_value,
+                        company,
                     ),
                 ))
                 exit(1)
+            company = this_shares['company']
+            position = ensure_position(accounts[kind][name], company)
+
+            # The value of a transaction is the amount of money paid for the
+            # shares (when buying), or received for them (when selling).
+            no = this_shares['no']
+            if no > 0:
+                position_acquire(position, no, -inflow)
+            else:
+                position_dispose(position, -no, -inflow)
+            position['fees'] -= fee_value
+            position['price_per_share'] = pps
+
+            prices.record_position(currency_basket, name, company,
+                sorting_key(each), position)
+            prices.record_price(currency_basket, name, company,
+                sorting_key(each), pps)
+    if type(each) is ir.Dividend_tx:
+        for a in each.ins:
+            kind, name = a.account
+
+            value, dividend_currency = each.outs[0].value
+            synth = each.outs[0]
+            synth = ir.Account_mod(
+                synth.text,
+                synth.timestamp,
+                a.account,
+                synth.value,
+            )
+            if not currency_matches(accounts, synth):
+                value = currency.convert(
+                    currency_basket,
+                    value,
+                    dividend_currency,
+                    default_currency,
+                    location = each.to_location(),
+                    what = 'dividend',
+                )
 
-            both_equity = (
-                    dst_account[0] == constants.ACCOUNT_EQUITY_T
-                and src_account[0] == constants.ACCOUNT_EQUITY_T)
-            if both_equity:
-                dst_kind, dst_name = dst_account
-                src_kind, src_name = src_account
-
-                company = this_shares['company']
-                if company not in accounts[dst_kind][dst_name]['shares']:
-                    accounts[dst_kind][dst_name]['shares'][company] = {
-                        'shares': 0,
-                        'price_per_share': decimal.Decimal(),
-                        'fees': decimal.Decimal(),
-                        'dividends': decimal.Decimal(),
-                        'txs': [],
-                        # FIXME are these fields below really needed?
-                        'balance': decimal.Decimal(),
-                        'paid': decimal.Decimal(),
-                        'value': decimal.Decimal(),
-                        'total_return': decimal.Decimal(),
-                    }
-
-                accounts[dst_kind][dst_name]['shares'][company]['txs'].append(this_tx)
-                accounts[dst_kind][dst_name]['shares'][company]['price_per_share'] = pps
-                accounts[dst_kind][dst_name]['companies'].add(company)
-
-                this_tx = {
-                    'base': each,
-                    'value': inflow,
-                    'shares': {
-                        'company': company,
-                        'no': -decimal.Decimal(shares[1]),
-                        'fee': {
-                            'currency': fee_currency,
-                            'amount': decimal.Decimal(),
-                        },
-                    },
-                }
-                accounts[src_kind][src_name]['shares'][company]['txs'].append(this_tx)
-                accounts[src_kind][src_name]['shares'][company]['price_per_share'] = pps
-                accounts[src_kind][src_name]['companies'].add(company)
+            company = a.value[0]
+            shares = accounts[kind][name]['shares']
+            shares[company]['dividends'] += value
+            prices.record_position(currency_basket, name, company,
+                sorting_key(each), shares[company])
+
+def calculate_balances(accounts, book, default_currency, until = None):
+    book_ir, currency_basket = book
+
+    # Without an explicit point in time the balances are calculated for "now".
+    # Exchange rates are applied regardless of their timestamps in this mode,
+    # which means that future rates are used for reports. When an explicit
+    # point in time is requested, nothing past it is considered.
+    this_moment_in_time = (until or datetime.datetime.now())
+
+    # Calculate balances.
+    for each in book_ir:
+        if type(each) is ir.Exchange_rates_record:
+            if until is not None and each.timestamp > until:
+                continue
+            apply_exchange_rates(currency_basket, each)
+            continue
+
+        if each.effective_date() > this_moment_in_time:
+            continue
+
+        apply_item(accounts, currency_basket, each, default_currency)
+
+def calculate_rates(book, until = None):
+    """Apply exchange rates of the book to the currency basket, the same way
+    calculate_balances() does, without calculating balances.
+    """
+    book_ir, currency_basket = book
+    for each in book_ir:
+        if type(each) is ir.Exchange_rates_record:
+            if until is not None and each.timestamp > until:
+                continue
+            apply_exchange_rates(currency_basket, each)
+
+def count_items_until(book_ir, timestamp):
+    """Count items of a sorted book that are in effect at the given point in
+    time, ie. those that calculate_balances() applies when asked for balances
+    at that time.
+    """
+    return bisect.bisect_right(book_ir, timestamp, key = sorting_key)
+
+def active_as_of(acc, timestamp):
+    opened = (acc['created'] <= timestamp)
+    closed = (acc['closed'] is not None and acc['closed'] <= timestamp)
+    return (opened and not closed)
+
+def convert_account_balance(kind, name, acc, currency_basket, default_currency):
+    """Convert balance of an account to the default currency.
+    """
+    return currency.convert(
+        currency_basket,
+        acc['balance'],
+        acc['currency'],
+        default_currency,
+        location = acc['~'].text[0].location,
+        what = '{} account named {}'.format(kind, name),
+    )
+
+def calculate_totals(account_types, accounts, currency_basket, default_currency):
+    """Sum balances of active accounts of the given types.
+
+    Returns a pair of the sum of balances of accounts kept in the default
+    currency, and the sum of balances of accounts kept in foreign currencies
+    converted to the default currency.
+    """
+    reserves_default = decimal.Decimal()
+    reserves_foreign = decimal.Decimal()
+    for t in account_types:
+        for name, acc in accounts[t].items():
+            if not acc['active']:
+                continue
+            if acc['currency'] == default_currency:
+                reserves_default += acc['balance']
             else:
-                kind, name = dst_account
-                if kind != constants.ACCOUNT_EQUITY_T:
-                    kind, name = src_account
-                if kind != constants.ACCOUNT_EQUITY_T:
-                    fmt = 'no equity account in transfer of {} shares'
-                    sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                        util.colors.colorise(
-                            'white',
-                            each.to_location(),
-                        ),
-                        util.colors.colorise(
-                            'red',
-                            'error',
-                        ),
-                        util.colors.colorise(
-                            'white',
-                            company,
-                        ),
-                    ))
-                    exit(1)
-                company = this_shares['company']
-                if company not in accounts[kind][name]['shares']:
-                    accounts[kind][name]['shares'][company] = {
-                        'shares': 0,
-                        'price_per_share': decimal.Decimal(),
-                        'fees': decimal.Decimal(),
-                        'dividends': decimal.Decimal(),
-                        'txs': [],
-                        # FIXME are these fields below really needed?
-                        'balance': decimal.Decimal(),
-                        'paid': decimal.Decimal(),
-                        'value': decimal.Decimal(),
-                        'total_return': decimal.Decimal(),
-                    }
-
-                accounts[kind][name]['shares'][company]['txs'].append(this_tx)
-                accounts[kind][name]['shares'][company]['price_per_share'] = pps
-                accounts[kind][name]['companies'].add(company)
-        if type(each) is ir.Dividend_tx:
-            for a in each.ins:
-                kind, name = a.account
-
-                value, currency = each.outs[0].value
-                synth = each.outs[0]
-                synth = ir.Account_mod(
-                    synth.text,
-                    synth.timestamp,
-                    a.account,
-                    synth.value,
+                reserves_foreign += convert_account_balance(
+                    t,
+                    name,
+                    acc,
+                    currency_basket,
+                    default_currency,
                 )
-                if not currency_matches(accounts, synth):
-                    wanted_currency = accounts[kind][name]['currency']
-
-                    pair = (currency, default_currency,)
-                    rev = False
-                    try:
-                        rate = currency_basket['rates'][pair]
-                    except KeyError:
-                        try:
-                            pair = (default_currency, currency,)
-                            rate = currency_basket['rates'][pair]
-                            rev = True
-                        except KeyError:
-                            fmt = 'no currency pair {}/{} for {} account named {}'
-                            sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                                util.colors.colorise(
-                                    'white',
-                                    acc['~'].text[0].location,
-                                ),
-                                util.colors.colorise(
-                                    'red',
-                                    'error',
-                                ),
-                                util.colors.colorise(
-                                    'white',
-                                    currency,
-                                ),
-                                util.colors.colorise(
-                                    'white',
-                                    default_currency,
-                                ),
-                                t,
-                                util.colors.colorise(
-                                    'white',
-                                    name,
-                                ),
-                            ))
-                            exit(1)
-
-                    rate = rate.rate
-                    if rev:
-                        value = (value / rate)
-                    else:
-                        value = (value * rate)
-
-                company = a.value[0]
-                shares = accounts[kind][name]['shares']
-                shares[company]['dividends'] += value
+
+    return (reserves_default, reserves_foreign,)
 
 def calculate_equity_values(accounts, book, default_currency):
     eq_accounts = accounts['equity']
@@ -450,31 +595,14 @@ def calculate_equity_values(accounts, book, default_currency):
             share_price = shares['price_per_share']
             dividends = shares['dividends']
 
-            # Fees paid to acquire the shares.
-            fees = decimal.Decimal()
-
-            # Total amount of money paid for the shares: share price plus any
-            # fees to intermediaries.
-            paid = decimal.Decimal()
-
-            shares_no = 0
-            for each in shares['txs']:
-                paid += each['value']
-                fee = each['shares']['fee']['amount']
-                fees -= fee
-                shares_no += each['shares']['no']
-
-                # If the share number ever reaches zero we should reset the
-                # calculations, otherwise the results are WILD and should
-                # OUTRAGEOUS loss. This is a quick hack to suppress the
-                # obviously incorrect result. A FIXME if you ever have time to
-                # debug the issue and develop a better solution.
-                #
-                # Only reset the paid value, though. Leave fees and dividends
-                # alone because they are useful for calculating Total Return
-                # even across periods when the position was liquidated.
-                if shares_no == 0:
-                    paid = decimal.Decimal()
+            # Fees paid to acquire the shares, and the total amount of money
+            # paid for the shares currently held (share price plus any fees to
+            # intermediaries). Both are maintained by calculate_balances() as
+            # transactions are applied, so valuation is only a matter of
+            # combining them with the current share price.
+            fees = shares['fees']
+            paid = shares['paid']
+            shares_no = shares['shares']
 
             # Don't consider the shares... if there are no shares, eg, when all
             # of them were sold or transferred to another broker.
@@ -525,9 +653,7 @@ def calculate_equity_values(accounts, book, default_currency):
                 'percent': tr_percent,
             }
 
-            shares['shares'] = shares_no
             shares['balance'] = worth
-            shares['paid'] = paid
             shares['value'] = value
             shares['total_return'] = tr
             shares['gain'] = {
@@ -541,81 +667,6 @@ def calculate_equity_values(accounts, book, default_currency):
                 account['value'] += value
             account['dividends'] += dividends
 
-            continue
-
-            # Here is the total money that you had to pay to obtain the
-            # shares. It is the source price because what you paid not only
-            # includes the shares' worth, but also the fees.
-            #
-            # Note that the amount may be negative (if you were only buying
-            # shares or sold them with a loss) or positive (if you sold
-            # shares with a profit).
-            #
-            # FIXME Calculations should be reset of the amount of shares
-            # ever reaches 0 as that means we sold all our shares, and using
-            # old prices after such a point does not make much sense.
-            paid = sum(map(
-                lambda x: (
-                    x['value']
-                    # A clever way of obtaining 1 if the operation was a buy
-                    # and -1 if the operation was a sell.
-                    #
-                    # We need this to correctly calculate the total amount
-                    # of money we have paid for the shares we have. If we
-                    # were buying then we should add the amount to the total
-                    # cost, but if we were selling then we should subtract.
-                    # Multiplying the source amount by either 1 or -1 makes
-                    # it possible to do it in a simple map/sum operation.
-                    #
-                    # Why do we sum source amounts? Because when buying we
-                    # should consider the amount of money we had to give to
-                    # the trading organisation to obtain the shares, and
-                    # when selling we should consider the amount of money we
-                    # got from the market.
-                    * (x['shares']['no'] / abs(x['shares']['no']))
-                ),
-                shares['txs']))
-
-            # What the shares are worth is simple: you take price of one
-            # share and multiply it by the amount of shares you own.
-            worth = (shares_no * share_price)
-
-            # The value of shares for you is not exactly what they are worth
-            # on the market. Remember that you paid some fees to acquite
-            # them, and that they may have yielded you some dividends.
-            value = (worth - fees + dividends)
-
-            # Account's balance tells you the worth of your account and is
-            # not concerned with any fees that you may have incurred while
-            # acquiting the wealth.
-            #
-            # The balance should not be modified if there are no shares for
-            # a company. This means that all shares were sold and including
-            # their cost in the report would be hugely misleading.
-            account['balance'] += (worth
-                if shares_no
-                else decimal.Decimal(0))
-            account['paid'] += (paid
-                if shares_no
-                else decimal.Decimal(0))
-            account['value'] += (value
-                if shares_no
-                else decimal.Decimal(0))
-            account['dividends'] += dividends
-
-            tr_nominal = (worth + paid + dividends)
-            tr_percent = -((tr_nominal / paid) * 100)
-            tr = {
-                'relevant': (dividends != 0),
-                'nominal': tr_nominal,
-                'percent': tr_percent,
-            }
-
-            shares['balance'] = worth
-            shares['paid'] = paid
-            shares['value'] = value
-            shares['total_return'] = tr
-
         # Include dividends in profit calculations. If the shares went down,
         # but the dividends were healthy then you are still OK.
         nominal_value = (account['balance'] + account['dividends'])
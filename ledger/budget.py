@@ -0,0 +1,105 @@
+import decimal
+
+from . import period as ledger_period
+
+
+# Budgets.
+#
+# A budget limits spending in a month, either to a percentage of revenues of the
+# month or to an amount in the default currency. It applies to all expenses, or
+# only to expenses of one sink or of transactions with one tag:
+#
+#   set budget 50.0 %
+#   set budget 100.00 $
+#   set budget 400.00 $ sink GROCER
+#   set budget 10.0 % tag eating_out
+#
+# Budgets do not require a pass over the book of their own. Expenses of sinks
+# and tags are aggregated together with the rest of expenses and revenues (see
+# ledger.rollup), and the state of a budget is calculated from the summary of
+# the month.
+BUDGET_PERCENTAGE = '%'
+BUDGET_AMOUNT = '$'
+
+SCOPE_SINK = 'sink'
+SCOPE_TAG = 'tag'
+
+
+def new_budget(kind, limit, scope = None, name = None):
+    return {
+        'kind': kind,       # percentage of revenues, or an amount
+        'limit': limit,
+        'scope': scope,     # None for all expenses, a sink, or a tag
+        'name': name,       # name of the sink or tag
+    }
+
+def parse(value):
+    """Parse the value of a budget configuration line.
+
+    Raises ValueError if the value is not a valid budget.
+    """
+    parts = value.split(maxsplit = 3)
+    if len(parts) not in (2, 4,):
+        raise ValueError('expected a limit and % or $, optionally followed by'
+            ' a sink or a tag')
+    limit, kind = parts[:2]
+    if kind not in (BUDGET_PERCENTAGE, BUDGET_AMOUNT,):
+        raise ValueError('invalid kind of budget: {}'.format(kind))
+    try:
+        limit = decimal.Decimal(limit)
+    except decimal.InvalidOperation:
+        raise ValueError('invalid limit of budget: {}'.format(limit))
+    if (not limit.is_finite()) or limit < 0:
+        raise ValueError('invalid limit of budget: {}'.format(limit))
+
+    if len(parts) == 2:
+        return new_budget(kind, limit)
+    scope, name = parts[2:]
+    if scope not in (SCOPE_SINK, SCOPE_TAG,):
+        raise ValueError('invalid scope of budget: {}'.format(scope))
+    return new_budget(kind, limit, scope = scope, name = name)
+
+def title_of(budget):
+    if budget['scope'] is None:
+        return 'budget'
+    if budget['scope'] == SCOPE_TAG:
+        return 'budget of tag {}'.format(budget['name'])
+    return 'budget of {}'.format(budget['name'])
+
+def spent_of(budget, summary):
+    ex = summary['expenses']
+    if budget['scope'] is None:
+        spent = ex['total']
+    elif budget['scope'] == SCOPE_SINK:
+        spent = ex['sinks'].get(budget['name'], decimal.Decimal())
+    else:
+        spent = ex['tags'].get(budget['name'], decimal.Decimal())
+    return abs(spent)
+
+def status(budget, summary, period_span):
+    """Calculate the state of a budget as of the end of a period.
+
+    The summary must be a summary of the month up to the end of the period, with
+    expenses of sinks and tags (see ledger.reporter.summarise_aggregate).
+    Returns a dict with the amount allowed to be spent in the month, the amount
+    spent, the amount remaining, and the daily cap (ie, the remaining amount
+    divided by the number of days left in the month, including the last day of
+    the period).
+    """
+    _, period_end = period_span
+    allowed = budget['limit']
+    if budget['kind'] == BUDGET_PERCENTAGE:
+        allowed = (summary['revenues']['total'] * budget['limit'] / 100)
+    spent = spent_of(budget, summary)
+
+    today = period_end.date()
+    days_left = (ledger_period.days_in_month(today.year, today.month)
+        - today.day + 1)
+    remaining = (allowed - spent)
+    return {
+        'budget': budget,
+        'allowed': allowed,
+        'spent': spent,
+        'remaining': remaining,
+        'daily_cap': (remaining / days_left),
+    }
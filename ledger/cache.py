@@ -0,0 +1,151 @@
+import hashlib
+import os
+import pickle
+
+import ledger
+
+
+# Cache of structures derived from books.
+#
+# Building rollups of transactions of the book is done once for each distinct
+# content of the book and the result is pickled to a file in the user's cache
+# directory. The file is named after a fingerprint of the content (text and
+# location of every line, including lines of included files) and of the version
+# of the ledger, so any change to the book or to the program makes the ledger
+# ignore the old entry.
+#
+# The IR of the book is not cached. Unpickling it takes longer than parsing and
+# sorting the book from scratch, as does unpickling anything holding about as
+# many amounts as the book itself. Only structures that are much smaller than
+# the book, but expensive to build, are worth caching.
+#
+# Cache is an optimisation: failures to read or write it are silently ignored
+# and the book is processed from scratch.
+#
+# Fingerprints start with an identifier of the book (derived from the path of
+# its main file), so entries of a book whose content changed can be told apart
+# from entries of other books. Whenever an entry is stored, entries of the same
+# book with other fingerprints are removed, as they will never be used again.
+#
+# The format number must be bumped whenever the structure of cached data
+# (rollups, or results of reports) changes.
+CACHE_FORMAT = 10
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'maelkum-ledger')
+
+def book_id(book_main):
+    path = os.path.abspath(book_main).encode('utf-8')
+    return hashlib.sha256(path).hexdigest()[:16]
+
+def fingerprint(book_main, book_lines):
+    digest = hashlib.sha256()
+    digest.update('{} {} {}\n'.format(
+        ledger.__version__,
+        ledger.__commit__,
+        CACHE_FORMAT,
+    ).encode('utf-8'))
+    for each in book_lines:
+        digest.update('{}\0{}\n'.format(each.location, each.text).encode('utf-8'))
+    return '{}-{}'.format(book_id(book_main), digest.hexdigest())
+
+def entry_path(key):
+    return os.path.join(cache_dir(), '{}.pickle'.format(key))
+
+def new_entry(key, rollup):
+    return {
+        'fingerprint': key,
+        'rollup': rollup,
+    }
+
+def read_pickle(path, key):
+    try:
+        with open(path, 'rb') as ifstream:
+            entry = pickle.load(ifstream)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+            ImportError, IndexError, TypeError, ValueError):
+        return None
+    if type(entry) is not dict or entry.get('fingerprint') != key:
+        return None
+    return entry
+
+def write_pickle(path, entry):
+    # Write to a temporary file first, so a concurrently running ledger never
+    # sees a partially written entry.
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(temporary, 'wb') as ofstream:
+            pickle.dump(entry, ofstream, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+
+def load(key):
+    """Load a cache entry with the given fingerprint.
+
+    Returns None if there is no such entry, or it cannot be read.
+    """
+    return read_pickle(entry_path(key), key)
+
+def evict(key):
+    """Remove entries of the book with the given fingerprint, which have other
+    fingerprints.
+    """
+    book, _ = key.split('-', maxsplit = 1)
+    try:
+        names = os.listdir(cache_dir())
+    except OSError:
+        return
+    for each in names:
+        if each.startswith(book + '-') and not each.startswith(key + '.'):
+            try:
+                os.unlink(os.path.join(cache_dir(), each))
+            except OSError:
+                pass
+
+def store(entry):
+    write_pickle(entry_path(entry['fingerprint']), entry)
+    evict(entry['fingerprint'])
+
+
+# Cache of report results.
+# Results of reports computed for a book are kept in a separate file for each
+# book, as a dict keyed by the default currency, the name of the report, its
+# resolved period (eg, the day for a report of "today"), and whether colors are
+# used. When the period of a report rolls over its key changes, so the old
+# result is not used. Only results used by the last invocation are kept.
+#
+# Facts about the book which keys of reports depend on (eg, the default
+# currency) are kept together with the results. Keys can then be found, and the
+# results reused, without parsing the book.
+def reports_path(key):
+    return os.path.join(cache_dir(), '{}.reports.pickle'.format(key))
+
+def report_key(default_currency, name, period, colors = False):
+    # Some results contain text that was already colorised, which must not be
+    # reused when colors are (or are not) wanted.
+    return (default_currency, name, period, colors,)
+
+def load_reports(key):
+    """Load results of reports computed for the book with the given fingerprint.
+
+    Returns a dict with facts about the book and the results, or None if there
+    are none, or they cannot be read.
+    """
+    return read_pickle(reports_path(key), key)
+
+def store_reports(key, facts, reports):
+    write_pickle(reports_path(key), {
+        'fingerprint': key,
+        'facts': facts,
+        'reports': reports,
+    })
+    evict(key)
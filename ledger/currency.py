@@ -0,0 +1,140 @@
+import collections
+import decimal
+import sys
+
+from . import timing
+from . import util
+
+
+# Currency conversion service.
+#
+# Exchange rates in the currency basket form a graph: currencies are nodes, and
+# each rate is an edge that can be traversed in both directions (multiplying
+# by the rate in one direction, and dividing by it in the other one). When a
+# pair of currencies is not directly connected, the value is converted through
+# a shortest path between them in the graph ie, through as few intermediate
+# currencies as possible.
+#
+# Paths between all pairs of currencies are computed once for each version of
+# the rates in the basket (the version is bumped every time rates are updated)
+# and kept in the basket, so conversions are a lookup followed by one (or, for
+# triangulated pairs, a few) multiplication or division.
+
+
+def new_conversions():
+    return {
+        'version': None,
+        'matrix': {},
+    }
+
+def bump_version(currency_basket):
+    currency_basket['rates_version'] = (
+        currency_basket.get('rates_version', 0) + 1)
+
+def conversion_matrix(currency_basket):
+    """Get paths between all pairs of currencies known in the basket.
+
+    Returns a dict mapping (currency, target) pairs to lists of steps. Each step
+    is a pair of a rate and a flag telling whether the value should be divided
+    (True) or multiplied (False) by that rate.
+    """
+    version = currency_basket.get('rates_version', 0)
+    conversions = currency_basket.get('conversions')
+    if conversions is None:
+        conversions = new_conversions()
+        currency_basket['conversions'] = conversions
+    if conversions['version'] == version:
+        return conversions['matrix']
+
+    graph = collections.defaultdict(list)
+    for (src, dst), rate in currency_basket['rates'].items():
+        graph[src].append((dst, rate.rate, False,))
+        graph[dst].append((src, rate.rate, True,))
+
+    matrix = {}
+    for origin in graph:
+        paths = { origin: [] }
+        queue = collections.deque([origin])
+        while queue:
+            here = queue.popleft()
+            for there, rate, rev in graph[here]:
+                if there in paths:
+                    continue
+                paths[there] = paths[here] + [(rate, rev,)]
+                queue.append(there)
+        for target, steps in paths.items():
+            if target != origin:
+                matrix[(origin, target,)] = steps
+
+    conversions['version'] = version
+    conversions['matrix'] = matrix
+    return matrix
+
+def can_convert(currency_basket, currency, target):
+    if currency == target:
+        return True
+    return ((currency, target,) in conversion_matrix(currency_basket))
+
+def report_missing_pair(currency, target, location, what):
+    fmt = 'no currency pair {}/{}'
+    if what is not None:
+        fmt += ' for {}'.format(what)
+    sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
+        util.colors.colorise(
+            'white',
+            (location or '<ledger>'),
+        ),
+        util.colors.colorise(
+            'red',
+            'error',
+        ),
+        util.colors.colorise(
+            'white',
+            currency,
+        ),
+        util.colors.colorise(
+            'white',
+            target,
+        ),
+    ))
+    exit(1)
+
+def steps_of(currency_basket, currency, target, location = None, what = None):
+    steps = conversion_matrix(currency_basket).get((currency, target,))
+    if steps is None:
+        report_missing_pair(currency, target, location, what)
+    return steps
+
+def convert(currency_basket, value, currency, target, location = None,
+        what = None):
+    """Convert a value from one currency to another.
+
+    Location and description of what is being converted are only used to
+    produce a helpful error message if the conversion is not possible.
+    """
+    if currency == target:
+        return value
+    timing.count('conversions')
+    for rate, rev in steps_of(currency_basket, currency, target, location, what):
+        if rev:
+            value = (value / rate)
+        else:
+            value = (value * rate)
+    return value
+
+def rate(currency_basket, currency, target, location = None, what = None):
+    """Get the rate used to convert between two currencies, for display.
+
+    For directly connected currencies this is the rate as it was recorded in
+    the book. For triangulated conversions it is the effective rate of the
+    conversion, rounded to four decimal places.
+    """
+    steps = steps_of(currency_basket, currency, target, location, what)
+    if len(steps) == 1:
+        return steps[0][0]
+    return convert(
+        currency_basket,
+        decimal.Decimal(1),
+        currency,
+        target,
+    ).quantize(decimal.Decimal('0.0001'))
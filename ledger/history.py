@@ -0,0 +1,61 @@
+from . import book as ledger_book
+from . import constants
+
+
+# Point-in-time queries.
+#
+# The state of accounts at a point in time is recovered by replaying the book
+# from its beginning up to that point. Only a single point in time is asked
+# about at once (see the --as-of option), so nothing past it is applied, and no
+# state is kept for other points in time.
+
+
+def replay_as_of(book_ir, default_currency, timestamp):
+    """Calculate the state of all accounts at the given point in time.
+
+    The book must be sorted chronologically. It is replayed from its beginning
+    up to the timestamp. Accounts opened after the timestamp are not included,
+    and accounts closed after it are reported as active.
+    """
+    accounts = ledger_book.new_accounts()
+    ledger_book.setup_accounts(accounts, book_ir)
+    currency_basket = ledger_book.new_currency_basket()
+
+    n = ledger_book.count_items_until(book_ir, timestamp)
+    for each in book_ir[:n]:
+        ledger_book.apply_item(accounts, currency_basket, each, default_currency)
+
+    return state_as_of(accounts, (book_ir, currency_basket,), default_currency,
+        timestamp)
+
+def state_as_of(accounts, book, default_currency, timestamp):
+    # Finish the state of accounts to which all items of the book up to the
+    # timestamp were applied.
+    book_ir, currency_basket = book
+    for kind in accounts:
+        for name in list(accounts[kind].keys()):
+            acc = accounts[kind][name]
+            if acc['created'] > timestamp:
+                del accounts[kind][name]
+                continue
+            acc['active'] = ledger_book.active_as_of(acc, timestamp)
+
+    ledger_book.calculate_equity_values(accounts, book, default_currency)
+
+    return {
+        'timestamp': timestamp,
+        'accounts': accounts,
+        'currency_basket': currency_basket,
+        'reserves': ledger_book.calculate_totals(
+            (constants.ACCOUNT_ASSET_T, constants.ACCOUNT_LIABILITY_T,),
+            accounts,
+            currency_basket,
+            default_currency,
+        ),
+        'balances': ledger_book.calculate_totals(
+            constants.ACCOUNT_TYPES,
+            accounts,
+            currency_basket,
+            default_currency,
+        ),
+    }
@@ -0,0 +1,161 @@
+import bisect
+import heapq
+
+from . import ir
+from . import period as ledger_period
+from . import rollup as ledger_rollup
+
+
+# Index of categories of transactions.
+#
+# Transactions are categorised by their tags (lines of their `with` blocks), by
+# the sinks of expenses, and by the faucets of revenues. The index maps each of
+# them to the transactions in that category, so that a per-category aggregation
+# (eg, spending on a tag in each month) only goes through the transactions it
+# is about instead of through the whole book.
+#
+# The index is filled while the book is parsed (see ledger.parser.parse), and
+# finished once the book is sorted: transactions are then identified by their
+# positions in the sorted book, kept in ascending order. As the book is sorted
+# by effective dates, transactions of a category in a period are found by
+# bisecting their positions with the bounds of the period's slice of the book
+# (see ledger.period.slice_of).
+#
+# Tags are indexed by their keys and values. Tags which are plain words (eg,
+# "eating_out") have no value, and attributes (eg, "rate: EUR/PLN 4.4321") are
+# split on the first colon.
+KIND_TAG = 'tag'
+KIND_SINK = 'sink'
+KIND_FAUCET = 'faucet'
+KINDS = (
+    KIND_TAG,
+    KIND_SINK,
+    KIND_FAUCET,
+)
+
+
+def new_index():
+    return {
+        KIND_TAG: {},       # key => value => [transaction, ...]
+        KIND_SINK: {},      # name => [transaction, ...]
+        KIND_FAUCET: {},    # name => [transaction, ...]
+    }
+
+def split_tag(text):
+    text = str(text).strip()
+    if ':' not in text:
+        return (text, None,)
+    key, value = text.split(':', maxsplit = 1)
+    return (key.strip(), value.strip(),)
+
+def add(index, item):
+    """Add an item of the book to the index.
+
+    Items other than transactions are ignored.
+    """
+    if not isinstance(item, ir.Transaction_record):
+        return
+
+    def put(entries, key):
+        if key not in entries:
+            entries[key] = []
+        # A transaction may name the same category twice, but is only listed
+        # once.
+        if (not entries[key]) or entries[key][-1] is not item:
+            entries[key].append(item)
+
+    for each in item.tags:
+        key, value = split_tag(each)
+        if key not in index[KIND_TAG]:
+            index[KIND_TAG][key] = {}
+        put(index[KIND_TAG][key], value)
+    if type(item) is ir.Expense_tx:
+        for each in item.outs:
+            kind, sink = each.account
+            if kind is None:
+                put(index[KIND_SINK], sink)
+    elif type(item) is ir.Revenue_tx:
+        for each in item.ins:
+            put(index[KIND_FAUCET], ledger_rollup.revenue_faucet(each))
+
+def finish(index, book_ir):
+    """Identify indexed transactions by their positions in the sorted book.
+    """
+    position = { id(each): i for i, each in enumerate(book_ir) }
+    def resolve(items):
+        return sorted(position[id(each)] for each in items)
+
+    for key, values in index[KIND_TAG].items():
+        for value, items in values.items():
+            values[value] = resolve(items)
+    for kind in (KIND_SINK, KIND_FAUCET,):
+        for name, items in index[kind].items():
+            index[kind][name] = resolve(items)
+    return index
+
+def build(book_ir):
+    """Build an index of a sorted book which was parsed without one.
+    """
+    index = new_index()
+    for each in book_ir:
+        add(index, each)
+    return finish(index, book_ir)
+
+def names(index, kind):
+    return sorted(index[kind].keys())
+
+def positions_of(index, kind, name, value = None):
+    """Get positions of transactions in a category, in ascending order.
+
+    For tags, the value may be given to only get transactions with the tag
+    having that value. Otherwise, all transactions with the tag are returned
+    whatever its value.
+    """
+    if kind != KIND_TAG:
+        return index[kind].get(name, [])
+    values = index[KIND_TAG].get(name, {})
+    if value is not None:
+        return values.get(value, [])
+    if len(values) == 1:
+        return next(iter(values.values()))
+
+    # A transaction may have the tag more than once, with different values, and
+    # is then listed under each of them. It is only returned once.
+    positions = []
+    for each in heapq.merge(*values.values()):
+        if (not positions) or positions[-1] != each:
+            positions.append(each)
+    return positions
+
+def positions_in(positions, book_ir, period_span):
+    """Narrow positions of transactions down to those in a period.
+    """
+    begin, end = ledger_period.slice_of(book_ir, period_span)
+    return positions[
+        bisect.bisect_left(positions, begin):bisect.bisect_left(positions, end)
+    ]
+
+def monthly(book_ir, positions):
+    """Aggregate expenses and revenues of transactions in each month.
+
+    Returns a list of ((year, month), aggregate, count) tuples, in chronological
+    order, for months with any expenses or revenues among the transactions.
+    Other transactions (eg, transfers) do not contribute to the aggregates, and
+    are not counted.
+    """
+    months = []
+    for i in positions:
+        each = book_ir[i]
+        if type(each) not in (ir.Expense_tx, ir.Revenue_tx,):
+            continue
+        day = each.effective_date()
+        key = (day.year, day.month,)
+        if (not months) or months[-1][0] != key:
+            months.append([key, ledger_rollup.new_aggregate(), 0])
+        month = months[-1]
+        if type(each) is ir.Expense_tx:
+            ledger_rollup.aggregate_expense(month[1], each)
+        else:
+            ledger_rollup.aggregate_revenue(month[1], each)
+        month[2] += 1
+    return [tuple(each) for each in months]
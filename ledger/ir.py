@@ -77,6 +77,8 @@ class Transaction_record(Item):
         if self._effective_date:
             return self._effective_date
         for each in self.tags:
+            if ':' not in str(each):
+                continue
             k, v = str(each).strip().split(':', maxsplit = 1)
             if k == 'effective_date':
                 ed = datetime.datetime.strptime(
@@ -89,6 +91,15 @@ class Transaction_record(Item):
             self._effective_date = self.timestamp
         return self._effective_date
 
+    def plain_tags(self):
+        # Tags are either plain words (eg, "eating_out"), or attributes of the
+        # transaction with values (eg, "effective_date: 2022-07-01T00:00").
+        return [
+            str(each).strip()
+            for each in self.tags
+            if ':' not in str(each)
+        ]
+
 
 class Revenue_tx(Transaction_record):
     pass
@@ -2,6 +2,8 @@ import datetime
 import os
 import re
 
+from . import timing
+
 
 class Location:
     def __init__(self, path, line):
@@ -42,23 +44,27 @@ def ingest_impl(out, raw, source_path, by):
         if re.compile(r'^include ').match(each):
             _, included_path = each.split()
 
-            rawer = None
-            with open(included_path, 'r') as ifstream:
-                rawer = ifstream.read().splitlines()
+            with timing.stage('file', args = { 'path': included_path, }):
+                rawer = None
+                with open(included_path, 'r') as ifstream:
+                    rawer = ifstream.read().splitlines()
+                timing.count('lines', len(rawer))
 
-            ingest_impl(out, rawer, included_path, by + (Location(source_path, i),))
+                ingest_impl(out, rawer, included_path, by + (Location(source_path, i),))
 
             continue
 
         out.append(Line(each, Location(source_path, i), by,))
 
 def ingest(source_path, by):
-    raw = None
-    with open(source_path, 'r') as ifstream:
-        raw = ifstream.read().splitlines()
-
-    source = []
-    ingest_impl(source, raw, source_path, by)
+    with timing.stage('file', args = { 'path': source_path, }):
+        raw = None
+        with open(source_path, 'r') as ifstream:
+            raw = ifstream.read().splitlines()
+        timing.count('lines', len(raw))
+
+        source = []
+        ingest_impl(source, raw, source_path, by)
 
     return source
 
@@ -0,0 +1,390 @@
+from . import book as ledger_book
+from . import constants
+from . import currency as ledger_currency
+
+
+# Machine-readable output.
+#
+# Instead of being rendered on a screen, reports may be emitted as a stream of
+# flat records, each with a "record" field telling its type:
+#
+#   period      expenses and revenues of a period
+#   sink        one of the biggest expense sinks of a period
+#   faucet      one of the biggest revenue faucets of a period
+#   budget      state of a budget as of the end of a period
+#   rolling     expenses and revenues of a rolling window as of a day
+#   category    expenses and revenues of a category of transactions in a month
+#   total       sum of balances of accounts (reserves, or all balances)
+#   balance     balance of an active account
+#   equity      a position held in an equity account
+#
+# Records are written as JSON Lines or CSV. Amounts are written as strings with
+# exact decimal values (monetary amounts rounded to cents, ratios and prices to
+# four decimal places) so they can be read without going through binary
+# floating point. Amounts of expenses are positive, as they are displayed in
+# text reports.
+FORMATS = (
+    'jsonl',
+    'csv',
+)
+
+RECORD_FIELDS = {
+    'period': (
+        'report',
+        'title',
+        'begin',
+        'end',
+        'currency',
+        'expenses',
+        'revenues',
+        'net',
+        'expense_count',
+        'revenue_count',
+        'expense_min',
+        'expense_max',
+        'expense_mean',
+        'expense_median',
+        'expense_p90',
+        'expense_p99',
+    ),
+    'sink': (
+        'report',
+        'rank',
+        'name',
+        'amount',
+        'currency',
+        'percent',
+    ),
+    'faucet': (
+        'report',
+        'rank',
+        'name',
+        'amount',
+        'currency',
+        'percent',
+    ),
+    'budget': (
+        'report',
+        'scope',
+        'name',
+        'kind',
+        'limit',
+        'currency',
+        'allowed',
+        'spent',
+        'remaining',
+        'daily_cap',
+    ),
+    'rolling': (
+        'report',
+        'day',
+        'window',
+        'currency',
+        'expenses',
+        'revenues',
+        'net',
+        'savings_rate',
+    ),
+    'category': (
+        'report',
+        'kind',
+        'name',
+        'value',
+        'month',
+        'currency',
+        'expenses',
+        'revenues',
+        'net',
+        'count',
+    ),
+    'total': (
+        'report',
+        'accounts',
+        'currency',
+        'total',
+        'domestic',
+        'foreign',
+    ),
+    'balance': (
+        'kind',
+        'account',
+        'currency',
+        'balance',
+        'default_currency',
+        'converted',
+        'rate',
+    ),
+    'equity': (
+        'account',
+        'company',
+        'currency',
+        'shares',
+        'price',
+        'worth',
+        'paid',
+        'average_price',
+        'dividends',
+        'gain',
+        'gain_percent',
+        'total_return',
+        'total_return_percent',
+    ),
+}
+
+# Columns of CSV output: the union of fields of all types of records.
+CSV_FIELDS = ['record']
+for fields in RECORD_FIELDS.values():
+    for each in fields:
+        if each not in CSV_FIELDS:
+            CSV_FIELDS.append(each)
+
+
+def amount(value):
+    return (None if value is None else '{:.2f}'.format(value))
+
+def ratio(value):
+    return (None if value is None else '{:.4f}'.format(value))
+
+def magnitude(value):
+    return (None if value is None else abs(value))
+
+def day(value):
+    return value.strftime(constants.DAYSTAMP_FORMAT)
+
+def new_record(record_type, **fields):
+    record = { 'record': record_type, }
+    for each in RECORD_FIELDS[record_type]:
+        record[each] = fields.get(each)
+    return record
+
+
+def period_records(name, report):
+    """Produce records of a day or period report computed by the reporter.
+    """
+    summary = report['summary']
+    default_currency = report['default_currency']
+    period_begin, period_end = report['span']
+
+    ex = summary['expenses']
+    rev = summary['revenues']
+    stats = ex['stats']
+    yield new_record('period',
+        report = name,
+        title = report['name'],
+        begin = day(period_begin),
+        end = day(period_end),
+        currency = default_currency,
+        expenses = amount(abs(ex['total'])),
+        revenues = amount(rev['total']),
+        net = amount(rev['total'] + ex['total']),
+        expense_count = ex['count'],
+        revenue_count = rev['count'],
+        # Expenses are negative, so the smallest is the maximal value.
+        expense_min = amount(magnitude(stats['max'])),
+        expense_max = amount(magnitude(stats['min'])),
+        expense_mean = amount(magnitude(stats['mean'])),
+        expense_median = amount(magnitude(stats['median'])),
+        expense_p90 = amount(magnitude(stats['quantiles'][0.1])),
+        expense_p99 = amount(magnitude(stats['quantiles'][0.01])),
+    )
+
+    for kind, entries, total in (
+            ('sink', ex['top_sinks'], ex['total'],),
+            ('faucet', rev['top_faucets'], rev['total'],),
+    ):
+        for rank, (entry, value) in enumerate(entries, start = 1):
+            yield new_record(kind,
+                report = name,
+                rank = rank,
+                name = entry,
+                amount = amount(abs(value)),
+                currency = default_currency,
+                percent = ratio((value / total * 100) if total else None),
+            )
+
+    for each in summary['budgets']:
+        budget = each['budget']
+        yield new_record('budget',
+            report = name,
+            scope = budget['scope'],
+            name = budget['name'],
+            kind = budget['kind'],
+            limit = str(budget['limit']),
+            currency = default_currency,
+            allowed = amount(each['allowed']),
+            spent = amount(each['spent']),
+            remaining = amount(each['remaining']),
+            daily_cap = amount(each['daily_cap']),
+        )
+
+def rolling_records(name, report):
+    """Produce records of a rolling windows report computed by the reporter,
+    one for each day and window.
+    """
+    series = report['series']
+    default_currency = report['default_currency']
+    for i, each in enumerate(series['days']):
+        for length, window in series['windows'].items():
+            expenses = window['expenses'][i]
+            revenues = window['revenues'][i]
+            yield new_record('rolling',
+                report = name,
+                day = day(each),
+                window = length,
+                currency = default_currency,
+                expenses = amount(expenses),
+                revenues = amount(revenues),
+                net = amount(revenues - expenses),
+                savings_rate = ratio(window['savings_rate'][i]),
+            )
+
+def category_records(name, report):
+    """Produce records of a category report computed by the reporter, one for
+    each month.
+    """
+    kind, category, value = report['category']
+    for each in report['months']:
+        year, month = each['month']
+        yield new_record('category',
+            report = name,
+            kind = kind,
+            name = category,
+            value = value,
+            month = '{:04d}-{:02d}'.format(year, month),
+            currency = report['default_currency'],
+            expenses = amount(each['expenses']),
+            revenues = amount(each['revenues']),
+            net = amount(each['revenues'] - each['expenses']),
+            count = each['count'],
+        )
+
+
+def total_record(name, account_types, accounts, book, default_currency):
+    _, currency_basket = book
+    domestic, foreign = ledger_book.calculate_totals(
+        account_types,
+        accounts,
+        currency_basket,
+        default_currency,
+    )
+    return new_record('total',
+        report = name,
+        accounts = sum(len(accounts[t]) for t in account_types),
+        currency = default_currency,
+        total = amount(domestic + foreign),
+        domestic = amount(domestic),
+        foreign = amount(foreign),
+    )
+
+def balance_records(accounts, book, default_currency):
+    _, currency_basket = book
+    for kind in constants.ACCOUNT_TYPES:
+        for name in sorted(accounts[kind].keys()):
+            acc = accounts[kind][name]
+            if not acc['active']:
+                continue
+
+            converted = acc['balance']
+            rate = None
+            if acc['currency'] != default_currency:
+                converted = None
+                if acc['balance']:
+                    converted = ledger_book.convert_account_balance(
+                        kind,
+                        name,
+                        acc,
+                        currency_basket,
+                        default_currency,
+                    )
+                    rate = ledger_currency.rate(
+                        currency_basket,
+                        acc['currency'],
+                        default_currency,
+                    )
+            yield new_record('balance',
+                kind = kind,
+                account = name,
+                currency = acc['currency'],
+                balance = amount(acc['balance']),
+                default_currency = default_currency,
+                converted = amount(converted),
+                rate = ratio(rate),
+            )
+
+def equity_records(accounts):
+    eq_accounts = accounts[constants.ACCOUNT_EQUITY_T]
+    for name in sorted(eq_accounts.keys()):
+        account = eq_accounts[name]
+        for company in sorted(account['shares'].keys()):
+            shares = account['shares'][company]
+            if not shares['shares']:
+                continue
+            yield new_record('equity',
+                account = name,
+                company = company,
+                currency = account['currency'],
+                shares = str(shares['shares']),
+                price = ratio(shares['price_per_share']),
+                worth = amount(shares['balance']),
+                paid = amount(shares['paid']),
+                average_price = ratio(abs(shares['paid'] / shares['shares'])),
+                dividends = amount(shares['dividends']),
+                gain = amount(shares['gain']['nominal']),
+                gain_percent = ratio(shares['gain']['percent']),
+                total_return = amount(shares['total_return']['nominal']),
+                total_return_percent = ratio(shares['total_return']['percent']),
+            )
+
+def compute_totals(snapshot):
+    """Compute records of totals, balances, and equity positions.
+
+    This is a computation that may be run by the scheduler (see
+    ledger.scheduler).
+    """
+    accounts = snapshot['accounts']
+    book = snapshot['book']
+    default_currency = snapshot['default_currency']
+
+    records = [
+        total_record(
+            'reserves',
+            (constants.ACCOUNT_ASSET_T, constants.ACCOUNT_LIABILITY_T,),
+            accounts,
+            book,
+            default_currency,
+        ),
+        total_record(
+            'balances',
+            constants.ACCOUNT_TYPES,
+            accounts,
+            book,
+            default_currency,
+        ),
+    ]
+    records.extend(balance_records(accounts, book, default_currency))
+    records.extend(equity_records(accounts))
+    return records
+
+
+def write_jsonl(records, stream):
+    import json
+    for each in records:
+        stream.write(json.dumps(each, ensure_ascii = False))
+        stream.write('\n')
+
+def write_csv(records, stream):
+    import csv
+    out = csv.DictWriter(stream, fieldnames = CSV_FIELDS, restval = '')
+    out.writeheader()
+    for each in records:
+        out.writerow(each)
+
+def write(fmt, records, stream):
+    """Write records to a stream, as soon as they are produced.
+    """
+    if fmt == 'jsonl':
+        write_jsonl(records, stream)
+    elif fmt == 'csv':
+        write_csv(records, stream)
+    else:
+        raise ValueError('unknown output format: {}'.format(fmt))
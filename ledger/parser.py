@@ -3,6 +3,7 @@ import decimal
 import re
 import sys
 
+from . import index as ledger_index
 from . import ir
 from . import util
 from . import constants
@@ -529,35 +530,61 @@ def parse_dividend_record(lines):
         tags,
     )
 
-def parse(lines):
+class Lines_from:
+    """View of lines of the book starting at a given line.
+
+    Records are parsed from views instead of slices of the lines, as slicing
+    would copy all remaining lines of the book for every record.
+    """
+    __slots__ = ('lines', 'begin',)
+
+    def __init__(self, lines, begin):
+        self.lines = lines
+        self.begin = begin
+
+    def __getitem__(self, i):
+        return self.lines[self.begin + i]
+
+    def __len__(self):
+        return (len(self.lines) - self.begin)
+
+def parse(lines, index = None):
+    """Parse lines of the book into items.
+
+    If an index is given (see ledger.index) the parsed transactions are added to
+    it.
+    """
     items = []
 
     i = 0
     while i < len(lines):
         each = lines[i]
         parts = str(each).split()
+        rest = Lines_from(lines, i)
 
         n = 0
         item = None
         if parts[0] == 'open':
-            n, item = parse_open_account(lines[i:])
+            n, item = parse_open_account(rest)
         elif parts[0] == 'close':
-            n, item = parse_close_account(lines[i:])
+            n, item = parse_close_account(rest)
         elif parts[0] == 'currency_rates':
-            n, item = parse_currency_rates(lines[i:])
+            n, item = parse_currency_rates(rest)
         elif parts[0] == 'set':
-            n, item = parse_configuration_line(lines[i:])
+            n, item = parse_configuration_line(rest)
         elif parts[0] == 'balance':
-            n, item = parse_balance_record(lines[i:])
+            n, item = parse_balance_record(rest)
         elif parts[0] == 'ex':
-            n, item = parse_expense_record(lines[i:])
+            n, item = parse_expense_record(rest)
         elif parts[0] == 'rx':
-            n, item = parse_revenue_record(lines[i:])
+            n, item = parse_revenue_record(rest)
         elif parts[0] == 'tx':
-            n, item = parse_transfer_record(lines[i:])
+            n, item = parse_transfer_record(rest)
         elif parts[0] == 'dividend':
-            n, item, rx = parse_dividend_record(lines[i:])
+            n, item, rx = parse_dividend_record(rest)
             items.append(rx)
+            if index is not None:
+                ledger_index.add(index, rx)
         else:
             print(type(each), repr(each))
             fmt = 'invalid syntax in `{}`'
@@ -580,6 +607,8 @@ def parse(lines):
 
         if item is not None:
             items.append(item)
+            if index is not None:
+                ledger_index.add(index, item)
         i += n
 
     return items
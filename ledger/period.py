@@ -0,0 +1,217 @@
+import bisect
+import datetime
+import decimal
+import re
+
+from . import book as ledger_book
+from . import ir
+from . import rollup as ledger_rollup
+
+
+# Periods of reports.
+#
+# A period is a pair of timestamps: the first and the last moment of the period
+# (both inclusive, with a precision of a minute). Periods are resolved relative
+# to the current moment, which may be given explicitly to make them
+# reproducible.
+#
+# Transactions of the book are sorted by their effective dates, so the
+# transactions of any period are a contiguous slice of the book, found by
+# bisection instead of by going through the whole book. Short periods are
+# aggregated straight from their slices. Long periods are aggregated from
+# rollups (see ledger.rollup) if they were built.
+
+
+def day_begin(day):
+    return datetime.datetime.combine(day, datetime.time(0, 0))
+
+def day_end(day):
+    return datetime.datetime.combine(day, datetime.time(23, 59))
+
+def now_or(now):
+    return (now or datetime.datetime.now())
+
+def add_months(day, months):
+    """Move a day by a number of months, clamping the day of the month to the
+    length of the resulting month (eg, a month after January 31 is the last day
+    of February).
+    """
+    month = (day.month - 1 + months)
+    year = (day.year + (month // 12))
+    month = ((month % 12) + 1)
+    return datetime.date(year, month, min(day.day, days_in_month(year, month)))
+
+def days_in_month(year, month):
+    if month == 12:
+        return 31
+    return (datetime.date(year, month + 1, 1) - datetime.date(year, month, 1)).days
+
+
+# Resolution of periods.
+def days(first, last):
+    return (day_begin(first), day_end(last),)
+
+def until_now(first, now = None):
+    return (day_begin(first), now_or(now),)
+
+def iso_week(year, week):
+    first = datetime.date.fromisocalendar(year, week, 1)
+    return days(first, first + datetime.timedelta(days = 6))
+
+def this_week(now = None):
+    now = now_or(now)
+    year, week, _ = now.isocalendar()
+    return until_now(datetime.date.fromisocalendar(year, week, 1), now)
+
+def last_week(now = None):
+    year, week, _ = (now_or(now) - datetime.timedelta(days = 7)).isocalendar()
+    return iso_week(year, week)
+
+def quarter(year, q):
+    first = datetime.date(year, (3 * (q - 1)) + 1, 1)
+    return days(first, add_months(first, 3) - datetime.timedelta(days = 1))
+
+def quarter_of(day):
+    return (((day.month - 1) // 3) + 1)
+
+def this_quarter(now = None):
+    now = now_or(now)
+    first, _ = quarter(now.year, quarter_of(now))
+    return until_now(first.date(), now)
+
+def last_quarter(now = None):
+    now = now_or(now)
+    day = add_months(now.date().replace(day = 1), -3)
+    return quarter(day.year, quarter_of(day))
+
+def whole_month(year, month):
+    first = datetime.date(year, month, 1)
+    return days(first, datetime.date(year, month, days_in_month(year, month)))
+
+def whole_year(year):
+    return days(datetime.date(year, 1, 1), datetime.date(year, 12, 31))
+
+def trailing_days(n, now = None):
+    """Last n days, including today.
+    """
+    now = now_or(now)
+    return until_now(now.date() - datetime.timedelta(days = (n - 1)), now)
+
+
+# Textual specifications of periods, as given on the command line. Each pattern
+# is matched against the whole specification, and resolves to a title and a
+# period.
+SPECIFICATIONS = (
+    (r'(\d{4})-W(\d{2})', lambda m, now: (
+        'Week {}-W{}'.format(m[1], m[2]),
+        iso_week(int(m[1]), int(m[2])),
+    )),
+    (r'(\d{4})-Q([1-4])', lambda m, now: (
+        'Quarter {}-Q{}'.format(m[1], m[2]),
+        quarter(int(m[1]), int(m[2])),
+    )),
+    (r'(\d{4})-(\d{2})-(\d{2})', lambda m, now: (
+        'Day {}'.format(m[0]),
+        days(*([datetime.date(int(m[1]), int(m[2]), int(m[3]))] * 2)),
+    )),
+    (r'(\d{4})-(\d{2})', lambda m, now: (
+        'Month {}'.format(m[0]),
+        whole_month(int(m[1]), int(m[2])),
+    )),
+    (r'(\d{4})', lambda m, now: (
+        'Year {}'.format(m[0]),
+        whole_year(int(m[1])),
+    )),
+    (r'last-(\d+)-days', lambda m, now: (
+        'Last {} days'.format(int(m[1])),
+        trailing_days(int(m[1]), now),
+    )),
+    (r'this-week', lambda m, now: ('This week', this_week(now),)),
+    (r'last-week', lambda m, now: ('Last week', last_week(now),)),
+    (r'this-quarter', lambda m, now: ('This quarter', this_quarter(now),)),
+    (r'last-quarter', lambda m, now: ('Last quarter', last_quarter(now),)),
+)
+
+def parse(spec, now = None):
+    """Resolve a textual specification of a period.
+
+    Returns a pair of a title and a period. Raises ValueError if the
+    specification is not understood, or names a period which does not exist
+    (eg, week 54).
+    """
+    for pattern, resolve in SPECIFICATIONS:
+        match = re.fullmatch(pattern, spec)
+        if match is not None:
+            return resolve(match, now)
+    raise ValueError('invalid period: {}'.format(spec))
+
+
+def months_in(period_span):
+    """Count calendar months in a period, counting days of the period as whole.
+
+    The result is exact for periods made of whole months (eg, a year has
+    exactly 12 months), and a remaining part of a month is counted as a
+    fraction of the length of that month.
+    """
+    period_begin, period_end = period_span
+    first = period_begin.date()
+    last = period_end.date()
+
+    months = 0
+    while add_months(first, months + 1) <= (last + datetime.timedelta(days = 1)):
+        months += 1
+    rest_begin = add_months(first, months)
+    rest = ((last - rest_begin).days + 1)
+    length = (add_months(first, months + 1) - rest_begin).days
+    return (decimal.Decimal(months) + (decimal.Decimal(rest) / length))
+
+
+# Index of the book.
+def slice_of(book_ir, period_span):
+    """Find the slice of a sorted book with items of a period.
+
+    Returns a pair of indexes (begin, end) such that book_ir[begin:end] holds
+    items whose effective dates fall on the days of the period.
+    """
+    period_begin, period_end = period_span
+    begin = bisect.bisect_left(
+        book_ir,
+        day_begin(period_begin.date()),
+        key = ledger_book.sorting_key,
+    )
+    end = bisect.bisect_right(
+        book_ir,
+        datetime.datetime.combine(period_end.date(), datetime.time.max),
+        key = ledger_book.sorting_key,
+        lo = begin,
+    )
+    return (begin, end,)
+
+def transactions_of(book_ir, period_span):
+    begin, end = slice_of(book_ir, period_span)
+    return [
+        each
+        for each in book_ir[begin:end]
+        if isinstance(each, ir.Transaction_record)
+    ]
+
+def aggregate(book, period_span):
+    """Aggregate expenses and revenues of a period.
+
+    Rollups are used if they were built, with transactions of days outside whole
+    months taken from slices of the book. Otherwise, the slice of the book with
+    transactions of the period is aggregated.
+    """
+    book_ir, currency_basket = book
+    def aggregate_slice(period_span):
+        begin, end = slice_of(book_ir, period_span)
+        return ledger_rollup.aggregate_items(book_ir[begin:end])
+
+    if currency_basket.get('rollup') is not None:
+        return ledger_rollup.aggregate_period(
+            currency_basket['rollup'],
+            period_span,
+            lambda first, last: aggregate_slice(
+                (day_begin(first), day_begin(last),)),
+        )
+    return aggregate_slice(period_span)
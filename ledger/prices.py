@@ -0,0 +1,121 @@
+import bisect
+import decimal
+
+
+# Price history of shares, and history of positions held in equity accounts.
+#
+# Both are kept in the currency basket, as sorted arrays of timestamps with
+# parallel arrays of values, so that the state at any point in time can be found
+# by bisection. Recording is idempotent: recording the same point again replaces
+# the value stored for that timestamp. This means that a replay of a part of the
+# book may share the stores with the full replay it was derived from.
+#
+# Prices are kept for each position (ie, a pair of an equity account and a
+# company), not for each company. Accounts may record different prices of the
+# same company (eg, brokers valuing shares at different times of day), and the
+# price history of a position must give the same price as the one its account
+# uses for valuation (see ledger.book.calculate_equity_values).
+
+
+def new_price_store():
+    return {}
+
+def new_position_store():
+    return {}
+
+def record_point(series, timestamp, values):
+    timestamps = series['timestamps']
+    i = bisect.bisect_left(timestamps, timestamp)
+    if i < len(timestamps) and timestamps[i] == timestamp:
+        for k, v in values.items():
+            series[k][i] = v
+        return
+    timestamps.insert(i, timestamp)
+    for k, v in values.items():
+        series[k].insert(i, v)
+
+def point_as_of(series, timestamp):
+    i = bisect.bisect_right(series['timestamps'], timestamp)
+    return (i - 1)
+
+def record_price(currency_basket, account, company, timestamp, price):
+    store = currency_basket['prices']
+    key = (account, company,)
+    if key not in store:
+        store[key] = {
+            'timestamps': [],
+            'prices': [],
+        }
+    record_point(store[key], timestamp, { 'prices': price, })
+
+def record_position(currency_basket, account, company, timestamp, position):
+    store = currency_basket['positions']
+    key = (account, company,)
+    if key not in store:
+        store[key] = {
+            'timestamps': [],
+            'shares': [],
+            'paid': [],
+            'fees': [],
+            'dividends': [],
+        }
+    record_point(store[key], timestamp, {
+        'shares': position['shares'],
+        'paid': position['paid'],
+        'fees': position['fees'],
+        'dividends': position['dividends'],
+    })
+
+def price_as_of(currency_basket, account, company, timestamp):
+    """Find the last known price of a share held in an account at the given
+    point in time.
+
+    Returns None if the price was not known at that time.
+    """
+    series = currency_basket['prices'].get((account, company,))
+    if series is None:
+        return None
+    i = point_as_of(series, timestamp)
+    if i < 0:
+        return None
+    return series['prices'][i]
+
+def position_as_of(currency_basket, account, company, timestamp):
+    """Find the state of a position at the given point in time.
+
+    Returns None if the position did not exist at that time.
+    """
+    series = currency_basket['positions'].get((account, company,))
+    if series is None:
+        return None
+    i = point_as_of(series, timestamp)
+    if i < 0:
+        return None
+    return {
+        'shares': series['shares'][i],
+        'paid': series['paid'][i],
+        'fees': series['fees'][i],
+        'dividends': series['dividends'][i],
+    }
+
+def portfolio_value_as_of(currency_basket, timestamp):
+    """Calculate market worth of shares held in each equity account at the given
+    point in time, using the prices known at that time.
+
+    Returns a dict mapping names of equity accounts to their worth. The worth is
+    expressed in the currency of each account.
+    """
+    worth = {}
+    for (account, company), series in currency_basket['positions'].items():
+        i = point_as_of(series, timestamp)
+        if i < 0:
+            continue
+        if account not in worth:
+            worth[account] = decimal.Decimal()
+
+        shares = series['shares'][i]
+        if not shares:
+            continue
+        price = price_as_of(currency_basket, account, company, timestamp)
+        worth[account] += (shares * (price or 0))
+    return worth
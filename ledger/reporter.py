@@ -1,9 +1,17 @@
 import datetime
 import decimal
+import heapq
 import sys
 
+from . import book as ledger_book
+from . import budget as ledger_budget
+from . import currency as ledger_currency
 from . import constants
+from . import index as ledger_index
 from . import ir
+from . import period as ledger_period
+from . import rollup as ledger_rollup
+from . import rolling as ledger_rolling
 from . import util
 
 
@@ -11,106 +19,152 @@ from . import util
 # Add code here instead of to the frontend functions defined lower, unless a
 # specific piece of code is not shared between reports or does not use values
 # calculated here.
-def get_txs_of_period(period_span, txs):
-    period_begin, period_end = period_span
-
-    expenses = []
-    revenues = []
-    for each in txs:
-        if not isinstance(each, ir.Transaction_record):
-            continue
+def summarise_aggregate(aggregate, currency_basket, default_currency):
+    """Convert an aggregate to the default currency.
+
+    Every bucket of the aggregate is converted once.
+    """
+    def convert(value, currency, what):
+        return ledger_currency.convert(
+            currency_basket,
+            value,
+            currency,
+            default_currency,
+            what = '{} in {}'.format(what, currency),
+        )
 
-        if each.effective_date().date() > period_end.date():
-            continue
-        if each.effective_date().date() < period_begin.date():
-            continue
+    def sum_buckets(buckets, what):
+        total = decimal.Decimal()
+        for currency, value in buckets.items():
+            total += convert(value, currency, what)
+        return total
+
+    def merge_buckets(buckets, what):
+        merged = {}
+        for (key, currency), value in buckets.items():
+            ledger_rollup.add_to_bucket(merged, key, convert(value, currency, what))
+        return merged
+
+    # Conversion to the default currency is multiplication by a rate, so
+    # statistics of each currency are converted by scaling them, and merged.
+    # The rate of each currency is looked up once, instead of converting every
+    # amount.
+    rates = {}
+    def rate_of(currency):
+        if currency not in rates:
+            rates[currency] = convert(decimal.Decimal(1), currency, 'expenses')
+        return rates[currency]
+
+    ex = aggregate['expenses']
+    expense_stats = util.math.new_stats()
+    for currency, stats in ex['values'].items():
+        util.math.stats_merge(expense_stats, util.math.stats_scale(
+            stats,
+            rate_of(currency),
+        ))
+    for parts in ex['mixed_values']:
+        util.math.stats_add(expense_stats, sum(
+            (value * rate_of(currency) for value, currency in parts),
+            decimal.Decimal(),
+        ))
 
-        # FIXME currencies
-        if type(each) is ir.Expense_tx:
-            expenses.append(each)
-        elif type(each) is ir.Revenue_tx:
-            revenues.append(each)
+    rev = aggregate['revenues']
+    return {
+        'expenses': {
+            'count': ex['count'],
+            'total': sum_buckets(ex['totals'], 'expenses'),
+            'sinks': merge_buckets(ex['sinks'], 'expenses'),
+            'tags': merge_buckets(ex['tags'], 'expenses'),
+            'stats': expense_stats,
+        },
+        'revenues': {
+            'count': rev['count'],
+            'total': sum_buckets(rev['totals'], 'revenues'),
+            'faucets': merge_buckets(rev['faucets'], 'revenues'),
+            'first': rev['first'],
+            'last': rev['last'],
+        },
+    }
+
+def select_top_entries(summary, monthly_breakdown = None, top = None):
+    """Select the biggest expense sinks and revenue faucets of a summary.
+
+    Only the selected entries are kept in the summary (as lists sorted from the
+    biggest), so renderers do not have to deal with all of them. Unless the
+    number of entries is given explicitly, it depends on the length of the
+    period: longer periods display more entries.
+    """
+    ex = summary['expenses']
+    rev = summary['revenues']
+
+    if top is None:
+        is_all_time_report = (rev['count'] and
+            (rev['last'] - rev['first']).days > 366)
+        top_sinks = 3 + 1 + (2 if monthly_breakdown else 0)
+        top_faucets = 3 + 0 + (3 if monthly_breakdown else 0)
+        if is_all_time_report:
+            top_sinks += 34
+            top_faucets += 39
+    else:
+        top_sinks = top
+        top_faucets = top
 
-    return (expenses, revenues,)
+    # Expenses are negative so the biggest sinks are the smallest values.
+    ex['top_sinks'] = heapq.nsmallest(
+        top_sinks,
+        ex.pop('sinks').items(),
+        key = lambda each: each[1],
+    )
+    rev['top_faucets'] = heapq.nlargest(
+        top_faucets,
+        rev.pop('faucets').items(),
+        key = lambda each: each[1],
+    )
+    return summary
 
-def report_common_impl(to_out, txs, book, default_currency, totals = False,
-        monthly_breakdown = None):
+def compute_common_impl(aggregate, book, default_currency,
+        monthly_breakdown = None, top = None, budgets = None, period_span = None):
     book, currency_basket = book
+    summary = summarise_aggregate(
+        aggregate,
+        currency_basket,
+        default_currency,
+    )
 
-    expenses, revenues = txs
+    # Budgets are calculated from all sinks and tags, before only the biggest
+    # sinks are selected.
+    summary['budgets'] = [
+        ledger_budget.status(each, summary, period_span)
+        for each in (budgets or ())
+    ]
+    summary['expenses'].pop('tags')
+    select_top_entries(summary, monthly_breakdown, top)
+
+    # Only figures derived from the statistics are displayed, and they are much
+    # smaller than the statistics themselves. Expenses are negative so the 10th
+    # and 1st percentiles are the 90th and 99th percentiles of their amounts.
+    ex = summary['expenses']
+    ex['stats'] = util.math.stats_summary(
+        ex['stats'],
+        quantiles = (0.1, 0.01,),
+    )
+    return summary
 
+def render_common_impl(to_out, summary, default_currency, totals = False,
+        monthly_breakdown = None):
     def p(s = ''):
         screen, column = to_out
         screen.print(column, s)
 
-    if (not expenses) and (not revenues):
+    if (not summary['expenses']['count']) and (not summary['revenues']['count']):
         p('  No transactions.')
         p()
         return
 
-    expense_sinks = {}
-    expense_values = []
-    total_expenses = decimal.Decimal()
-    for each in expenses:
-        ins_sum = decimal.Decimal()
-        for exin in each.ins:
-            val = exin.value
-            currency = val[1]
-            if currency == default_currency:
-                val = val[0]
-            else:
-                pair = (currency, default_currency,)
-                rev = False
-                try:
-                    rate = currency_basket['rates'][pair]
-                except KeyError:
-                    try:
-                        pair = (default_currency, currency,)
-                        rate = currency_basket['rates'][pair]
-                        rev = True
-                    except KeyError:
-                        fmt = 'no currency pair {}/{} for {} account named {}'
-                        sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                            util.colors.colorise(
-                                'white',
-                                acc['~'].text[0].location,
-                            ),
-                            util.colors.colorise(
-                                'red',
-                                'error',
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                currency,
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                default_currency,
-                            ),
-                            t,
-                            util.colors.colorise(
-                                'white',
-                                name,
-                            ),
-                        ))
-                        exit(1)
-
-                rate = rate.rate
-                if rev:
-                    val = (val[0] / rate)
-                else:
-                    val = (val[0] * rate)
-
-            ins_sum += val
-        for exout in each.outs:
-            kind, sink = exout.account
-            if kind is not None:
-                continue
-            if sink not in expense_sinks:
-                expense_sinks[sink] = decimal.Decimal()
-            expense_sinks[sink] += ins_sum
-        expense_values.append(ins_sum)
-        total_expenses += ins_sum
+    total_expenses = summary['expenses']['total']
+    expense_stats = summary['expenses']['stats']
+    total_revenues = summary['revenues']['total']
+
     fmt = '  Expenses:   {} {}'.format(
         util.colors.colorise(
             util.colors.COLOR_BALANCE_NEGATIVE,
@@ -128,76 +182,10 @@ def report_common_impl(to_out, txs, book, default_currency, totals = False,
         )
     p(fmt)
 
-    if not revenues:
+    if not summary['revenues']['count']:
         p()
         return
 
-    revenue_faucets = {}
-    revenue_values = []
-    total_revenues = decimal.Decimal()
-    for rx in revenues:
-        rev_sum = decimal.Decimal()
-        for each in rx.outs:
-            value_raw, currency = each.value
-            if currency == default_currency:
-                rev_sum += value_raw
-            else:
-                pair = (currency, default_currency,)
-                rev = False
-                try:
-                    rate = currency_basket['rates'][pair]
-                except KeyError:
-                    try:
-                        pair = (default_currency, currency,)
-                        rate = currency_basket['rates'][pair]
-                        rev = True
-                    except KeyError:
-                        fmt = 'no currency pair {}/{} for rx transaction'
-                        sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                            util.colors.colorise(
-                                'white',
-                                rx.text[0].location,
-                            ),
-                            util.colors.colorise(
-                                'red',
-                                'error',
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                currency,
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                default_currency,
-                            ),
-                        ))
-                        exit(1)
-
-                rate = rate.rate
-                if rev:
-                    rev_sum += (value_raw / rate)
-                else:
-                    rev_sum += (value_raw * rate)
-        for each in rx.ins:
-            kind, faucet = each.account
-
-            # Revenue from an equity account means dividends, and should be
-            # recorded with the company's ticker as the faucet. Lumping all
-            # revenue sources under the exchange's name would be misleading.
-            #
-            # The revenue does not come from NYSE but from company XYZ.
-            if kind == constants.ACCOUNT_EQUITY_T:
-                faucet = '{} ({})'.format(
-                    each.value[0],  # Name of the company, and of
-                    faucet,         # the account in which the shares are held.
-                )
-
-            if faucet not in revenue_faucets:
-                revenue_faucets[faucet] = decimal.Decimal()
-            revenue_faucets[faucet] += rev_sum
-        revenue_values.append(rev_sum)
-        total_revenues += rev_sum
-
     fmt = '  Revenues:   {} {}'.format(
         util.colors.colorise(
             util.colors.COLOR_BALANCE_POSITIVE,
@@ -254,11 +242,11 @@ def report_common_impl(to_out, txs, book, default_currency, totals = False,
     ))
 
     # Expense value ranges, average and median, and other statistics.
-    if expense_values:
-        avg_expense = abs(util.math.mean(expense_values))
-        med_expense = abs(util.math.median(expense_values))
-        max_expense = abs(min(expense_values))
-        min_expense = abs(max(expense_values))
+    if expense_stats['count']:
+        avg_expense = abs(expense_stats['mean'])
+        med_expense = abs(expense_stats['median'])
+        max_expense = abs(expense_stats['min'])
+        min_expense = abs(expense_stats['max'])
         p('  Expense range is {:.2f} ∾ {:.2f} {}.'.format(
             min_expense,
             max_expense,
@@ -273,20 +261,13 @@ def report_common_impl(to_out, txs, book, default_currency, totals = False,
             default_currency,
         ))
 
-    is_all_time_report = ((
-        max(revenues[-1].timestamp, revenues[-1].timestamp)
-        - min(revenues[0].timestamp, revenues[0].timestamp)).days > 366)
-
-    expense_sinks_sorted = sorted(expense_sinks.items(),
-        key = lambda each: each[1])
-    revenue_faucets_sorted = sorted(revenue_faucets.items(),
-        key = lambda each: each[1],
-        reverse = True)
+    expense_sinks_sorted = summary['expenses']['top_sinks']
+    revenue_faucets_sorted = summary['revenues']['top_faucets']
 
-    sink_faucet_value_len = max(
-        expense_sinks_sorted[0][1],
-        revenue_faucets_sorted[0][1])
-    sink_faucet_value_len = len('{:.2f}'.format(abs(sink_faucet_value_len)))
+    # There may be revenues without any expenses in the period, so there may be
+    # no sinks at all.
+    sink_faucet_value_len = max(map(lambda each: len('{:.2f}'.format(abs(each[1]))),
+        expense_sinks_sorted[:1] + revenue_faucets_sorted[:1]))
     fmt_value = lambda value: ('{{:{}.2f}}'
         .format(sink_faucet_value_len)
         .format(value))
@@ -335,20 +316,12 @@ def report_common_impl(to_out, txs, book, default_currency, totals = False,
                 sink_3rd[0],
             ))
 
-        extra_sinks = 1 + (2 if monthly_breakdown else 0)
-
-        if is_all_time_report:
-            extra_sinks += 34
-
         fmt = (
             '               {:3d}th: {} {} {} {}'
             if monthly_breakdown else
             '                 {:1d}th: {} {} {} {}'
         )
-        for n in range(3, 3 + extra_sinks):
-            if n >= len(expense_sinks_sorted):
-                break
-
+        for n in range(3, len(expense_sinks_sorted)):
             sink_nth = expense_sinks_sorted[n]
             p(fmt.format(
                 (n + 1),
@@ -402,20 +375,12 @@ def report_common_impl(to_out, txs, book, default_currency, totals = False,
                 faucet_3rd[0],
             ))
 
-        extra_faucets = 0 + (3 if monthly_breakdown else 0)
-
-        if is_all_time_report:
-            extra_faucets += 39
-
         fmt = (
             '               {:3d}th: {} {} {} {}'
             if monthly_breakdown else
             '                 {:1d}th: {} {} {} {}'
         )
-        for n in range(3, 3 + extra_faucets):
-            if n >= len(revenue_faucets_sorted):
-                break
-
+        for n in range(3, len(revenue_faucets_sorted)):
             faucet_nth = revenue_faucets_sorted[n]
             p(fmt.format(
                 (n + 1),
@@ -427,160 +392,436 @@ def report_common_impl(to_out, txs, book, default_currency, totals = False,
 
     p()
 
-def report_day_impl(to_out, period_day, period_name, book, default_currency):
+def compute_day_impl(period_day, period_name, book, default_currency):
+    book, currency_basket = book
+    return {
+        'name': period_name,
+        'span': (period_day, period_day,),
+        'default_currency': default_currency,
+        'totals': False,
+        'monthly_breakdown': None,
+        'summary': compute_common_impl(
+            aggregate = ledger_period.aggregate(
+                (book, currency_basket,),
+                (period_day, period_day,),
+            ),
+            book = (book, currency_basket,),
+            default_currency = default_currency,
+        ),
+    }
+
+def render_day_impl(to_out, report):
     def p(s = ''):
         screen, column = to_out
         screen.print(column, s)
 
+    period_day, _ = report['span']
     p('{} ({})'.format(
-        util.colors.colorise('white', period_name),
+        util.colors.colorise('white', report['name']),
         util.colors.colorise('white',
             period_day.strftime(constants.DAYSTAMP_FORMAT)),
     ))
+    render_common_impl(
+        to_out,
+        report['summary'],
+        report['default_currency'],
+    )
+
+def report_day_impl(to_out, period_day, period_name, book, default_currency):
+    render_day_impl(
+        to_out,
+        compute_day_impl(period_day, period_name, book, default_currency),
+    )
+
+def compute_period_impl(period_span, period_name, book, default_currency,
+        monthly_breakdown = None, top = None, budgets = None):
+    if monthly_breakdown:
+        monthly_breakdown = ledger_period.months_in(period_span)
+    else:
+        monthly_breakdown = None
+
     book, currency_basket = book
-    report_common_impl(
-        to_out = to_out,
-        txs = get_txs_of_period((period_day, period_day,), book),
-        book = (book, currency_basket,),
-        default_currency = default_currency,
+    return {
+        'name': period_name,
+        'span': period_span,
+        'default_currency': default_currency,
+        'totals': True,
+        'monthly_breakdown': monthly_breakdown,
+        'summary': compute_common_impl(
+            aggregate = ledger_period.aggregate(
+                (book, currency_basket,),
+                period_span,
+            ),
+            book = (book, currency_basket,),
+            default_currency = default_currency,
+            monthly_breakdown = monthly_breakdown,
+            top = top,
+            budgets = budgets,
+            period_span = period_span,
+        ),
+    }
+
+def render_period_impl(to_out, report):
+    def p(s = ''):
+        screen, column = to_out
+        screen.print(column, s)
+
+    period_begin, period_end = report['span']
+    p('{} ({} to {})'.format(
+        util.colors.colorise('white', report['name']),
+        util.colors.colorise('white',
+            period_begin.strftime(constants.DAYSTAMP_FORMAT)),
+        util.colors.colorise('white',
+            period_end.strftime(constants.DAYSTAMP_FORMAT)),
+    ))
+    render_common_impl(
+        to_out,
+        report['summary'],
+        report['default_currency'],
+        totals = report['totals'],
+        monthly_breakdown = report['monthly_breakdown'],
     )
+    render_budgets_impl(
+        to_out,
+        report['summary']['budgets'],
+        report['default_currency'],
+    )
+
+def render_budgets_impl(to_out, budgets, default_currency):
+    def p(s = ''):
+        screen, column = to_out
+        screen.print(column, s)
+
+    if not budgets:
+        return
+
+    fmt = '{:7.2f}'
+    width = max(len(ledger_budget.title_of(each['budget'])) for each in budgets)
+    for each in budgets:
+        title = '{}:'.format(ledger_budget.title_of(each['budget']))
+        p('  Daily expense cap to meet {:{}} {} {}'.format(
+            title,
+            width + 1,
+            util.colors.colorise_balance(each['daily_cap'], fmt),
+            default_currency,
+        ))
+        p('  Total expense cap to meet {:{}} {} {}'.format(
+            title,
+            width + 1,
+            util.colors.colorise_balance(each['remaining'], fmt),
+            default_currency,
+        ))
+    p()
 
 def report_period_impl(to_out, period_span, period_name, book, default_currency,
-        monthly_breakdown = None):
+        monthly_breakdown = None, top = None):
+    render_period_impl(
+        to_out,
+        compute_period_impl(
+            period_span,
+            period_name,
+            book,
+            default_currency,
+            monthly_breakdown = monthly_breakdown,
+            top = top,
+        ),
+    )
+
+def compute_rolling_impl(period_span, period_name, book, default_currency,
+        windows = ledger_rolling.DEFAULT_WINDOWS):
+    return {
+        'name': period_name,
+        'span': period_span,
+        'default_currency': default_currency,
+        'series': ledger_rolling.series(
+            book,
+            default_currency,
+            period_span,
+            windows = windows,
+        ),
+    }
+
+def render_rolling_impl(to_out, report):
     def p(s = ''):
         screen, column = to_out
         screen.print(column, s)
 
-    period_begin, period_end = period_span
+    period_begin, period_end = report['span']
     p('{} ({} to {})'.format(
-        util.colors.colorise('white', period_name),
+        util.colors.colorise('white', report['name']),
         util.colors.colorise('white',
             period_begin.strftime(constants.DAYSTAMP_FORMAT)),
         util.colors.colorise('white',
             period_end.strftime(constants.DAYSTAMP_FORMAT)),
     ))
 
-    if monthly_breakdown:
-        delta = (period_end - period_begin)
-        # FIXME count months instead of calculating an approximation
-        monthly_breakdown = (decimal.Decimal(delta.days) / 30)
-    else:
-        monthly_breakdown = None
+    # Each window is displayed as a group of three columns: money spent and
+    # earned in the window, and the percentage of earnings that was saved.
+    series = report['series']
+    windows = series['windows']
+    p('  {:10}'.format('') + ''.join(
+        '  {:^29}'.format('last {} day(s)'.format(length))
+        for length in windows
+    ))
+    p('  {:10}'.format('Day') + ''.join(
+        '  {:>10} {:>10} {:>7}'.format('Spent', 'Earned', 'Saved')
+        for _ in windows
+    ))
+    for i, day in enumerate(series['days']):
+        row = '  {}'.format(day.strftime(constants.DAYSTAMP_FORMAT))
+        for window in windows.values():
+            rate = window['savings_rate'][i]
+            row += '  {} {} {}'.format(
+                util.colors.colorise(
+                    util.colors.COLOR_BALANCE_NEGATIVE,
+                    '{:10.2f}'.format(window['expenses'][i]),
+                ),
+                util.colors.colorise(
+                    util.colors.COLOR_BALANCE_POSITIVE,
+                    '{:10.2f}'.format(window['revenues'][i]),
+                ),
+                ('{:>7}'.format('-') if rate is None else
+                    util.colors.colorise_balance(rate, '{:6.1f}') + '%'),
+            )
+        p(row)
+    p()
 
-    book, currency_basket = book
-    report_common_impl(
-        to_out = to_out,
-        txs = get_txs_of_period(period_span, book),
-        book = (book, currency_basket,),
-        default_currency = default_currency,
-        totals = True,
-        monthly_breakdown = monthly_breakdown,
+def compute_category_impl(category, period_span, period_name, book,
+        default_currency):
+    """Compute expenses and revenues of a category of transactions (see
+    ledger.index) in each month of a period.
+
+    A category is a (kind, name, value) tuple. Expenses of a sink only count
+    amounts spent on that sink, and revenues of a faucet only amounts coming
+    from that faucet.
+    """
+    book_ir, currency_basket = book
+    kind, name, value = category
+
+    index = currency_basket.get('index')
+    if index is None:
+        index = ledger_index.build(book_ir)
+    positions = ledger_index.positions_in(
+        ledger_index.positions_of(index, kind, name, value),
+        book_ir,
+        period_span,
+    )
+
+    months = []
+    for month, aggregate, count in ledger_index.monthly(book_ir, positions):
+        summary = summarise_aggregate(
+            aggregate,
+            currency_basket,
+            default_currency,
+        )
+        expenses = summary['expenses']['total']
+        revenues = summary['revenues']['total']
+        if kind == ledger_index.KIND_SINK:
+            expenses = summary['expenses']['sinks'].get(name, decimal.Decimal())
+        elif kind == ledger_index.KIND_FAUCET:
+            revenues = summary['revenues']['faucets'].get(name, decimal.Decimal())
+        months.append({
+            'month': month,
+            'count': count,
+            'expenses': abs(expenses),
+            'revenues': revenues,
+        })
+    return {
+        'name': period_name,
+        'span': period_span,
+        'default_currency': default_currency,
+        'category': category,
+        'months': months,
+    }
+
+def render_category_impl(to_out, report):
+    def p(s = ''):
+        screen, column = to_out
+        screen.print(column, s)
+
+    period_begin, period_end = report['span']
+    p('{} ({} to {})'.format(
+        util.colors.colorise('white', report['name']),
+        util.colors.colorise('white',
+            period_begin.strftime(constants.DAYSTAMP_FORMAT)),
+        util.colors.colorise('white',
+            period_end.strftime(constants.DAYSTAMP_FORMAT)),
+    ))
+
+    months = report['months']
+    if not months:
+        p('  No expenses or revenues.')
+        p()
+        return
+
+    def row(title, expenses, revenues, count):
+        return '  {:7}  {} {} {:6d}'.format(
+            title,
+            util.colors.colorise(
+                util.colors.COLOR_BALANCE_NEGATIVE,
+                '{:10.2f}'.format(expenses),
+            ),
+            util.colors.colorise(
+                util.colors.COLOR_BALANCE_POSITIVE,
+                '{:10.2f}'.format(revenues),
+            ),
+            count,
+        )
+
+    p('  {:7}  {:>10} {:>10} {:>6}'.format('Month', 'Spent', 'Earned', 'Count'))
+    for each in months:
+        year, month = each['month']
+        p(row(
+            '{:04d}-{:02d}'.format(year, month),
+            each['expenses'],
+            each['revenues'],
+            each['count'],
+        ))
+    p('    ----')
+    p(row(
+        'Total',
+        sum((each['expenses'] for each in months), decimal.Decimal()),
+        sum((each['revenues'] for each in months), decimal.Decimal()),
+        sum(each['count'] for each in months),
+    ))
+    p()
+
+
+# Periods of frontend reports.
+# Each function resolves a period to a pair of timestamps (the first and the
+# last moment of the period), relative to the current time.
+def span_today():
+    now = datetime.datetime.now()
+    return (now, now,)
+
+def span_yesterday():
+    day = (datetime.datetime.now() - datetime.timedelta(days = 1))
+    return (day, day,)
+
+def span_this_month():
+    period_end = datetime.datetime.now()
+    period_begin = datetime.datetime.strptime(
+        period_end.strftime(constants.THIS_MONTH_FORMAT),
+        constants.TIMESTAMP_FORMAT,
     )
+    return (period_begin, period_end,)
+
+def span_last_month():
+    period_end = datetime.datetime.strptime(
+        datetime.datetime.now().strftime(constants.THIS_MONTH_FORMAT),
+        constants.THIS_MONTH_FORMAT,
+    ) - datetime.timedelta(days = 1)
+    period_begin = datetime.datetime.strptime(
+        period_end.strftime(constants.THIS_MONTH_FORMAT),
+        constants.THIS_MONTH_FORMAT,
+    )
+    return (period_begin, period_end,)
+
+def span_this_year():
+    period_end = datetime.datetime.now()
+    period_begin = datetime.datetime.strptime(
+        period_end.strftime(constants.THIS_YEAR_FORMAT),
+        constants.TIMESTAMP_FORMAT,
+    )
+    return (period_begin, period_end,)
+
+def span_last_year():
+    period_end = datetime.datetime.now()
+    period_begin = datetime.datetime.strptime(
+        constants.THIS_YEAR_FORMAT.replace('%Y', str(period_end.year - 1)),
+        constants.THIS_YEAR_FORMAT,
+    )
+    period_end = constants.LAST_YEAR_DAY_FORMAT.replace('%Y', str(period_end.year - 1))
+    period_end = datetime.datetime.strptime(
+        period_end,
+        constants.TIMESTAMP_FORMAT,
+    )
+    return (period_begin, period_end,)
+
+def first_effective_date(book_ir):
+    for each in book_ir:
+        if isinstance(each, ir.Transaction_record):
+            return each.effective_date()
+    return None
+
+def span_all_time(first):
+    return (first, datetime.datetime.now(),)
 
 
 # Frontend report functions.
 # Add convenience functions here (eg, for for current day, last month) and call
 # them from the UI.
 def report_today(to_out, book, default_currency):
+    period_day, _ = span_today()
     report_day_impl(
         to_out,
-        datetime.datetime.now(),
+        period_day,
         'Today',
         book,
         default_currency,
     )
 
 def report_yesterday(to_out, book, default_currency):
+    period_day, _ = span_yesterday()
     report_day_impl(
         to_out,
-        (datetime.datetime.now() - datetime.timedelta(days = 1)),
+        period_day,
         'Yesterday',
         book,
         default_currency,
     )
 
-def report_this_month(to_out, book, default_currency):
-    period_end = datetime.datetime.now()
-    period_begin = datetime.datetime.strptime(
-        period_end.strftime(constants.THIS_MONTH_FORMAT),
-        constants.TIMESTAMP_FORMAT,
-    )
+def report_this_month(to_out, book, default_currency, top = None):
     report_period_impl(
         to_out,
-        (period_begin, period_end,),
+        span_this_month(),
         'This month',
         book,
         default_currency,
+        top = top,
     )
 
-def report_last_month(to_out, book, default_currency):
-    period_end = datetime.datetime.strptime(
-        datetime.datetime.now().strftime(constants.THIS_MONTH_FORMAT),
-        constants.THIS_MONTH_FORMAT,
-    ) - datetime.timedelta(days = 1)
-    period_begin = datetime.datetime.strptime(
-        period_end.strftime(constants.THIS_MONTH_FORMAT),
-        constants.THIS_MONTH_FORMAT,
-    )
+def report_last_month(to_out, book, default_currency, top = None):
     report_period_impl(
         to_out,
-        (period_begin, period_end,),
+        span_last_month(),
         'Last month',
         book,
         default_currency,
+        top = top,
     )
 
-def report_this_year(to_out, book, default_currency):
-    period_end = datetime.datetime.now()
-    period_begin = datetime.datetime.strptime(
-        period_end.strftime(constants.THIS_YEAR_FORMAT),
-        constants.TIMESTAMP_FORMAT,
-    )
+def report_this_year(to_out, book, default_currency, top = None):
     report_period_impl(
         to_out,
-        (period_begin, period_end,),
+        span_this_year(),
         'This year',
         book,
         default_currency,
         monthly_breakdown = True,
+        top = top,
     )
 
-def report_last_year(to_out, book, default_currency):
-    period_end = datetime.datetime.now()
-    period_begin = datetime.datetime.strptime(
-        constants.THIS_YEAR_FORMAT.replace('%Y', str(period_end.year - 1)),
-        constants.THIS_YEAR_FORMAT,
-    )
-    period_end = constants.LAST_YEAR_DAY_FORMAT.replace('%Y', str(period_end.year - 1))
-    period_end = datetime.datetime.strptime(
-        period_end,
-        constants.TIMESTAMP_FORMAT,
-    )
+def report_last_year(to_out, book, default_currency, top = None):
     report_period_impl(
         to_out,
-        (period_begin, period_end,),
+        span_last_year(),
         'Last year',
         book,
         default_currency,
         monthly_breakdown = True,
+        top = top,
     )
 
-def report_all_time(to_out, book, default_currency):
-    first = None
-    for each in book[0]:
-        if isinstance(each, ir.Transaction_record):
-            first = each
-            break
-
-    period_end = datetime.datetime.now()
-    period_begin = first.effective_date()
+def report_all_time(to_out, book, default_currency, top = None):
     report_period_impl(
         to_out,
-        (period_begin, period_end,),
+        span_all_time(first_effective_date(book[0])),
         'All time',
         book,
         default_currency,
         monthly_breakdown = True,
+        top = top,
     )
 
 ACCOUNT_ASSET_T = 'asset'
@@ -599,58 +840,13 @@ to_stdout = lambda fmt, *args, **kwargs: to_impl(sys.stdout, fmt, *args, **kwarg
 to_stderr = lambda fmt, *args, **kwargs: to_impl(sys.stderr, fmt, *args, **kwargs)
 
 def report_total_impl(to_out, period, account_types, accounts, book, default_currency):
-    reserves_default = decimal.Decimal()
-    reserves_foreign = decimal.Decimal()
-    for t in account_types:
-        for name, acc in accounts[t].items():
-            if not acc['active']:
-                continue
-            if acc['currency'] == default_currency:
-                reserves_default += acc['balance']
-            else:
-                _, currency_basket = book
-
-                pair = (acc['currency'], default_currency,)
-                rev = False
-                try:
-                    rate = currency_basket['rates'][pair]
-                except KeyError:
-                    try:
-                        pair = (default_currency, acc['currency'],)
-                        rate = currency_basket['rates'][pair]
-                        rev = True
-                    except KeyError:
-                        fmt = 'no currency pair {}/{} for {} account named {}'
-                        sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                            util.colors.colorise(
-                                'white',
-                                acc['~'].text[0].location,
-                            ),
-                            util.colors.colorise(
-                                'red',
-                                'error',
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                acc['currency'],
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                default_currency,
-                            ),
-                            t,
-                            util.colors.colorise(
-                                'white',
-                                name,
-                            ),
-                        ))
-                        exit(1)
-
-                rate = rate.rate
-                if rev:
-                    reserves_foreign += (acc['balance'] / rate)
-                else:
-                    reserves_foreign += (acc['balance'] * rate)
+    _, currency_basket = book
+    reserves_default, reserves_foreign = ledger_book.calculate_totals(
+        account_types,
+        accounts,
+        currency_basket,
+        default_currency,
+    )
 
     reserves_total = (reserves_default + reserves_foreign)
 
@@ -747,47 +943,18 @@ def report_total_balances(to_out, accounts, book, default_currency):
             if acc['currency'] != default_currency and acc['balance']:
                 _, currency_basket = book
 
-                pair = (acc['currency'], default_currency,)
-                rev = False
-                try:
-                    rate = currency_basket['rates'][pair]
-                except KeyError:
-                    try:
-                        pair = (default_currency, acc['currency'],)
-                        rate = currency_basket['rates'][pair]
-                        rev = True
-                    except KeyError:
-                        fmt = 'no currency pair {}/{} for {} account named {}'
-                        sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                            util.colors.colorise(
-                                'white',
-                                acc['~'].text[0].location,
-                            ),
-                            util.colors.colorise(
-                                'red',
-                                'error',
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                acc['currency'],
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                default_currency,
-                            ),
-                            t,
-                            util.colors.colorise(
-                                'white',
-                                name,
-                            ),
-                        ))
-                        exit(1)
-
-                rate = rate.rate
-                if rev:
-                    balance_in_default = (balance_raw / rate)
-                else:
-                    balance_in_default = (balance_raw * rate)
+                balance_in_default = ledger_book.convert_account_balance(
+                    t,
+                    name,
+                    acc,
+                    currency_basket,
+                    default_currency,
+                )
+                rate = ledger_currency.rate(
+                    currency_basket,
+                    acc['currency'],
+                    default_currency,
+                )
 
                 # FIXME display % gain/loss depending on exchange rate
                 fmt = ' ≅ {} {} at {} {}/{} rate'
@@ -828,48 +995,14 @@ def report_total_equity(to_out, accounts, book, default_currency):
         gain_nominal = gain['nominal']
         gain_percent = gain['percent']
 
-        if account['currency'] != default_currency:
-            pair = (account['currency'], default_currency,)
-            rev = False
-            try:
-                rate = currency_basket['rates'][pair]
-            except KeyError:
-                try:
-                    pair = (default_currency, account['currency'],)
-                    rate = currency_basket['rates'][pair]
-                    rev = True
-                except KeyError:
-                    fmt = 'no currency pair {}/{} for {} account named {}'
-                    sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                        util.colors.colorise(
-                            'white',
-                            account['~'].text[0].location,
-                        ),
-                        util.colors.colorise(
-                            'red',
-                            'error',
-                        ),
-                        util.colors.colorise(
-                            'white',
-                            account['currency'],
-                        ),
-                        util.colors.colorise(
-                            'white',
-                            default_currency,
-                        ),
-                        t,
-                        util.colors.colorise(
-                            'white',
-                            name,
-                        ),
-                    ))
-                    exit(1)
-
-            rate = rate.rate
-            if rev:
-                gain_nominal = (gain_nominal / rate)
-            else:
-                gain_nominal = (gain_nominal * rate)
+        gain_nominal = ledger_currency.convert(
+            currency_basket,
+            gain_nominal,
+            account['currency'],
+            default_currency,
+            location = account['~'].text[0].location,
+            what = 'equity account named {}'.format(name),
+        )
 
         total_gain.append((gain_nominal, gain_percent,))
 
@@ -926,11 +1059,6 @@ def report_total_equity(to_out, accounts, book, default_currency):
     #        NO-DIVIDEND
     company_name_length += 2
 
-    shares_length = 0
-    if len(account['shares'].keys()):
-        shares_length = max(map(lambda _: len(str(_['shares'])),
-            account['shares'].values()))
-
     for name in sorted(eq_accounts.keys()):
         account = eq_accounts[name]
         total_value = account['balance']
@@ -963,48 +1091,18 @@ def report_total_equity(to_out, accounts, book, default_currency):
             )
 
             if account['currency'] != default_currency:
-                balance_raw = total_value
-                pair = (account['currency'], default_currency,)
-                rev = False
-                try:
-                    rate = currency_basket['rates'][pair]
-                except KeyError:
-                    try:
-                        pair = (default_currency, account['currency'],)
-                        rate = currency_basket['rates'][pair]
-                        rev = True
-                    except KeyError:
-                        fmt = 'no currency pair {}/{} for {} account named {}'
-                        sys.stderr.write(('{}: {}: ' + fmt + '\n').format(
-                            util.colors.colorise(
-                                'white',
-                                account['~'].text[0].location,
-                            ),
-                            util.colors.colorise(
-                                'red',
-                                'error',
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                account['currency'],
-                            ),
-                            util.colors.colorise(
-                                'white',
-                                default_currency,
-                            ),
-                            t,
-                            util.colors.colorise(
-                                'white',
-                                name,
-                            ),
-                        ))
-                        exit(1)
-
-                rate = rate.rate
-                if rev:
-                    balance_in_default = (balance_raw / rate)
-                else:
-                    balance_in_default = (balance_raw * rate)
+                balance_in_default = ledger_book.convert_account_balance(
+                    constants.ACCOUNT_EQUITY_T,
+                    name,
+                    account,
+                    currency_basket,
+                    default_currency,
+                )
+                rate = ledger_currency.rate(
+                    currency_basket,
+                    account['currency'],
+                    default_currency,
+                )
 
                 # FIXME display % gain/loss depending on exchange rate
                 fmt = ' ≅ {} {} at {} {}/{} rate'
@@ -0,0 +1,130 @@
+import datetime
+import decimal
+
+from . import currency as ledger_currency
+from . import rollup as ledger_rollup
+
+
+# Rolling windows.
+#
+# A rolling window is the sum of expenses and revenues of the last N days,
+# calculated for every day of a period (eg, spending of the last 30 days, as of
+# each day of the year). Instead of aggregating the transactions of every window
+# separately, daily amounts are taken from the rollups (see ledger.rollup) and
+# each window slides over them: the amounts of a day entering the window are
+# added to its sums, and the amounts of the day leaving it are subtracted. Every
+# window thus advances in constant time per day, whatever its length.
+#
+# Amounts are converted to the default currency at the same rates as amounts of
+# period reports, so a window gives the same totals as a report of the same
+# days. Sums of Decimal amounts are exact, so subtracting days leaving the
+# window does not accumulate errors.
+DEFAULT_WINDOWS = (7, 30, 90,)
+
+
+def parse_windows(s):
+    """Parse a comma-separated list of lengths of windows, in days.
+    """
+    windows = tuple(sorted(set(int(each) for each in s.split(','))))
+    if (not windows) or windows[0] < 1:
+        raise ValueError('windows must be at least 1 day long')
+    return windows
+
+def daily_amounts(rollup, currency_basket, default_currency, first, last):
+    """Get expenses and revenues of each day from first to last (both
+    inclusive), converted to the default currency.
+
+    Returns a list of (expenses, revenues) pairs. Expenses are positive.
+    """
+    def convert(buckets, what):
+        total = decimal.Decimal()
+        for currency, value in buckets.items():
+            total += ledger_currency.convert(
+                currency_basket,
+                value,
+                currency,
+                default_currency,
+                what = '{} in {}'.format(what, currency),
+            )
+        return total
+
+    zero = (decimal.Decimal(), decimal.Decimal(),)
+    amounts = []
+    day = first
+    one_day = datetime.timedelta(days = 1)
+    while day <= last:
+        cell = rollup['days'].get(day)
+        if cell is None:
+            amounts.append(zero)
+        else:
+            amounts.append((
+                -convert(cell['expenses'], 'expenses'),
+                convert(cell['revenues'], 'revenues'),
+            ))
+        day += one_day
+    return amounts
+
+def savings_rate(expenses, revenues):
+    # Percentage of revenues which was not spent. Unknown without revenues.
+    if not revenues:
+        return None
+    return ((revenues - expenses) / revenues * 100)
+
+def series(book, default_currency, period_span, windows = DEFAULT_WINDOWS):
+    """Calculate rolling windows for every day of a period.
+
+    Windows of the first days of the period reach back before its beginning.
+    Returns a dict with a list of days, and for each window (by its length) the
+    lists of its expenses, revenues, and savings rates (in percent, None for
+    windows without revenues) on each of these days.
+    """
+    _, currency_basket = book
+    period_begin, period_end = period_span
+    begin = period_begin.date()
+    end = period_end.date()
+
+    lead = (max(windows) - 1)
+    amounts = daily_amounts(
+        ledger_rollup.of(book),
+        currency_basket,
+        default_currency,
+        begin - datetime.timedelta(days = lead),
+        end,
+    )
+
+    result = {
+        'days': [],
+        'windows': {
+            each: {
+                'expenses': [],
+                'revenues': [],
+                'savings_rate': [],
+            }
+            for each in windows
+        },
+    }
+    sums = { each: [decimal.Decimal(), decimal.Decimal()] for each in windows }
+    day = begin
+    one_day = datetime.timedelta(days = 1)
+    for i, (expenses, revenues) in enumerate(amounts):
+        for length in windows:
+            window = sums[length]
+            window[0] += expenses
+            window[1] += revenues
+            if i >= length:
+                leaving_expenses, leaving_revenues = amounts[i - length]
+                window[0] -= leaving_expenses
+                window[1] -= leaving_revenues
+
+        if i < lead:
+            continue
+        result['days'].append(day)
+        for length in windows:
+            window_expenses, window_revenues = sums[length]
+            out = result['windows'][length]
+            out['expenses'].append(window_expenses)
+            out['revenues'].append(window_revenues)
+            out['savings_rate'].append(
+                savings_rate(window_expenses, window_revenues))
+        day += one_day
+    return result
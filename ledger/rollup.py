@@ -0,0 +1,281 @@
+import datetime
+import decimal
+
+from . import constants
+from . import ir
+from . import util
+
+
+# Aggregation of transactions.
+# Amounts are summed in their original currencies, in buckets keyed by the
+# currency (and the sink or faucet), and each bucket is converted to the default
+# currency only once when the aggregate is summarised. Converting a sum instead
+# of converting each amount and summing the results gives the same result for
+# multiplication by a rate. For division, the results may only differ past the
+# 28th significant digit due to Decimal rounding, which is invisible in reports.
+#
+# Amounts of expenses are not kept. Statistics of them (see ledger.util.math)
+# are kept in bounded accumulators for each currency instead, so the size of an
+# aggregate does not grow with the number of its expenses. Only expenses paid in
+# more than one currency at once are kept as amounts, as they cannot be placed
+# in statistics of a single currency before they are converted.
+def new_aggregate():
+    return {
+        'expenses': {
+            'count': 0,
+            'totals': {},       # currency => amount
+            'sinks': {},        # (sink, currency) => amount
+            'tags': {},         # (tag, currency) => amount
+            'values': {},       # currency => statistics of expense amounts
+            'mixed_values': [], # [[(amount, currency), ...] for each expense
+                                # paid in more than one currency]
+        },
+        'revenues': {
+            'count': 0,
+            'totals': {},       # currency => amount
+            'faucets': {},      # (faucet, currency) => amount
+            'first': None,      # timestamp of the first revenue
+            'last': None,       # timestamp of the last revenue
+        },
+    }
+
+def add_to_bucket(buckets, key, value):
+    if key not in buckets:
+        buckets[key] = decimal.Decimal()
+    buckets[key] += value
+
+def aggregate_expense(aggregate, each):
+    ex = aggregate['expenses']
+    ex['count'] += 1
+
+    parts = {}
+    for exin in each.ins:
+        value, currency = exin.value
+        add_to_bucket(parts, currency, value)
+
+    for currency, value in parts.items():
+        add_to_bucket(ex['totals'], currency, value)
+    for exout in each.outs:
+        kind, sink = exout.account
+        if kind is not None:
+            continue
+        for currency, value in parts.items():
+            add_to_bucket(ex['sinks'], (sink, currency,), value)
+    for tag in each.plain_tags():
+        for currency, value in parts.items():
+            add_to_bucket(ex['tags'], (tag, currency,), value)
+
+    if len(parts) == 1:
+        (currency, value), = parts.items()
+        if currency not in ex['values']:
+            ex['values'][currency] = util.math.new_stats()
+        util.math.stats_add(ex['values'][currency], value)
+    else:
+        ex['mixed_values'].append([(v, c,) for c, v in parts.items()])
+
+def revenue_faucet(each):
+    kind, faucet = each.account
+
+    # Revenue from an equity account means dividends, and should be
+    # recorded with the company's ticker as the faucet. Lumping all
+    # revenue sources under the exchange's name would be misleading.
+    #
+    # The revenue does not come from NYSE but from company XYZ.
+    if kind == constants.ACCOUNT_EQUITY_T:
+        faucet = '{} ({})'.format(
+            each.value[0],  # Name of the company, and of
+            faucet,         # the account in which the shares are held.
+        )
+    return faucet
+
+def aggregate_revenue(aggregate, rx):
+    rev = aggregate['revenues']
+    rev['count'] += 1
+    if rev['first'] is None:
+        rev['first'] = rx.timestamp
+    rev['last'] = rx.timestamp
+
+    parts = {}
+    for each in rx.outs:
+        value, currency = each.value
+        add_to_bucket(parts, currency, value)
+
+    for currency, value in parts.items():
+        add_to_bucket(rev['totals'], currency, value)
+    for each in rx.ins:
+        faucet = revenue_faucet(each)
+        for currency, value in parts.items():
+            add_to_bucket(rev['faucets'], (faucet, currency,), value)
+
+def aggregate_txs(txs):
+    expenses, revenues = txs
+    aggregate = new_aggregate()
+    for each in expenses:
+        aggregate_expense(aggregate, each)
+    for each in revenues:
+        aggregate_revenue(aggregate, each)
+    return aggregate
+
+def aggregate_items(items):
+    """Aggregate expenses and revenues found among items of the book.
+    """
+    aggregate = new_aggregate()
+    for each in items:
+        if type(each) is ir.Expense_tx:
+            aggregate_expense(aggregate, each)
+        elif type(each) is ir.Revenue_tx:
+            aggregate_revenue(aggregate, each)
+    return aggregate
+
+def merge_aggregate(aggregate, other):
+    """Merge other aggregate into the first one.
+
+    Aggregates must be merged in chronological order for the first and last
+    revenue timestamps to be correct. The other aggregate is not modified.
+    """
+    ex, other_ex = aggregate['expenses'], other['expenses']
+    ex['count'] += other_ex['count']
+    for currency, value in other_ex['totals'].items():
+        add_to_bucket(ex['totals'], currency, value)
+    for key, value in other_ex['sinks'].items():
+        add_to_bucket(ex['sinks'], key, value)
+    for key, value in other_ex['tags'].items():
+        add_to_bucket(ex['tags'], key, value)
+    for currency, stats in other_ex['values'].items():
+        if currency not in ex['values']:
+            ex['values'][currency] = util.math.new_stats()
+        util.math.stats_merge(ex['values'][currency], stats)
+    ex['mixed_values'].extend(other_ex['mixed_values'])
+
+    rev, other_rev = aggregate['revenues'], other['revenues']
+    rev['count'] += other_rev['count']
+    for currency, value in other_rev['totals'].items():
+        add_to_bucket(rev['totals'], currency, value)
+    for key, value in other_rev['faucets'].items():
+        add_to_bucket(rev['faucets'], key, value)
+    if rev['first'] is None:
+        rev['first'] = other_rev['first']
+    if other_rev['last'] is not None:
+        rev['last'] = other_rev['last']
+    return aggregate
+
+
+# Rollups of transactions.
+# Expenses and revenues of the whole book are aggregated once, for each month
+# and for each year (by effective date). A report for any period then merges the
+# coarsest aggregates that fit in it instead of going through all transactions
+# of the book. A report for many years merges a handful of yearly aggregates,
+# plus monthly aggregates and the transactions of the days at its edges (which
+# are found by bisecting the sorted book, see ledger.period.aggregate).
+#
+# For each day only the totals of expenses and revenues in each currency are
+# kept, for rolling windows (see ledger.rolling). Full aggregates of days would
+# hold nearly as many amounts as the book itself.
+def new_rollup():
+    return {
+        'days': {},     # date => totals
+        'months': {},   # (year, month) => aggregate
+        'years': {},    # year => aggregate
+    }
+
+def new_day():
+    return {
+        'expenses': {},     # currency => amount
+        'revenues': {},     # currency => amount
+    }
+
+def aggregate_day(day, each):
+    if type(each) is ir.Expense_tx:
+        totals, postings = day['expenses'], each.ins
+    else:
+        totals, postings = day['revenues'], each.outs
+    for posting in postings:
+        value, currency = posting.value
+        add_to_bucket(totals, currency, value)
+
+def build(book_ir):
+    """Build rollups of expenses and revenues of the book.
+
+    The book must be sorted chronologically.
+    """
+    rollup = new_rollup()
+    for each in book_ir:
+        if type(each) is ir.Expense_tx:
+            aggregate_one = aggregate_expense
+        elif type(each) is ir.Revenue_tx:
+            aggregate_one = aggregate_revenue
+        else:
+            continue
+
+        day = each.effective_date().date()
+        if day not in rollup['days']:
+            rollup['days'][day] = new_day()
+        aggregate_day(rollup['days'][day], each)
+
+        # Aggregating each transaction at every level is the same as summing
+        # aggregates of the finer levels, but cheaper.
+        for level, key in (
+                ('months', (day.year, day.month,),),
+                ('years', day.year,),
+        ):
+            cells = rollup[level]
+            if key not in cells:
+                cells[key] = new_aggregate()
+            aggregate_one(cells[key], each)
+    return rollup
+
+def of(book):
+    """Get rollups of the book, building them on first use.
+
+    Rollups are kept in the currency basket as they do not change after the
+    book is loaded.
+    """
+    book_ir, currency_basket = book
+    if currency_basket.get('rollup') is None:
+        currency_basket['rollup'] = build(book_ir)
+    return currency_basket['rollup']
+
+def last_day_of_month(day):
+    if day.month == 12:
+        return datetime.date(day.year, 12, 31)
+    return (datetime.date(day.year, day.month + 1, 1)
+        - datetime.timedelta(days = 1))
+
+def aggregate_period(rollup, period_span, aggregate_days):
+    """Aggregate expenses and revenues of a period (both ends inclusive) using
+    the rollups.
+
+    Days which do not make up whole months are aggregated by a function called
+    with the first and the last day (both inclusive) of each run of them.
+    """
+    period_begin, period_end = period_span
+    begin = period_begin.date()
+    end = period_end.date()
+
+    aggregate = new_aggregate()
+    def merge(level, key):
+        cell = rollup[level].get(key)
+        if cell is not None:
+            merge_aggregate(aggregate, cell)
+
+    days = []
+    def merge_days():
+        if days:
+            merge_aggregate(aggregate, aggregate_days(days[0], days[-1]))
+            days.clear()
+
+    day = begin
+    while day <= end:
+        if (day.month, day.day,) == (1, 1,) and datetime.date(day.year, 12, 31) <= end:
+            merge_days()
+            merge('years', day.year)
+            day = datetime.date(day.year + 1, 1, 1)
+        elif day.day == 1 and last_day_of_month(day) <= end:
+            merge_days()
+            merge('months', (day.year, day.month,))
+            day = (last_day_of_month(day) + datetime.timedelta(days = 1))
+        else:
+            days.append(day)
+            day += datetime.timedelta(days = 1)
+    merge_days()
+    return aggregate
@@ -0,0 +1,284 @@
+import os
+import time
+
+from . import reporter
+from . import util
+
+
+# Scheduling of reports.
+#
+# Computing a report (aggregating transactions, converting currencies, choosing
+# what to display) is separated from rendering it on a screen. Once the book is
+# loaded and balances are calculated the computations do not depend on each
+# other, so they can be run concurrently in a pool of worker processes. Each
+# worker receives a read-only snapshot of the book (inherited from the parent
+# process where the platform allows it, instead of being pickled for each
+# report) and sends back the results. Rendering is then done in the parent
+# process in the order in which reports were scheduled, so the output does not
+# depend on which computation finished first.
+#
+# A snapshot is a dict with the book, the accounts, the default currency, and
+# the budgets.
+# Jobs are dicts describing a report: its name, the function computing it
+# (called with the snapshot and the arguments of the job), the function
+# rendering it (called with the place to render it to and the result), and the
+# resolved period the report covers. Two jobs with the same name and period
+# produce the same result for the same book, which makes results cacheable.
+#
+# Jobs also declare what must be prepared in the snapshot before they can be
+# computed, so that stages no report needs are skipped:
+#
+#   rollup      rollups of transactions (see ledger.rollup), ie. only
+#               transactions in the period of the report
+#   rates       exchange rates, to convert amounts to the default currency
+#   balances    balances of accounts
+#   equity      valuations of equity accounts
+NEEDS_ROLLUP = 'rollup'
+NEEDS_RATES = 'rates'
+NEEDS_BALANCES = 'balances'
+NEEDS_EQUITY = 'equity'
+
+# Some stages are done by others: balances are calculated together with
+# exchange rates, and equity can only be valued once balances are known.
+NEEDS_IMPLIED = {
+    NEEDS_ROLLUP: (),
+    NEEDS_RATES: (),
+    NEEDS_BALANCES: (NEEDS_RATES,),
+    NEEDS_EQUITY: (NEEDS_BALANCES, NEEDS_RATES,),
+}
+
+
+def new_job(name, compute, args, render, period = None, needs = ()):
+    return {
+        'name': name,
+        'compute': compute,
+        'args': args,
+        'render': render,
+        'period': period,
+        'needs': tuple(needs),
+    }
+
+def needs_of(jobs):
+    """Get the set of stages needed to compute the given jobs.
+    """
+    needs = set()
+    for job in jobs:
+        for each in job['needs']:
+            needs.add(each)
+            needs.update(NEEDS_IMPLIED[each])
+    return needs
+
+def period_of_day(period_day):
+    return (period_day.date(),)
+
+def period_of_span(period_span, monthly_breakdown, top):
+    # Reports are aggregated by days, but the monthly breakdown depends on the
+    # exact length of the period.
+    period_begin, period_end = period_span
+    return (
+        period_begin.date(),
+        period_end.date(),
+        ((period_end - period_begin).days if monthly_breakdown else None),
+        top,
+    )
+
+def new_snapshot(book, accounts, default_currency, budgets = ()):
+    return {
+        'book': book,
+        'accounts': accounts,
+        'default_currency': default_currency,
+        'budgets': budgets,
+    }
+
+
+# Computations run by the workers.
+# They must be module-level functions so that references to them can be sent
+# to worker processes.
+def compute_day(snapshot, period_name, period_day):
+    return reporter.compute_day_impl(
+        period_day,
+        period_name,
+        snapshot['book'],
+        snapshot['default_currency'],
+    )
+
+def compute_period(snapshot, period_name, period_span, monthly_breakdown, top,
+        budgeted = False):
+    return reporter.compute_period_impl(
+        period_span,
+        period_name,
+        snapshot['book'],
+        snapshot['default_currency'],
+        monthly_breakdown = monthly_breakdown,
+        top = top,
+        budgets = (snapshot['budgets'] if budgeted else None),
+    )
+
+def compute_rolling(snapshot, period_name, period_span, windows):
+    return reporter.compute_rolling_impl(
+        period_span,
+        period_name,
+        snapshot['book'],
+        snapshot['default_currency'],
+        windows = windows,
+    )
+
+def compute_category(snapshot, period_name, period_span, category):
+    return reporter.compute_category_impl(
+        category,
+        period_span,
+        period_name,
+        snapshot['book'],
+        snapshot['default_currency'],
+    )
+
+def compute_recorded(snapshot, report):
+    # Reports of totals compute and print at the same time, so their output is
+    # recorded and replayed when rendering.
+    recording = util.screen.Recording()
+    report(
+        (recording, 0,),
+        snapshot['accounts'],
+        snapshot['book'],
+        snapshot['default_currency'],
+    )
+    return recording.lines
+
+def render_recorded(to_out, lines):
+    util.screen.Recording.replay(lines, to_out)
+
+
+# Worker processes.
+# The snapshot is kept in a global variable of each worker, set once when the
+# worker is started.
+worker_snapshot = None
+
+def worker_init(snapshot):
+    global worker_snapshot
+    worker_snapshot = snapshot
+
+def worker_run(job):
+    return run_job(worker_snapshot, job)
+
+def run_job(snapshot, job):
+    # The clock of time.perf_counter() is shared by processes on the platforms
+    # which fork workers, so times measured in workers can be put on the same
+    # timeline as the ones measured in the parent process.
+    began = time.perf_counter()
+    result = job['compute'](snapshot, *job['args'])
+    return {
+        'result': result,
+        'compute_seconds': (time.perf_counter() - began),
+        'compute_began': began,
+        'pid': os.getpid(),
+    }
+
+def pool_context():
+    import multiprocessing
+
+    # Forking lets workers share the snapshot with the parent process without
+    # pickling it.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+def run(snapshot, jobs, workers = 1, cached = None):
+    """Compute all jobs, using the given number of worker processes.
+
+    With one worker (or just one job) the computations are run in the current
+    process, one after another. Jobs whose names are found in the cached dict
+    are not computed, and their results are taken from it. Returns a dict
+    mapping names of jobs to their results, and to the time each computation
+    took (None for cached results).
+    """
+    cached = (cached or {})
+    outcomes = {
+        job['name']: {
+            'result': cached[job['name']],
+            'compute_seconds': None,
+            'compute_began': None,
+            'pid': None,
+        }
+        for job in jobs
+        if job['name'] in cached
+    }
+    pending = [job for job in jobs if job['name'] not in cached]
+    if workers <= 1 or len(pending) <= 1:
+        for job in pending:
+            outcomes[job['name']] = run_job(snapshot, job)
+    else:
+        # Machinery of worker processes takes a while to import, and is only
+        # imported when it is used.
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers = min(workers, len(pending)),
+                mp_context = pool_context(),
+                initializer = worker_init,
+                initargs = (snapshot,),
+        ) as pool:
+            futures = [
+                (job['name'], pool.submit(worker_run, job),)
+                for job in pending
+            ]
+            try:
+                for name, future in futures:
+                    outcomes[name] = future.result()
+            except BaseException:
+                # Do not start computations whose results will not be used.
+                pool.shutdown(cancel_futures = True)
+                raise
+
+    return {
+        job['name']: {
+            'job': job,
+            'result': outcomes[job['name']]['result'],
+            'timings': {
+                'compute': outcomes[job['name']]['compute_seconds'],
+                'render': None,
+                'compute_began': outcomes[job['name']]['compute_began'],
+                'render_began': None,
+                'pid': outcomes[job['name']]['pid'],
+            },
+        }
+        for job in jobs
+    }
+
+def render(results, name, to_out):
+    report = results[name]
+    began = time.perf_counter()
+    report['job']['render'](to_out, report['result'])
+    report['timings']['render'] = (time.perf_counter() - began)
+    report['timings']['render_began'] = began
+
+def timings(results):
+    """Get a breakdown of time spent on each report.
+
+    Returns a list of (name, compute seconds, render seconds) tuples, in the
+    order in which reports were scheduled. Compute time is None for results
+    taken from cache, and render time is None for reports that were not
+    rendered.
+    """
+    return [
+        (name, report['timings']['compute'], report['timings']['render'],)
+        for name, report in results.items()
+    ]
+
+def spans(results, phase):
+    """Get spans of time in which reports were computed or rendered.
+
+    Phase is either "compute" or "render". Returns a list of (name, began,
+    seconds, pid) tuples, where began is a value of time.perf_counter(), and pid
+    is the process in which the report was computed (None for rendering, which
+    is done in the current process). Reports which were not computed (or
+    rendered) are skipped.
+    """
+    return [
+        (
+            name,
+            report['timings'][phase + '_began'],
+            report['timings'][phase],
+            (report['timings']['pid'] if phase == 'compute' else None),
+        )
+        for name, report in results.items()
+        if report['timings'][phase] is not None
+    ]
@@ -0,0 +1,140 @@
+import csv
+import datetime
+import decimal
+
+from . import book as ledger_book
+from . import constants
+from . import currency
+from . import ir
+
+
+def daily_net_worth(book_ir, default_currency, begin = None, end = None):
+    """Calculate daily balances of all accounts in a single pass over the book.
+
+    The book must be sorted chronologically. Items are applied one by one and
+    at every day boundary the balances of all accounts are recorded, together
+    with the total balance converted to the default currency at rates known on
+    that day. The total has the same meaning as the one displayed by the
+    "Balance on all accounts" line of the overview. It is None on days when
+    some open account's balance could not be converted for lack of rates.
+
+    Days between the first item of the book (or the begin date) and the end
+    date (or today) are all included, even if nothing happened on them.
+
+    Returns a dict of columns: a list of days, a list of totals, and for each
+    account a list of its balances in its own currency and converted to the
+    default currency. Balances of accounts that were not open on a given day
+    are recorded as None.
+    """
+    accounts = ledger_book.new_accounts()
+    ledger_book.setup_accounts(accounts, book_ir)
+    currency_basket = ledger_book.new_currency_basket()
+    book = (book_ir, currency_basket,)
+
+    columns = [
+        (kind, name,)
+        for kind in constants.ACCOUNT_TYPES
+        for name in sorted(accounts[kind].keys())
+    ]
+    series = {
+        'default_currency': default_currency,
+        'accounts': columns,
+        'currencies': [accounts[k][n]['currency'] for k, n in columns],
+        'days': [],
+        'total': [],
+        'balance': { each: [] for each in columns },
+        'converted': { each: [] for each in columns },
+    }
+
+    def emit(day):
+        end_of_day = datetime.datetime.combine(day, datetime.time.max)
+        for kind, name in columns:
+            acc = accounts[kind][name]
+            acc['active'] = ledger_book.active_as_of(acc, end_of_day)
+        if accounts[constants.ACCOUNT_EQUITY_T]:
+            ledger_book.calculate_equity_values(accounts, book, default_currency)
+
+        # Totals are only known for days on which balances of all open
+        # accounts could be converted to the default currency. Before the
+        # first exchange rate for an account's currency is recorded, the total
+        # (and the account's converted balance) is unknown.
+        total = decimal.Decimal()
+        for kind, name in columns:
+            acc = accounts[kind][name]
+            balance = None
+            converted = None
+            if acc['active']:
+                balance = acc['balance']
+                if currency.can_convert(
+                        currency_basket,
+                        acc['currency'],
+                        default_currency):
+                    converted = ledger_book.convert_account_balance(
+                        kind,
+                        name,
+                        acc,
+                        currency_basket,
+                        default_currency,
+                    )
+                if converted is None:
+                    total = None
+                elif total is not None:
+                    total += converted
+            series['balance'][(kind, name,)].append(balance)
+            series['converted'][(kind, name,)].append(converted)
+
+        series['days'].append(day)
+        series['total'].append(total)
+
+    end = (end or datetime.date.today())
+    day = begin
+    one_day = datetime.timedelta(days = 1)
+    for each in book_ir:
+        # Configuration has no meaningful timestamp and must not move the first
+        # day of the series to the epoch.
+        if type(each) is ir.Configuration_line:
+            continue
+
+        this_day = ledger_book.sorting_key(each).date()
+        if this_day > end:
+            break
+        if day is None:
+            day = this_day
+
+        # Crossing a day boundary. Record the state of each day that passed
+        # before applying the item.
+        while day < this_day:
+            emit(day)
+            day += one_day
+
+        ledger_book.apply_item(accounts, currency_basket, each, default_currency)
+
+    while day is not None and day <= end:
+        emit(day)
+        day += one_day
+
+    return series
+
+def write_csv(series, stream):
+    default_currency = series['default_currency']
+    columns = series['accounts']
+
+    header = ['day', 'total [{}]'.format(default_currency)]
+    for (kind, name), currency in zip(columns, series['currencies']):
+        header.append('{}/{} [{}]'.format(kind, name, currency))
+        header.append('{}/{} [{}]'.format(kind, name, default_currency))
+
+    def fmt(value):
+        return ('' if value is None else '{:.2f}'.format(value))
+
+    out = csv.writer(stream)
+    out.writerow(header)
+    for i, day in enumerate(series['days']):
+        row = [
+            day.strftime(constants.DAYSTAMP_FORMAT),
+            fmt(series['total'][i]),
+        ]
+        for each in columns:
+            row.append(fmt(series['balance'][each][i]))
+            row.append(fmt(series['converted'][each][i]))
+        out.writerow(row)
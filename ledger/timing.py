@@ -0,0 +1,224 @@
+import contextlib
+import os
+import sys
+import time
+
+
+# Instrumentation of the pipeline.
+#
+# Processing of a book is divided into stages (loading, parsing, sorting,
+# calculating balances, computing reports, etc). Stages may be nested, and each
+# stage records the time it took, counts of items it processed (eg, lines,
+# records, postings, conversions), and optionally the peak of memory allocated
+# while it was running.
+#
+# Instrumentation is disabled by default and then stage() and count() do almost
+# nothing, so they can be left in the code. It is enabled by calling start(),
+# which returns the root stage. Stages are dicts:
+#
+#   name        name of the stage
+#   seconds     wall-clock time the stage took
+#   counts      dict mapping names of counted items to their counts
+#   args        dict of other details of the stage (eg, path of a loaded file)
+#   memory      peak of memory allocated during the stage, in bytes above the
+#               memory allocated when the stage started (None if memory is not
+#               traced)
+#   began       value of time.perf_counter() when the stage started
+#   pid         process in which the stage ran
+#   children    list of nested stages, in the order in which they started
+#
+# Stages run in worker processes (see ledger.scheduler) are not seen by the
+# instrumentation of the parent process. Their times may be added to the
+# current stage with record().
+#
+# Stages may be exported as a timeline (see ledger.trace).
+
+ROOT = None
+CURRENT = None
+TRACE_MEMORY = False
+
+
+def new_stage(name, args = None):
+    return {
+        'name': name,
+        'seconds': None,
+        'counts': {},
+        'args': dict(args or {}),
+        'memory': None,
+        'began': None,
+        'pid': os.getpid(),
+        'children': [],
+        'parent': None,
+        'memory_base': None,
+        'memory_peak': None,
+    }
+
+def enabled():
+    return (CURRENT is not None)
+
+def start(name = 'total', trace_memory = False):
+    """Enable instrumentation and start the root stage.
+
+    With memory tracing enabled, the peak of memory allocated during each stage
+    is recorded using tracemalloc. This slows the program down considerably.
+    """
+    global ROOT, CURRENT, TRACE_MEMORY
+    TRACE_MEMORY = trace_memory
+    if TRACE_MEMORY:
+        import tracemalloc
+        tracemalloc.start()
+    ROOT = new_stage(name)
+    CURRENT = ROOT
+    enter(ROOT)
+    return ROOT
+
+def stop():
+    """Finish all stages which are still running and disable instrumentation.
+
+    Returns the root stage.
+    """
+    global CURRENT
+    root = ROOT
+    while CURRENT is not None:
+        leave(CURRENT)
+        CURRENT = CURRENT['parent']
+    if TRACE_MEMORY:
+        import tracemalloc
+        tracemalloc.stop()
+    return root
+
+def traced_memory():
+    import tracemalloc
+    return tracemalloc.get_traced_memory()
+
+def enter(stage):
+    if TRACE_MEMORY:
+        import tracemalloc
+        current, peak = traced_memory()
+        # The peak is reset for each stage, so the peak of the enclosing stage
+        # is carried over before it is lost.
+        parent = stage['parent']
+        if parent is not None:
+            parent['memory_peak'] = max(parent['memory_peak'], peak)
+        tracemalloc.reset_peak()
+        stage['memory_base'] = current
+        stage['memory_peak'] = current
+    stage['began'] = time.perf_counter()
+
+def leave(stage):
+    stage['seconds'] = (time.perf_counter() - stage['began'])
+    if TRACE_MEMORY:
+        _, peak = traced_memory()
+        stage['memory_peak'] = max(stage['memory_peak'], peak)
+        stage['memory'] = (stage['memory_peak'] - stage['memory_base'])
+        parent = stage['parent']
+        if parent is not None:
+            parent['memory_peak'] = max(
+                parent['memory_peak'],
+                stage['memory_peak'],
+            )
+
+@contextlib.contextmanager
+def stage(name, args = None, **counts):
+    """Time a stage of the pipeline, nested in the current one.
+
+    Counts given as keyword arguments are added to the counts of the stage.
+    """
+    global CURRENT
+    if CURRENT is None:
+        yield None
+        return
+
+    this = new_stage(name, args)
+    this['parent'] = CURRENT
+    this['counts'].update(counts)
+    CURRENT['children'].append(this)
+    CURRENT = this
+    enter(this)
+    try:
+        yield this
+    finally:
+        leave(this)
+        CURRENT = this['parent']
+
+def count(name, n = 1):
+    """Count items processed by the current stage.
+    """
+    if CURRENT is None:
+        return
+    counts = CURRENT['counts']
+    counts[name] = (counts.get(name, 0) + n)
+
+def annotate(**args):
+    """Add details to the current stage.
+    """
+    if CURRENT is None:
+        return
+    CURRENT['args'].update(args)
+
+def record(name, seconds, began = None, pid = None, args = None, **counts):
+    """Record a stage which was timed elsewhere (eg, in a worker process), as
+    nested in the current one.
+    """
+    if CURRENT is None:
+        return
+    this = new_stage(name, args)
+    this['parent'] = CURRENT
+    this['seconds'] = seconds
+    this['began'] = began
+    this['pid'] = (pid or this['pid'])
+    this['counts'].update(counts)
+    CURRENT['children'].append(this)
+    return this
+
+
+def walk(stage, depth = 0):
+    yield (depth, stage,)
+    for each in stage['children']:
+        yield from walk(each, depth + 1)
+
+def format_bytes(n):
+    if n is None:
+        return ''
+    for unit in ('B', 'KiB', 'MiB',):
+        if abs(n) < 1024:
+            return '{:.1f} {}'.format(n, unit)
+        n /= 1024
+    return '{:.1f} GiB'.format(n)
+
+def summary(root, stream = None):
+    """Write a summary of stages: their times, shares of the total time,
+    counts, and peaks of memory (if memory was traced).
+    """
+    stream = (stream or sys.stderr)
+    total = (root['seconds'] or 0)
+    traced = any(stage['memory'] is not None for _, stage in walk(root))
+
+    rows = []
+    for depth, stage in walk(root):
+        seconds = stage['seconds']
+        rows.append((
+            ('  ' * depth) + stage['name'],
+            ('' if seconds is None else '{:.1f} ms'.format(seconds * 1000)),
+            ('' if (seconds is None or not total)
+                else '{:.1f}%'.format(seconds / total * 100)),
+            (format_bytes(stage['memory']) if traced else ''),
+            ', '.join(
+                ['{} {}'.format(v, k) for k, v in stage['counts'].items()]
+                + ['{}={}'.format(k, v) for k, v in stage['args'].items()]
+            ),
+        ))
+
+    header = ('stage', 'time', 'share', ('peak memory' if traced else ''), '',)
+    widths = [
+        max(len(row[i]) for row in (rows + [header]))
+        for i in range(4)
+    ]
+    for row in ([header] + rows):
+        stream.write('{:<{}}  {:>{}}  {:>{}}  {:>{}}  {}'.format(
+            row[0], widths[0],
+            row[1], widths[1],
+            row[2], widths[2],
+            row[3], widths[3],
+            row[4],
+        ).rstrip() + '\n')
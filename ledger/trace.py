@@ -0,0 +1,77 @@
+import os
+
+from . import timing
+
+
+# Export of stages of processing as a timeline.
+#
+# Stages recorded by the instrumentation (see ledger.timing) are written in the
+# Chrome trace-event format: a JSON object with a list of events, each
+# describing a span of time (a "complete" event) in a process. Such files can be
+# opened in any viewer of traces (eg, chrome://tracing, Perfetto, Speedscope)
+# without running any service.
+#
+# Stages become spans, with their counts and details (eg, the path of a loaded
+# file, or the number of parsed records) as arguments. Spans are placed on the
+# timeline of the process in which they ran, so reports computed by worker
+# processes are displayed next to each other, and next to the main process.
+
+
+def microseconds(seconds):
+    return round(seconds * 1000000, 3)
+
+def span_event(stage, origin):
+    args = {}
+    args.update(stage['counts'])
+    args.update(stage['args'])
+    return {
+        'name': stage['name'],
+        'cat': 'ledger',
+        'ph': 'X',
+        'ts': microseconds(stage['began'] - origin),
+        'dur': microseconds(stage['seconds']),
+        'pid': stage['pid'],
+        'tid': stage['pid'],
+        'args': args,
+    }
+
+def process_name_event(pid, name):
+    return {
+        'name': 'process_name',
+        'ph': 'M',
+        'pid': pid,
+        'tid': pid,
+        'args': { 'name': name, },
+    }
+
+def events(root):
+    """Produce trace events of a tree of stages.
+
+    Stages without a known beginning (ie, recorded without a time at which
+    they started) are skipped, as they cannot be placed on the timeline.
+    """
+    origin = root['began']
+    main_pid = os.getpid()
+    pids = set()
+    spans = []
+    for _, stage in timing.walk(root):
+        if stage['began'] is None or stage['seconds'] is None:
+            continue
+        pids.add(stage['pid'])
+        spans.append(span_event(stage, origin))
+
+    names = [process_name_event(main_pid, 'ledger')]
+    for i, pid in enumerate(sorted(pids - {main_pid}), start = 1):
+        names.append(process_name_event(pid, 'worker {}'.format(i)))
+    return (names + spans)
+
+def write(root, path):
+    # Only imported when a trace is written (see ledger/__init__.py for the
+    # rationale).
+    import json
+    with open(path, 'w') as ofstream:
+        json.dump({
+            'traceEvents': events(root),
+            'displayTimeUnit': 'ms',
+        }, ofstream)
+        ofstream.write('\n')
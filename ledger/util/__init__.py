@@ -1,4 +1,22 @@
-import ledger.util.colors
-import ledger.util.screen
-import ledger.util.string
-import ledger.util.math
+import importlib
+
+
+# Submodules are imported lazily, when they are first used. See ledger/__init__.py
+# for the rationale.
+SUBMODULES = (
+    'colors',
+    'screen',
+    'string',
+    'math',
+)
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__,
+        name,
+    ))
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(SUBMODULES))
@@ -1,15 +1,60 @@
-try:
-    import colored
-except ImportError:
-    colored = None
+import math
+import os
+import sys
+
+# The colored package is only imported when colors are wanted.
+colored = None
 
 
 # Colorisation utilities.
+#
+# Colors are only used if the colored package is available, the standard output
+# is a terminal, and the user did not opt out by setting NO_COLOR (see
+# https://no-color.org/). Escape sequences are resolved once for each named
+# color and kept in a table, so colorising text is a lookup and a concatenation.
+# Without colors, colorising text only converts it to a string.
+ESCAPES = {}
+RESET = ''
+ENABLED = False
+
+def import_colored():
+    global colored
+    if colored is None:
+        try:
+            import colored
+        except ImportError:
+            return None
+    return colored
+
+def colors_wanted(stream = None):
+    if os.environ.get('NO_COLOR'):
+        return False
+    stream = (stream or sys.stdout)
+    try:
+        if not stream.isatty():
+            return False
+    except (AttributeError, ValueError):
+        return False
+    return (import_colored() is not None)
+
+def set_enabled(enabled):
+    global ENABLED, RESET
+    ENABLED = bool(enabled and import_colored() is not None)
+    RESET = (colored.attr('reset') if ENABLED else '')
+    ESCAPES.clear()
+
+def escape(color):
+    code = ESCAPES.get(color)
+    if code is None:
+        code = colored.fg(color)
+        ESCAPES[color] = code
+    return code
+
 def colorise_if_possible(color, s):
     s = str(s)
-    if colored is None:
+    if not ENABLED:
         return s
-    return (colored.fg(color) + s + colored.attr('reset'))
+    return (escape(color) + s + RESET)
 
 def colorise(color, s):
     return colorise_if_possible(color, s)
@@ -100,12 +145,12 @@ RATIO_COLORS = tuple(
 )
 
 def COLOR_SPENT_RATIO(percent):
-    for (low, high), colour in RATIO_COLORS:
-        low_match = (percent >= low)
-        high_match = (percent <= high)
-        if low_match and high_match:
-            break
-    return colour
+    # Buckets include both of their bounds, and a value on the boundary of two
+    # buckets belongs to the lower one. Values out of range get the last color.
+    if not (0 <= percent <= 100):
+        return RATIO_COLORS[-1][1]
+    n = math.ceil(percent * len(RATIO_COLORS) / 100)
+    return RATIO_COLORS[max(n - 1, 0)][1]
 
 def COLOR_SPENT_RATIO_old(percentage_spent):
     # Monthly revenues allow living for...
@@ -126,3 +171,5 @@ def COLOR_SPENT_RATIO_old(percentage_spent):
         return 'red_3b'
 
     return 'red_3a'
+
+set_enabled(colors_wanted())
@@ -1,3 +1,7 @@
+import decimal
+import math
+
+
 def mean(seq):
     return sum(seq) / len(seq)
 
@@ -14,7 +18,248 @@ def median(seq):
     else:
         return seq[n]
 
+def quantile(seq, q):
+    # Linear interpolation between the closest ranks, so the 0.5-quantile is the
+    # median.
+    seq = sorted(seq)
+    rank = (q * (len(seq) - 1))
+    lower = math.floor(rank)
+    if rank == lower:
+        return seq[lower]
+    fraction = decimal.Decimal(repr(rank - lower))
+    return (seq[lower] + ((seq[lower + 1] - seq[lower]) * fraction))
+
 def diff_less_than(a, b, percent_diff):
     a_more = a * (1 + percent_diff)
     a_less = a * (1 - percent_diff)
     return (b < a_more) and (b > a_less)
+
+
+# Streaming statistics.
+#
+# An accumulator of statistics is updated one value at a time and gives exact
+# count, sum, minimum, maximum, and mean of the values added to it. Quantiles
+# (including the median) are exact as long as the accumulator holds at most
+# STATS_EXACT_VALUES values, which are then kept as they are. Above that, they
+# are estimated from a sketch of logarithmically sized buckets (as in DDSketch)
+# with a bounded relative error. The sketch is always kept, and values are
+# dropped once there are too many of them, so the size of an accumulator does
+# not depend on the number of values added to it: it is bounded by the number of
+# buckets, which only grows with the logarithm of the range of the values (and
+# is capped). Accumulators can be merged, so statistics can be computed
+# separately for parts of the data (periods, currencies, workers) and combined,
+# at a cost proportional to the number of buckets instead of the number of
+# values.
+#
+# Scaling an accumulator (eg, converting it to another currency) does not move
+# values to other buckets, as every move could add another error on top of the
+# error of the bucket. Instead, representative values of buckets are scaled and
+# kept as points (ie, values with counts) next to the buckets. Their number is
+# bounded by the number of buckets of accumulators that were scaled.
+#
+# bench/sketch.py checks quantiles against exact ones on random data.
+STATS_EXACT_VALUES = 256
+
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_GAMMA = ((1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY))
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+# Maximum number of buckets for each sign of values. Buckets of values from
+# 0.01 to 10 million take about 1000 buckets, so the cap is only reached by
+# unusually wide ranges. Then, buckets of the smallest magnitudes are collapsed
+# into one, so only quantiles among the smallest values lose accuracy.
+SKETCH_MAX_BUCKETS = 2048
+
+def new_stats():
+    return {
+        'count': 0,
+        'sum': decimal.Decimal(),
+        'min': None,
+        'max': None,
+        'values': [],       # every value, or None if there are too many
+        'sketch': {
+            'negative': {}, # bucket index => count
+            'zero': 0,
+            'positive': {}, # bucket index => count
+            'points': [],   # (value, count) of buckets of scaled accumulators
+        },
+    }
+
+def sketch_index(value):
+    return math.ceil(math.log(abs(value)) / SKETCH_LOG_GAMMA)
+
+def sketch_value(i):
+    # Representative magnitude of values in a bucket, within the relative
+    # accuracy of every value in it.
+    return (2 * (SKETCH_GAMMA ** i) / (SKETCH_GAMMA + 1))
+
+def sketch_collapse(store):
+    if len(store) <= SKETCH_MAX_BUCKETS:
+        return
+    indexes = sorted(store)
+    excess = indexes[:(len(indexes) - SKETCH_MAX_BUCKETS + 1)]
+    lowest = excess[-1]
+    for i in excess[:-1]:
+        store[lowest] += store.pop(i)
+
+def sketch_points(sketch):
+    # Representative values of buckets, and points, with their counts.
+    return (
+        [(-sketch_value(i), count) for i, count in sketch['negative'].items()]
+        + [(0.0, sketch['zero'])]
+        + [(sketch_value(i), count) for i, count in sketch['positive'].items()]
+        + sketch['points']
+    )
+
+def sketch_add(sketch, value, count = 1):
+    if not value:
+        sketch['zero'] += count
+        return
+    store = sketch[('positive' if value > 0 else 'negative')]
+    i = sketch_index(float(value))
+    if i in store:
+        store[i] += count
+        return
+    store[i] = count
+    sketch_collapse(store)
+
+def stats_add(stats, value):
+    stats['count'] += 1
+    stats['sum'] += value
+    if stats['min'] is None or value < stats['min']:
+        stats['min'] = value
+    if stats['max'] is None or value > stats['max']:
+        stats['max'] = value
+    if stats['values'] is not None:
+        if len(stats['values']) < STATS_EXACT_VALUES:
+            stats['values'].append(value)
+        else:
+            stats['values'] = None
+    sketch_add(stats['sketch'], value)
+
+def stats_merge(stats, other):
+    """Merge other accumulator into stats.
+    """
+    if not other['count']:
+        return stats
+    stats['count'] += other['count']
+    stats['sum'] += other['sum']
+    if stats['min'] is None or other['min'] < stats['min']:
+        stats['min'] = other['min']
+    if stats['max'] is None or other['max'] > stats['max']:
+        stats['max'] = other['max']
+    if (stats['values'] is None or other['values'] is None
+            or stats['count'] > STATS_EXACT_VALUES):
+        stats['values'] = None
+    else:
+        stats['values'].extend(other['values'])
+
+    sketch = stats['sketch']
+    sketch['zero'] += other['sketch']['zero']
+    for sign in ('negative', 'positive',):
+        store = sketch[sign]
+        for i, count in other['sketch'][sign].items():
+            store[i] = (store.get(i, 0) + count)
+        sketch_collapse(store)
+    sketch['points'].extend(other['sketch']['points'])
+    return stats
+
+def stats_scale(stats, factor):
+    """Multiply every value in the accumulator by a positive factor (eg, an
+    exchange rate).
+
+    Returns a new accumulator. Representative values of buckets of the sketch
+    are scaled and kept as points, so the cost depends on the number of buckets
+    instead of the number of values, and the relative error of every estimate
+    stays as it was.
+    """
+    scaled = new_stats()
+    if not stats['count']:
+        return scaled
+    scaled['count'] = stats['count']
+    scaled['sum'] = (stats['sum'] * factor)
+    scaled['min'] = (stats['min'] * factor)
+    scaled['max'] = (stats['max'] * factor)
+    if stats['values'] is None:
+        scaled['values'] = None
+    else:
+        scaled['values'] = [(each * factor) for each in stats['values']]
+
+    sketch = stats['sketch']
+    scaled['sketch']['zero'] = sketch['zero']
+    factor = float(factor)
+    scaled['sketch']['points'] = [
+        ((value * factor), count,)
+        for value, count in sketch_points(sketch)
+        if value
+    ]
+    return scaled
+
+def stats_mean(stats):
+    return (stats['sum'] / stats['count'])
+
+def stats_median(stats):
+    return stats_quantile(stats, 0.5)
+
+def stats_quantile(stats, q):
+    """Find q-quantile (0 <= q <= 1) of values in the accumulator.
+
+    The quantile is exact if the accumulator still holds its values. Otherwise,
+    the estimate is within SKETCH_RELATIVE_ACCURACY of the exact value. If the
+    quantile falls between two values (eg, the median of an even number of
+    values) they are interpolated. Returns None if no values were added.
+    """
+    if not stats['count']:
+        return None
+    if q <= 0:
+        return stats['min']
+    if q >= 1:
+        return stats['max']
+    if stats['values'] is not None:
+        return quantile(stats['values'], q)
+
+    points = sorted(sketch_points(stats['sketch']))
+    def value_at(rank):
+        seen = 0
+        for value, count in points:
+            seen += count
+            if seen > rank:
+                break
+        if not value:
+            return decimal.Decimal()
+        value = decimal.Decimal(repr(value))
+        return max(stats['min'], min(stats['max'], value))
+
+    rank = (q * (stats['count'] - 1))
+    lower = math.floor(rank)
+    value = value_at(lower)
+    if rank == lower:
+        return value
+    fraction = decimal.Decimal(repr(rank - lower))
+    return (value + ((value_at(lower + 1) - value) * fraction))
+
+def stats_summary(stats, quantiles = (0.9, 0.99,)):
+    """Reduce an accumulator to a dict of plain figures, eg to be displayed or
+    sent to another process.
+
+    Estimates of the given quantiles are stored in a dict keyed by the quantile.
+    """
+    if not stats['count']:
+        return {
+            'count': 0,
+            'sum': stats['sum'],
+            'min': None,
+            'max': None,
+            'mean': None,
+            'median': None,
+            'quantiles': { q: None for q in quantiles },
+        }
+    return {
+        'count': stats['count'],
+        'sum': stats['sum'],
+        'min': stats['min'],
+        'max': stats['max'],
+        'mean': stats_mean(stats),
+        'median': stats_median(stats),
+        'quantiles': { q: stats_quantile(stats, q) for q in quantiles },
+    }
@@ -1,5 +1,6 @@
 import os
 import re
+import sys
 
 
 class Screen:
@@ -7,7 +8,23 @@ class Screen:
 
     @staticmethod
     def get_tty_width():
-        width = int(os.popen('stty size', 'r').read().split()[1])
+        # The width may be forced with the COLUMNS environment variable.
+        # Otherwise, the terminal is asked directly and if there is no
+        # terminal (eg, the output is redirected to a file) a classic width of
+        # 80 columns is used.
+        width = None
+        try:
+            width = int(os.environ.get('COLUMNS', ''))
+        except ValueError:
+            pass
+        for stream in (sys.stdout, sys.stdin,):
+            if width:
+                break
+            try:
+                width = os.get_terminal_size(stream.fileno()).columns
+            except (AttributeError, OSError, ValueError):
+                pass
+        width = (width or 80)
         if (width % 2) == 1:
             width -= 1
         return width
@@ -16,30 +33,38 @@ class Screen:
     def strip_ansi(s):
         return Screen.ANSI_CODE.sub('', s)
 
+    @staticmethod
+    def visible_width(s):
+        # Most text is not colorised at all, and does not need to go through the
+        # regular expression.
+        if '\x1b' not in s:
+            return len(s)
+        return len(Screen.strip_ansi(s))
+
+    # Text is kept in a list of cells for each column. A cell is a pair of the
+    # text and its visible width (ie, without ANSI escape codes), which is known
+    # when the text is printed and so the layout never has to inspect the text
+    # again. Every column is as long as the number of lines printed to it.
     def __init__(self, width, columns):
         self._width = width
         self._columns = columns
         self.reset()
 
     def clear_buffer(self):
-        self._buffer = []
-        self._column_line = {}
-        for i in range(self._columns):
-            self._column_line[i] = 0
+        self._cells = [[] for _ in range(self._columns)]
+        self._lines = 0
 
     def new_line(self):
-        self._buffer.append([])
-        for _ in range(self._columns):
-            self._buffer[-1].append('')
+        self._lines += 1
 
     def reset(self):
         self.clear_buffer()
         self.new_line()
 
     def max_line(self):
-        return max(self._column_line.values())
+        return (self._lines - 1)
 
-    def print(self, column, text, line = None):
+    def print(self, column, text, line = None, width = None):
         if column >= self._columns:
             raise Exception('column {} out of range ({})'.format(
                 column,
@@ -48,34 +73,62 @@ class Screen:
 
         if line is not None:
             raise Exception('FIXME')
-        else:
-            line = self._column_line[column]
-        self._buffer[line].pop(column)
-        self._buffer[line].insert(column, text)
-        self._column_line[column] += 1
-        if len(self._buffer) <= self.max_line():
+
+        # The last column is not padded, so width of its text is not needed.
+        if width is None and column < (self._columns - 1):
+            width = Screen.visible_width(text)
+
+        cells = self._cells[column]
+        cells.append((text, width,))
+        if len(cells) >= self._lines:
             self.new_line()
 
     def fill(self):
         n = self.max_line()
-        for each in self._column_line:
-            self._column_line[each] = n
+        for cells in self._cells:
+            cells.extend([('', 0,)] * (n - len(cells)))
 
     def empty_line(self):
         self.fill()
+        for cells in self._cells:
+            cells.append(('', 0,))
         self.new_line()
-        n = self.max_line() + 1
-        for each in self._column_line:
-            self._column_line[each] = n
 
     def str(self):
-        output = []
         column_width = (self._width // self._columns)
-        for buf_line in self._buffer:
-            line = ''
-            for buf_column in buf_line[:-1]:
-                padding = (column_width - len(Screen.strip_ansi(buf_column))) * ' '
-                line += (buf_column) + padding
-            line += buf_line[-1]
-            output.append(line)
+        padded = self._cells[:-1]
+        last = self._cells[-1]
+        output = []
+        for i in range(self._lines):
+            parts = []
+            for cells in padded:
+                text, width = (cells[i] if i < len(cells) else ('', 0,))
+                parts.append(text)
+                parts.append(' ' * (column_width - width))
+            if i < len(last):
+                parts.append(last[i][0])
+            output.append(''.join(parts))
         return '\n'.join(output)
+
+
+class Recording:
+    """Record lines printed by a report, to display them on a screen later.
+
+    A recording stands in for a screen when a report is computed in a place
+    where it cannot be displayed directly (eg, in another process), and it
+    only has one column.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def print(self, column, text, line = None, width = None):
+        if line is not None:
+            raise Exception('FIXME')
+        self.lines.append(text)
+
+    @staticmethod
+    def replay(lines, to_out):
+        screen, column = to_out
+        for each in lines:
+            screen.print(column, each)
@@ -0,0 +1,218 @@
+import bisect
+import datetime
+import decimal
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Valuation of positions held in equity accounts over a series of dates.
+#
+# The input are the price and position histories recorded in the currency
+# basket by calculate_balances() (see ledger.prices). The output are matrices
+# with one row per date and one column per position (ie, a pair of an equity
+# account and a company).
+#
+# If NumPy is available the matrices are computed using cumulative sums of
+# position deltas and element-wise (broadcast) operations. Otherwise, a pure
+# Python implementation is used. Both use Decimal values (NumPy arrays have the
+# object dtype) so the results are exactly the same as figures displayed by the
+# equity report.
+
+
+def month_ends(begin, end):
+    """Produce the last minute of every month between begin and end.
+    """
+    dates = []
+    year, month = begin.year, begin.month
+    while True:
+        if month == 12:
+            first_of_next = datetime.datetime(year + 1, 1, 1)
+        else:
+            first_of_next = datetime.datetime(year, month + 1, 1)
+        last = first_of_next - datetime.timedelta(minutes = 1)
+        if last.date() > end.date():
+            break
+        dates.append(last)
+        year, month = first_of_next.year, first_of_next.month
+    return dates
+
+def position_deltas(series):
+    """Turn a history of position states into a list of changes.
+    """
+    deltas = []
+    prev = {
+        'shares': decimal.Decimal(),
+        'paid': decimal.Decimal(),
+        'dividends': decimal.Decimal(),
+    }
+    for i, timestamp in enumerate(series['timestamps']):
+        this = {
+            'shares': series['shares'][i],
+            'paid': series['paid'][i],
+            'dividends': series['dividends'][i],
+        }
+        deltas.append((timestamp, {
+            k: (this[k] - prev[k])
+            for k in this
+        }))
+        prev = this
+    return deltas
+
+def value_portfolio(currency_basket, dates):
+    """Value all positions at each of the given dates.
+
+    Returns a dict with the list of dates, the list of columns (pairs of account
+    and company names), and matrices indexed [date][column] of: the number of
+    shares held, prices, worth, amount paid, dividends received, nominal and
+    percent gain, and nominal and percent total return. Percentages are zero
+    where no shares are held.
+    """
+    columns = sorted(currency_basket['positions'].keys())
+    deltas = {
+        each: position_deltas(currency_basket['positions'][each])
+        for each in columns
+    }
+    if numpy is not None:
+        return value_portfolio_numpy(currency_basket, dates, columns, deltas)
+    return value_portfolio_python(currency_basket, dates, columns, deltas)
+
+def value_portfolio_numpy(currency_basket, dates, columns, deltas):
+    n, m = len(dates), len(columns)
+    dates_array = numpy.array(dates, dtype = 'datetime64[m]')
+
+    def zeros():
+        return numpy.full((n, m), decimal.Decimal(), dtype = object)
+
+    # Deltas are placed at the first date at, or after, the change. A
+    # cumulative sum of them gives the state of each position at each date.
+    shares = zeros()
+    paid = zeros()
+    dividends = zeros()
+    for j, column in enumerate(columns):
+        timestamps = numpy.array(
+            [each[0] for each in deltas[column]],
+            dtype = 'datetime64[m]',
+        )
+        rows = numpy.searchsorted(dates_array, timestamps, side = 'left')
+        for row, (_, delta) in zip(rows, deltas[column]):
+            if row >= n:
+                continue
+            shares[row, j] += delta['shares']
+            paid[row, j] += delta['paid']
+            dividends[row, j] += delta['dividends']
+    shares = numpy.cumsum(shares, axis = 0)
+    paid = numpy.cumsum(paid, axis = 0)
+    dividends = numpy.cumsum(dividends, axis = 0)
+
+    # Prices are looked up by bisection of each position's price history.
+    prices = zeros()
+    for j, column in enumerate(columns):
+        series = currency_basket['prices'].get(column)
+        if series is None:
+            continue
+        timestamps = numpy.array(series['timestamps'], dtype = 'datetime64[m]')
+        indexes = numpy.searchsorted(timestamps, dates_array, side = 'right') - 1
+        known = (indexes >= 0)
+        values = numpy.array(series['prices'] + [decimal.Decimal()],
+            dtype = object)
+        prices[:, j] = numpy.where(known, values[indexes], decimal.Decimal())
+
+    held = (shares != 0)
+    has_paid = (paid != 0)
+    divisor = numpy.where(has_paid, paid, decimal.Decimal(1))
+
+    worth = (shares * prices)
+    gain_nominal = (worth - paid)
+    tr_nominal = (worth - paid + dividends)
+    gain_percent = numpy.where(held & has_paid,
+        ((worth / divisor * 100) - 100), decimal.Decimal())
+    tr_percent = numpy.where(held & has_paid,
+        ((tr_nominal / divisor) * 100), decimal.Decimal())
+
+    return {
+        'dates': list(dates),
+        'columns': columns,
+        'shares': shares,
+        'prices': prices,
+        'worth': worth,
+        'paid': paid,
+        'dividends': dividends,
+        'gain_nominal': gain_nominal,
+        'gain_percent': gain_percent,
+        'tr_nominal': tr_nominal,
+        'tr_percent': tr_percent,
+    }
+
+def value_portfolio_python(currency_basket, dates, columns, deltas):
+    result = {
+        'dates': list(dates),
+        'columns': columns,
+        'shares': [],
+        'prices': [],
+        'worth': [],
+        'paid': [],
+        'dividends': [],
+        'gain_nominal': [],
+        'gain_percent': [],
+        'tr_nominal': [],
+        'tr_percent': [],
+    }
+
+    state = {
+        each: {
+            'shares': decimal.Decimal(),
+            'paid': decimal.Decimal(),
+            'dividends': decimal.Decimal(),
+        }
+        for each in columns
+    }
+    next_delta = { each: 0 for each in columns }
+    for date in dates:
+        rows = { k: [] for k in result if k not in ('dates', 'columns',) }
+        for column in columns:
+            # Apply deltas up to, and including, the date.
+            column_deltas = deltas[column]
+            while next_delta[column] < len(column_deltas):
+                timestamp, delta = column_deltas[next_delta[column]]
+                if timestamp > date:
+                    break
+                for k in state[column]:
+                    state[column][k] += delta[k]
+                next_delta[column] += 1
+
+            shares = state[column]['shares']
+            paid = state[column]['paid']
+            dividends = state[column]['dividends']
+
+            price = decimal.Decimal()
+            series = currency_basket['prices'].get(column)
+            if series is not None:
+                i = bisect.bisect_right(series['timestamps'], date) - 1
+                if i >= 0:
+                    price = series['prices'][i]
+
+            worth = (shares * price)
+            gain_nominal = (worth - paid)
+            tr_nominal = (worth - paid + dividends)
+            gain_percent = decimal.Decimal()
+            tr_percent = decimal.Decimal()
+            if shares and paid:
+                gain_percent = ((worth / paid * 100) - 100)
+                tr_percent = ((tr_nominal / paid) * 100)
+
+            rows['shares'].append(shares)
+            rows['prices'].append(price)
+            rows['worth'].append(worth)
+            rows['paid'].append(paid)
+            rows['dividends'].append(dividends)
+            rows['gain_nominal'].append(gain_nominal)
+            rows['gain_percent'].append(gain_percent)
+            rows['tr_nominal'].append(tr_nominal)
+            rows['tr_percent'].append(tr_percent)
+        for k, row in rows.items():
+            result[k].append(row)
+
+    return result
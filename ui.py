@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import argparse
 import datetime
 import decimal
 import os
@@ -30,33 +31,621 @@ def to_impl(stream, fmt, *args, **kwargs):
 to_stdout = lambda fmt, *args, **kwargs: to_impl(sys.stdout, fmt, *args, **kwargs)
 to_stderr = lambda fmt, *args, **kwargs: to_impl(sys.stderr, fmt, *args, **kwargs)
 
-def main(args):
-    to_stdout("Maelkum's ledger {} ({})".format(
-        ledger.__version__,
-        ledger.__commit__,
+def parse_timestamp(s):
+    # A bare date means "at the end of that day" as that is what people usually
+    # mean when they ask about the state of their finances on a given day.
+    try:
+        return datetime.datetime.strptime(s, ledger.constants.TIMESTAMP_FORMAT)
+    except ValueError:
+        pass
+    try:
+        day = datetime.datetime.strptime(s, ledger.constants.DAYSTAMP_FORMAT)
+        return day.replace(hour = 23, minute = 59)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid timestamp: {}'.format(s))
+
+def parse_day_begin(s):
+    # A bare date used as the beginning of a period means "from the start of
+    # that day".
+    try:
+        return datetime.datetime.strptime(s, ledger.constants.TIMESTAMP_FORMAT)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.strptime(s, ledger.constants.DAYSTAMP_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid timestamp: {}'.format(s))
+
+def parse_windows(s):
+    try:
+        return ledger.rolling.parse_windows(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid windows: {}'.format(s))
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog = 'maelkum-ledger',
+        description = "Maelkum's ledger",
+    )
+    parser.add_argument('book',
+        help = 'path to the main file of the book')
+    parser.add_argument('--as-of',
+        metavar = 'TIMESTAMP',
+        type = parse_timestamp,
+        default = None,
+        help = 'report balances as of YYYY-MM-DD or YYYY-MM-DDTHH:MM')
+    parser.add_argument('--top',
+        metavar = 'N',
+        type = int,
+        default = None,
+        help = 'number of expense sinks and revenue faucets to display')
+    parser.add_argument('--jobs', '-j',
+        metavar = 'N',
+        type = int,
+        default = 1,
+        help = 'number of processes computing reports (default: 1)')
+    parser.add_argument('--no-cache',
+        action = 'store_true',
+        help = 'do not read nor write the cache of processed books')
+    parser.add_argument('--format',
+        choices = ('text',) + ledger.output.FORMATS,
+        default = 'text',
+        help = 'write reports as text (default), JSON Lines, or CSV records')
+    parser.add_argument('--net-worth',
+        action = 'store_true',
+        help = 'write daily balances of all accounts as CSV to standard output')
+    parser.add_argument('--timings',
+        action = 'store_true',
+        help = 'write time taken by each stage of processing to standard error')
+    parser.add_argument('--profile',
+        metavar = 'FILE',
+        default = None,
+        help = 'write a cProfile dump to FILE, and peak memory of each stage'
+            ' to standard error')
+    parser.add_argument('--trace',
+        metavar = 'FILE',
+        default = None,
+        help = 'write a timeline of stages of processing to FILE, in Chrome'
+            ' trace-event format')
+
+    # Without a command, the overview (ie, all reports) is displayed.
+    commands = parser.add_subparsers(
+        dest = 'command',
+        metavar = 'COMMAND',
+        help = 'report to display, instead of the overview (options of the'
+            ' ledger must come before the command)',
+    )
+    commands.add_parser('overview',
+        help = 'display all reports (default)')
+    commands.add_parser('today',
+        help = 'display expenses and revenues of today')
+    commands.add_parser('month',
+        help = 'display expenses and revenues of this and last month')
+    commands.add_parser('week',
+        help = 'display expenses and revenues of this and last week')
+    commands.add_parser('quarter',
+        help = 'display expenses and revenues of this and last quarter')
+    commands.add_parser('year',
+        help = 'display expenses and revenues of this and last year')
+    commands.add_parser('balances',
+        help = 'display balances of accounts')
+    commands.add_parser('equity',
+        help = 'display equity accounts')
+    period = commands.add_parser('period',
+        help = 'display expenses and revenues of a period')
+    period.add_argument('period_spec',
+        metavar = 'PERIOD',
+        nargs = '?',
+        default = None,
+        help = 'period to display: YYYY, YYYY-MM, YYYY-MM-DD, YYYY-Qn,'
+            ' YYYY-Www, this-week, last-week, this-quarter, last-quarter, or'
+            ' last-N-days (instead of --from and --to)')
+    period.add_argument('--last',
+        dest = 'period_last',
+        metavar = 'N',
+        type = int,
+        default = None,
+        help = 'display the last N days, including today')
+    period.add_argument('--from',
+        dest = 'period_from',
+        metavar = 'TIMESTAMP',
+        type = parse_day_begin,
+        default = None,
+        help = 'beginning of the period, YYYY-MM-DD or YYYY-MM-DDTHH:MM'
+            ' (default: the first transaction)')
+    period.add_argument('--to',
+        dest = 'period_to',
+        metavar = 'TIMESTAMP',
+        type = parse_timestamp,
+        default = None,
+        help = 'end of the period, YYYY-MM-DD or YYYY-MM-DDTHH:MM'
+            ' (default: now)')
+    rolling = commands.add_parser('rolling',
+        help = 'display spending, earnings, and savings rates of the last days'
+            ' as of every day of a period')
+    rolling.add_argument('rolling_spec',
+        metavar = 'PERIOD',
+        nargs = '?',
+        default = None,
+        help = 'period to display, as for the period command (default: this'
+            ' year)')
+    rolling.add_argument('--windows',
+        dest = 'rolling_windows',
+        metavar = 'DAYS',
+        type = parse_windows,
+        default = ledger.rolling.DEFAULT_WINDOWS,
+        help = 'comma-separated lengths of windows, in days (default: {})'
+            .format(','.join(map(str, ledger.rolling.DEFAULT_WINDOWS))))
+    category = commands.add_parser('category',
+        help = 'display expenses and revenues of transactions with a tag, or of'
+            ' a sink or faucet, in each month')
+    category.add_argument('category_spec',
+        metavar = 'PERIOD',
+        nargs = '?',
+        default = None,
+        help = 'period to display, as for the period command (default: all'
+            ' time)')
+    category_kind = category.add_mutually_exclusive_group(required = True)
+    category_kind.add_argument('--tag',
+        metavar = 'TAG',
+        default = None,
+        help = 'tag of transactions, either a plain word or "key: value" (a'
+            ' bare key matches any value)')
+    category_kind.add_argument('--sink',
+        metavar = 'NAME',
+        default = None,
+        help = 'sink of expenses')
+    category_kind.add_argument('--faucet',
+        metavar = 'NAME',
+        default = None,
+        help = 'faucet of revenues')
+    args = parser.parse_args(args)
+
+    for spec in ('rolling_spec', 'category_spec',):
+        if getattr(args, spec, None) is not None:
+            try:
+                ledger.period.parse(getattr(args, spec))
+            except ValueError as e:
+                parser.error(str(e))
+    if args.command == 'period':
+        given = [
+            each
+            for each in (args.period_spec, args.period_last,)
+            if each is not None
+        ]
+        if len(given) > 1 or (given and (args.period_from or args.period_to)):
+            parser.error('a period must be given either as PERIOD, with'
+                ' --last, or with --from and --to')
+        if args.period_last is not None and args.period_last < 1:
+            parser.error('--last must be at least 1')
+        if args.period_spec is not None:
+            try:
+                ledger.period.parse(args.period_spec)
+            except ValueError as e:
+                parser.error(str(e))
+    if args.net_worth and args.format not in ('text', 'csv',):
+        parser.error('--net-worth is only written as CSV')
+    return args
+
+
+# Reports, in the order in which they are computed. Reports of totals are
+# written as a single report in structured output.
+REPORTS = (
+    'today',
+    'yesterday',
+    'this_week',
+    'last_week',
+    'this_month',
+    'last_month',
+    'this_quarter',
+    'last_quarter',
+    'this_year',
+    'last_year',
+    'all_time',
+    'period',
+    'rolling',
+    'category',
+    'totals',
+    'reserves',
+    'balances',
+    'equity',
+)
+TOTALS_REPORTS = (
+    'reserves',
+    'balances',
+    'equity',
+)
+
+# Layouts of reports displayed by each command. A layout is a list of blocks,
+# each block is a list of columns, and each column is a list of reports (None
+# for an empty line).
+LAYOUTS = {
+    'overview': [
+        [['today'], ['yesterday']],
+        [['this_month'], ['last_month']],
+        [['this_year'], ['last_year']],
+        [['reserves', 'balances', None, 'equity'], ['all_time']],
+    ],
+    'today': [
+        [['today']],
+    ],
+    'week': [
+        [['this_week'], ['last_week']],
+    ],
+    'month': [
+        [['this_month'], ['last_month']],
+    ],
+    'quarter': [
+        [['this_quarter'], ['last_quarter']],
+    ],
+    'year': [
+        [['this_year'], ['last_year']],
+    ],
+    'balances': [
+        [['reserves', 'balances']],
+    ],
+    'equity': [
+        [['equity']],
+    ],
+    'period': [
+        [['period']],
+    ],
+    'rolling': [
+        [['rolling']],
+    ],
+    'category': [
+        [['category']],
+    ],
+}
+
+def span_of_period(args, facts):
+    """Resolve the period given to the period command to its title and span.
+    """
+    if args.period_spec is not None:
+        return ledger.period.parse(args.period_spec)
+    if args.period_last is not None:
+        return (
+            'Last {} days'.format(args.period_last),
+            ledger.period.trailing_days(args.period_last),
+        )
+
+    period_begin = args.period_from
+    period_end = args.period_to
+    if period_begin is None:
+        period_begin = facts['first']
+    if period_end is None:
+        period_end = datetime.datetime.now()
+    return ('Period', (period_begin, period_end,),)
+
+def needs_of_span(period_span):
+    # Short periods are aggregated straight from their slices of the book, and
+    # only long ones are worth building rollups for.
+    scheduler = ledger.scheduler
+    period_begin, period_end = period_span
+    if (period_end - period_begin).days > 31:
+        return (scheduler.NEEDS_ROLLUP, scheduler.NEEDS_RATES,)
+    return (scheduler.NEEDS_RATES,)
+
+def new_report_job(name, facts, args):
+    """Describe the computation of a report, and what it needs.
+    """
+    reporter = ledger.reporter
+    scheduler = ledger.scheduler
+    top = args.top
+
+    day_reports = {
+        'today': ('Today', reporter.span_today,),
+        'yesterday': ('Yesterday', reporter.span_yesterday,),
+    }
+    if name in day_reports:
+        title, span = day_reports[name]
+        period_day, _ = span()
+        return scheduler.new_job(name, scheduler.compute_day,
+            (title, period_day,), reporter.render_day_impl,
+            period = scheduler.period_of_day(period_day),
+            needs = (scheduler.NEEDS_RATES,))
+
+    period = ledger.period
+    period_reports = {
+        'this_week': ('This week', period.this_week, None,),
+        'last_week': ('Last week', period.last_week, None,),
+        'this_month': ('This month', reporter.span_this_month, None,),
+        'last_month': ('Last month', reporter.span_last_month, None,),
+        'this_quarter': ('This quarter', period.this_quarter, True,),
+        'last_quarter': ('Last quarter', period.last_quarter, True,),
+        'this_year': ('This year', reporter.span_this_year, True,),
+        'last_year': ('Last year', reporter.span_last_year, True,),
+        'all_time': ('All time',
+            lambda: reporter.span_all_time(facts['first']), True,),
+    }
+    if name == 'period':
+        title, period_span = span_of_period(args, facts)
+        # Spending per month is only interesting for periods longer than a
+        # month.
+        period_begin, period_end = period_span
+        monthly_breakdown = ((period_end - period_begin).days > 31) or None
+    elif name in period_reports:
+        title, span, monthly_breakdown = period_reports[name]
+        period_span = span()
+    if name == 'period' or name in period_reports:
+        # Budgets limit spending in a month, and are displayed with the report
+        # of this month.
+        budgeted = (name == 'this_month')
+        return scheduler.new_job(name, scheduler.compute_period,
+            (title, period_span, monthly_breakdown, top, budgeted,),
+            reporter.render_period_impl,
+            period = scheduler.period_of_span(
+                period_span,
+                monthly_breakdown,
+                top,
+            ),
+            needs = needs_of_span(period_span))
+
+    if name == 'rolling':
+        title, period_span = ('Rolling windows', reporter.span_this_year(),)
+        if args.rolling_spec is not None:
+            title, period_span = ledger.period.parse(args.rolling_spec)
+            title = 'Rolling windows, {}'.format(title.lower())
+        windows = args.rolling_windows
+        period_begin, period_end = period_span
+        return scheduler.new_job(name, scheduler.compute_rolling,
+            (title, period_span, windows,),
+            reporter.render_rolling_impl,
+            period = (period_begin.date(), period_end.date(), windows,),
+            needs = (scheduler.NEEDS_ROLLUP, scheduler.NEEDS_RATES,))
+
+    if name == 'category':
+        return new_category_job(name, facts, args)
+
+    # Totals are calculated from balances as of now, so the number of items in
+    # effect now identifies their period.
+    period_totals = facts['in_effect']
+    if name == 'totals':
+        return scheduler.new_job(name, ledger.output.compute_totals,
+            (), None,
+            period = period_totals,
+            needs = (scheduler.NEEDS_EQUITY,))
+
+    # Balances of all accounts include equity accounts, which must be valued
+    # first. Reserves are only made of assets and liabilities.
+    recorded_reports = {
+        'reserves': (reporter.report_total_reserves, scheduler.NEEDS_BALANCES,),
+        'balances': (reporter.report_total_balances, scheduler.NEEDS_EQUITY,),
+        'equity': (reporter.report_total_equity, scheduler.NEEDS_EQUITY,),
+    }
+    report, needs = recorded_reports[name]
+    return scheduler.new_job(name, scheduler.compute_recorded,
+        (report,), scheduler.render_recorded,
+        period = period_totals,
+        needs = (needs,))
+
+def new_category_job(name, facts, args):
+    scheduler = ledger.scheduler
+    index = ledger.index
+    if args.tag is not None:
+        key, value = index.split_tag(args.tag)
+        category = (index.KIND_TAG, key, value,)
+        title = 'Tag {}'.format(args.tag.strip())
+    elif args.sink is not None:
+        category = (index.KIND_SINK, args.sink, None,)
+        title = 'Sink {}'.format(args.sink)
+    else:
+        category = (index.KIND_FAUCET, args.faucet, None,)
+        title = 'Faucet {}'.format(args.faucet)
+
+    period_span = ledger.reporter.span_all_time(facts['first'])
+    if args.category_spec is not None:
+        period_title, period_span = ledger.period.parse(args.category_spec)
+        title = '{}, {}'.format(title, period_title.lower())
+    period_begin, period_end = period_span
+    return scheduler.new_job(name, scheduler.compute_category,
+        (title, period_span, category,),
+        ledger.reporter.render_category_impl,
+        period = (period_begin.date(), period_end.date(), category,),
+        needs = (scheduler.NEEDS_RATES,))
+
+def report_as_of(book_ir, default_currency, timestamp, fmt):
+    # The book is replayed from its beginning up to the timestamp (see
+    # ledger.history).
+    with ledger.timing.stage('as of'):
+        state = ledger.history.replay_as_of(book_ir, default_currency,
+            timestamp)
+
+    accounts = state['accounts']
+    book = (book_ir, state['currency_basket'],)
+
+    # Structured output has the same records of totals, balances, and equity
+    # positions as the overview, but as of the timestamp.
+    if fmt != 'text':
+        snapshot = ledger.scheduler.new_snapshot(book, accounts,
+            default_currency)
+        ledger.output.write(fmt, ledger.output.compute_totals(snapshot),
+            sys.stdout)
+        return
+
+    Screen = ledger.util.screen.Screen
+    screen = Screen(Screen.get_tty_width(), 1)
+
+    screen.print(0, 'As of {}'.format(
+        ledger.util.colors.colorise(
+            ledger.util.colors.COLOR_DATETIME,
+            timestamp.strftime(ledger.constants.TIMESTAMP_FORMAT),
+        ),
     ))
+    ledger.reporter.report_total_reserves((screen, 0), accounts, book, default_currency)
+    ledger.reporter.report_total_balances((screen, 0), accounts, book, default_currency)
+    screen.print(0, '')
+    ledger.reporter.report_total_equity((screen, 0), accounts, book, default_currency)
+    to_stdout(screen.str())
+
+def load_book(book_main):
+    stage = ledger.timing.stage
 
-    book_main = args[0]
-    book_lines = ledger.loader.load(book_main)
+    with stage('load'):
+        book_lines = ledger.loader.load(book_main)
+        ledger.timing.count('lines', len(book_lines))
     # to_stdout('\n'.join(map(repr, book_lines)))
 
-    book_ir = ledger.parser.parse(book_lines)
+    with stage('fingerprint'):
+        fingerprint = ledger.cache.fingerprint(book_main, book_lines)
+    return (book_lines, fingerprint,)
+
+def parse_book(book_lines):
+    stage = ledger.timing.stage
+
+    with stage('parse'):
+        index = ledger.index.new_index()
+        book_ir = ledger.parser.parse(book_lines, index = index)
+        ledger.timing.count('records', len(book_ir))
     # to_stdout('{} item(s):'.format(len(book_ir)))
     # to_stdout('\n'.join(map(repr, book_ir)))
 
-    def sorting_key(item):
-        if isinstance(item, ledger.ir.Transaction_record):
-            return item.effective_date()
-        return item.timestamp
-    book_ir = sorted(book_ir, key = sorting_key)
+    with stage('sort'):
+        book_ir = sorted(book_ir, key = ledger.book.sorting_key)
+        ledger.index.finish(index, book_ir)
     # to_stdout('chronologically sorted item(s):'.format(len(book_ir)))
     # to_stdout('\n'.join(map(lambda x: '{} {}'.format(x.timestamp, repr(x)), book_ir)))
 
+    return (book_ir, index,)
+
+def new_book_facts(book_ir, default_currency):
+    """Find facts about the book which keys of reports depend on.
+    """
+    first = ledger.reporter.first_effective_date(book_ir)
+
+    # Totals are calculated from the items in effect now. The same items stay in
+    # effect until the next one takes effect.
+    in_effect = ledger.book.count_items_until(book_ir, datetime.datetime.now())
+    since = None
+    if in_effect:
+        since = ledger.book.sorting_key(book_ir[in_effect - 1])
+    until = None
+    if in_effect < len(book_ir):
+        until = ledger.book.sorting_key(book_ir[in_effect])
+    return {
+        'default_currency': default_currency,
+        'first': first,
+        'in_effect': in_effect,
+        'in_effect_span': (since, until,),
+    }
+
+def facts_hold(facts):
+    # Facts found at another time still hold if the same items are in effect.
+    now = datetime.datetime.now()
+    since, until = facts['in_effect_span']
+    return ((since is None or since <= now) and (until is None or now < until))
+
+def new_report_jobs(args, facts, structured):
+    """Describe reports to display, and their layout.
+    """
+    layout = LAYOUTS[args.command or 'overview']
+    selected = set(
+        name
+        for block in layout
+        for column in block
+        for name in column
+        if name is not None
+    )
+    if structured and (selected & set(TOTALS_REPORTS)):
+        # Totals, balances, and equity are written as one set of records.
+        selected = (selected - set(TOTALS_REPORTS)) | {'totals'}
+    jobs = [
+        new_report_job(name, facts, args)
+        for name in REPORTS
+        if name in selected
+    ]
+    return (layout, jobs,)
+
+def report_key(job, facts):
+    return ledger.cache.report_key(
+        facts['default_currency'],
+        job['name'],
+        job['period'],
+        colors = ledger.util.colors.ENABLED,
+    )
+
+def cached_results(jobs, facts, reports_entry):
+    if reports_entry is None:
+        return {}
+    cached_reports = reports_entry['reports']
+    return {
+        job['name']: cached_reports[report_key(job, facts)]
+        for job in jobs
+        if report_key(job, facts) in cached_reports
+    }
+
+def count_postings(book_ir, until):
+    return sum(
+        (len(each.ins) + len(each.outs))
+        for each in book_ir[:until]
+        if isinstance(each, ledger.ir.Transaction_record)
+    )
+
+def main(args):
+    args = parse_args(args)
+
+    # Instrumentation is only enabled when it is asked for, as tracing memory
+    # allocations makes the ledger much slower.
+    profiler = None
+    if args.timings or args.profile or args.trace:
+        ledger.timing.start(trace_memory = bool(args.profile))
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if ledger.timing.enabled():
+            root = ledger.timing.stop()
+            if args.trace:
+                ledger.trace.write(root, args.trace)
+            if args.timings or args.profile:
+                ledger.timing.summary(root, sys.stderr)
+
+def run(args):
+    stage = ledger.timing.stage
+
+    # Machine-readable output must not be polluted by the banner.
+    structured = (args.format != 'text')
+    if not (args.net_worth or structured):
+        to_stdout("Maelkum's ledger {} ({})".format(
+            ledger.__version__,
+            ledger.__commit__,
+        ))
+
+    use_cache = not args.no_cache
+    book_lines, fingerprint = load_book(args.book)
+
+    # Results of reports computed for the same book, and the same periods, by a
+    # previous invocation are reused. Facts about the book which tell what the
+    # reports are were cached with them, so when all results can be reused the
+    # book is not even parsed.
+    reports_entry = None
+    if use_cache and args.as_of is None and not args.net_worth:
+        with stage('read report cache'):
+            reports_entry = ledger.cache.load_reports(fingerprint)
+    if reports_entry is not None and facts_hold(reports_entry['facts']):
+        facts = reports_entry['facts']
+        layout, jobs = new_report_jobs(args, facts, structured)
+        cached = cached_results(jobs, facts, reports_entry)
+        if len(cached) == len(jobs):
+            with stage('compute reports', reports = len(jobs),
+                    cached = len(cached)):
+                results = ledger.scheduler.run(None, jobs, cached = cached)
+            render_reports(args, layout, jobs, results)
+            return
+
+    book_ir, index = parse_book(book_lines)
+
     ####
 
     default_currency = 'EUR'
-    accounts = { 'asset': {}, 'liability': {}, 'equity': {}, }
-    txs = []
+    budgets = []
+    accounts = ledger.book.new_accounts()
 
     # First, process configuration to see if there is anything the ledger should
     # be aware of - default currency, budger levels, etc.
@@ -64,50 +653,195 @@ def main(args):
         if type(each) is ledger.ir.Configuration_line:
             if each.key == 'default-currency':
                 default_currency = str(each.value)
-            elif each.key == 'budget': # FIXME TODO
-                pass
+            elif each.key == 'budget':
+                try:
+                    budgets.append(ledger.budget.parse(str(each.value)))
+                except ValueError as e:
+                    to_stderr('{}: {}: {}',
+                        ledger.util.colors.colorise(
+                            'white',
+                            each.to_location(),
+                        ),
+                        ledger.util.colors.colorise(
+                            'red',
+                            'error',
+                        ),
+                        e,
+                    )
+                    exit(1)
             else:
                 raise
 
-    # Then, set up accounts to be able to track balances and verify that
-    # transactions refer to recognised accounts.
-    ledger.book.setup_accounts(accounts, book_ir)
-
-    # Then, process transactions (ie, revenues, expenses, dividends, transfers)
-    # to get an accurate picture of balances.
-    currency_basket = { 'rates': {}, 'txs': [], }
+    if args.as_of is not None:
+        report_as_of(book_ir, default_currency, args.as_of, args.format)
+        return
+    if args.net_worth:
+        series = ledger.timeseries.daily_net_worth(book_ir, default_currency)
+        ledger.timeseries.write_csv(series, sys.stdout)
+        return
 
+    currency_basket = ledger.book.new_currency_basket()
     book = (book_ir, currency_basket,)
 
-    ledger.book.calculate_balances(accounts, book, default_currency)
-    ledger.book.calculate_equity_values(accounts, book, default_currency)
+    # Then, describe reports to display. They are independent of each other
+    # and may be computed concurrently. Only the reports which were asked for
+    # are computed.
+    scheduler = ledger.scheduler
+    facts = new_book_facts(book_ir, default_currency)
+    layout, jobs = new_report_jobs(args, facts, structured)
+    cached = cached_results(jobs, facts, reports_entry)
 
-    Screen = ledger.util.screen.Screen
-    screen = Screen(Screen.get_tty_width(), 2)
+    # Only stages needed by reports which must be computed are run.
+    needs = scheduler.needs_of(
+        job
+        for job in jobs
+        if job['name'] not in cached
+    )
+    snapshot = None
+    store_rollup = False
+    if len(cached) < len(jobs):
+        # Then, set up accounts to be able to track balances and verify that
+        # transactions refer to recognised accounts.
+        if scheduler.NEEDS_BALANCES in needs:
+            with stage('setup accounts'):
+                ledger.book.setup_accounts(accounts, book_ir)
 
-    # Then, prepare and display a report.
+        # Rollups of transactions are only read from the cache, or built, when
+        # reports of long periods need them. Once there, they are used for
+        # reports of all periods.
+        if scheduler.NEEDS_ROLLUP in needs:
+            if use_cache:
+                with stage('read cache'):
+                    entry = ledger.cache.load(fingerprint)
+                if entry is not None:
+                    currency_basket['rollup'] = entry['rollup']
+            if currency_basket['rollup'] is None:
+                with stage('rollup'):
+                    currency_basket['rollup'] = ledger.rollup.build(book_ir)
+                store_rollup = use_cache
+        currency_basket['index'] = index
 
-    ledger.reporter.report_today((screen, 0), book, default_currency)
-    ledger.reporter.report_yesterday((screen, 1), book, default_currency)
-    to_stdout(screen.str())
-    screen.reset()
+        # Then, process transactions (ie, revenues, expenses, dividends,
+        # transfers) to get an accurate picture of balances. Reports of
+        # periods only need exchange rates to convert amounts.
+        if scheduler.NEEDS_BALANCES in needs:
+            period_totals = ledger.book.count_items_until(
+                book_ir,
+                datetime.datetime.now(),
+            )
+            with stage('calculate balances', records = period_totals):
+                if ledger.timing.enabled():
+                    ledger.timing.count(
+                        'postings',
+                        count_postings(book_ir, period_totals),
+                    )
+                ledger.book.calculate_balances(accounts, book, default_currency)
+        elif scheduler.NEEDS_RATES in needs:
+            with stage('calculate rates'):
+                ledger.book.calculate_rates(book)
+        if scheduler.NEEDS_EQUITY in needs:
+            with stage('calculate equity values'):
+                ledger.book.calculate_equity_values(
+                    accounts,
+                    book,
+                    default_currency,
+                )
 
-    ledger.reporter.report_this_month((screen, 0), book, default_currency)
-    ledger.reporter.report_last_month((screen, 1), book, default_currency)
-    to_stdout(screen.str())
-    screen.reset()
+        snapshot = scheduler.new_snapshot(
+            book,
+            accounts,
+            default_currency,
+            budgets = budgets,
+        )
 
-    ledger.reporter.report_this_year((screen, 0), book, default_currency)
-    ledger.reporter.report_last_year((screen, 1), book, default_currency)
-    to_stdout(screen.str())
-    screen.reset()
+    with stage('compute reports', reports = len(jobs), cached = len(cached)):
+        results = scheduler.run(
+            snapshot,
+            jobs,
+            workers = args.jobs,
+            cached = cached,
+        )
+        # Reports may have been computed in worker processes, so their times
+        # are taken from the scheduler.
+        for name, began, seconds, pid in scheduler.spans(results, 'compute'):
+            ledger.timing.record(name, seconds,
+                began = began,
+                pid = pid,
+                args = { 'report': name, 'phase': 'compute', },
+            )
+    if store_rollup:
+        with stage('write cache'):
+            ledger.cache.store(ledger.cache.new_entry(
+                fingerprint,
+                currency_basket['rollup'],
+            ))
+    if use_cache and len(cached) < len(jobs):
+        with stage('write report cache'):
+            ledger.cache.store_reports(fingerprint, facts, {
+                report_key(job, facts): results[job['name']]['result']
+                for job in jobs
+            })
+
+    render_reports(args, layout, jobs, results)
+
+def render_reports(args, layout, jobs, results):
+    scheduler = ledger.scheduler
+
+    # Display the reports. Structured output is written directly to the standard
+    # output, without going through a screen.
+    with ledger.timing.stage('render'):
+        structured = (args.format != 'text')
+        if structured:
+            def records():
+                for job in jobs:
+                    result = results[job['name']]['result']
+                    if job['name'] == 'totals':
+                        yield from result
+                    elif job['name'] == 'rolling':
+                        yield from ledger.output.rolling_records(
+                            job['name'],
+                            result,
+                        )
+                    elif job['name'] == 'category':
+                        yield from ledger.output.category_records(
+                            job['name'],
+                            result,
+                        )
+                    else:
+                        yield from ledger.output.period_records(
+                            job['name'],
+                            result,
+                        )
+            try:
+                ledger.output.write(args.format, records(), sys.stdout)
+                sys.stdout.flush()
+            except BrokenPipeError:
+                # The reader went away (eg, the output was piped to head).
+                # This is not an error, but Python would complain when
+                # flushing the standard output at exit.
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+            return
+
+        # Reports are laid out in blocks, each a row of columns. Every block
+        # is displayed on its own screen.
+        Screen = ledger.util.screen.Screen
+        width = Screen.get_tty_width()
+        for block in layout:
+            screen = Screen(width, len(block))
+            for column, names in enumerate(block):
+                for name in names:
+                    if name is None:
+                        screen.print(column, '')
+                    else:
+                        scheduler.render(results, name, (screen, column))
+            to_stdout(screen.str())
+
+        for name, began, seconds, _ in scheduler.spans(results, 'render'):
+            ledger.timing.record(name, seconds,
+                began = began,
+                args = { 'report': name, 'phase': 'render', },
+            )
 
-    ledger.reporter.report_all_time((screen, 1), book, default_currency)
-    ledger.reporter.report_total_reserves((screen, 0), accounts, book, default_currency)
-    ledger.reporter.report_total_balances((screen, 0), accounts, book, default_currency)
-    screen.print(0, '')
-    ledger.reporter.report_total_equity((screen, 0), accounts, book, default_currency)
-    to_stdout(screen.str())
-    screen.reset()
 
 main(sys.argv[1:])